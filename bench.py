@@ -0,0 +1,364 @@
+import json
+import random
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from config import EMBEDDING_MODEL, HIGHLIGHTS_DIR, RERANK_BATCH_SIZE, RERANKER_MODEL
+
+# Sample books the synthetic libraries are sized and worded on, wherever the bench is run from
+SAMPLE_DIR = Path(__file__).resolve().parent / HIGHLIGHTS_DIR
+
+
+# --- Reference implementations the text benchmark compares against ---
+def _legacy_clean_text(text):
+    if not text or not isinstance(text, str):
+        return ""
+    if "## Quotes" in text:
+        return text
+    text = re.sub(r"background-color:: \w+", "", text)
+    text = re.sub(r"==|[\*\_\[\]\(\)#-]", "", text)
+    text = re.sub(r'(\w) "(\w)', r'\1 "\2', text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def _legacy_extract_quotes(text):
+    cleaned = _legacy_clean_text(str(text))
+    if not cleaned:
+        return []
+    quotes = re.findall(r'"([^"]+)"', cleaned)
+    quotes += re.findall(r"•\s*(.+?)(?=\n|$)", cleaned)
+    valid_quotes = []
+    for q in quotes:
+        q = q.strip()
+        words = q.split()
+        if (
+            (6 <= len(words) <= 40)
+            and not q.lower().startswith(("chapter", "section", "note"))
+            and not q.endswith((":", "-", "..."))
+            and not any(word.isupper() for word in words[:3])
+        ):
+            valid_quotes.append(q.rstrip(",.;"))
+    return valid_quotes
+
+
+def _time_per_item(fn, items, repeat=5):
+    """Best-of-`repeat` wall time per item, in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(items), 1) * 1e6
+
+
+def sample_chunks(directory=SAMPLE_DIR):
+    from ingest import make_splitter
+    from utils import CleanTextLoader
+
+    docs = []
+    for path in sorted(Path(directory).glob("**/*.md")):
+        docs.extend(CleanTextLoader(str(path)).load())
+    return [c.page_content for c in make_splitter().split_documents(docs)]
+
+
+def bench_text_processing(directory=SAMPLE_DIR, repeat=5):
+    """Per-chunk cost of the query-time text work, before and after index-time analysis."""
+    from text_processing import analyze_chunk, chunk_analysis, clean_text
+
+    chunks = sample_chunks(directory)
+    metadata = {}
+    for c in chunks:
+        word_count, quotes = analyze_chunk(c)
+        metadata[c] = {"word_count": word_count, "quotes": json.dumps(quotes)}
+
+    def legacy_query_path(c):
+        return len(_legacy_clean_text(c).split()) > 10, _legacy_extract_quotes(c)
+
+    def current_query_path(c):
+        return chunk_analysis(c, metadata[c])
+
+    results = {
+        "chunks": len(chunks),
+        "clean_text_us": {
+            "before": _time_per_item(_legacy_clean_text, chunks, repeat),
+            "after": _time_per_item(clean_text, chunks, repeat),
+        },
+        "query_path_us": {
+            "before": _time_per_item(legacy_query_path, chunks, repeat),
+            "after": _time_per_item(current_query_path, chunks, repeat),
+        },
+    }
+
+    print(f"📏 Text processing over {len(chunks)} chunks (µs per chunk)")
+    for name in ("clean_text_us", "query_path_us"):
+        before, after = results[name]["before"], results[name]["after"]
+        print(f"  {name[:-3]:<12} before {before:8.1f}  after {after:8.1f}  ({before / after:.1f}x)")
+    return results
+
+
+# --- Synthetic libraries ---
+def _vocabulary(directory=SAMPLE_DIR):
+    words = re.findall(r"[A-Za-z']+", " ".join(sample_chunks(directory)))
+    return [w for w in words if len(w) > 2] or ["habit", "focus", "time", "life", "work"]
+
+
+def generate_library(target, scale, directory=SAMPLE_DIR, seed=0, quotes_per_book=30, books=None):
+    """Write `scale` times as many books as `directory` holds, in the same markdown format."""
+    rng = random.Random(seed)
+    vocab = _vocabulary(directory)
+    if books is None:
+        found = len(list(Path(directory).glob("**/*.md")))
+        if not found:
+            raise ValueError(f"No highlights in {directory} to size a synthetic library on")
+        books = found * scale
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+
+    for b in range(books):
+        lines = ["- ## Quotes"]
+        for _ in range(quotes_per_book):
+            words = rng.choices(vocab, k=rng.randint(8, 30))
+            sentence = " ".join(words)
+            lines.append(f'\t- "{sentence[0].upper()}{sentence[1:]}."')
+        (target / f"Book Synthetic {b:05d}.md").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return books, vocab
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+def bench_library(scale, queries=50, embedding_model=EMBEDDING_MODEL, reranker_model=RERANKER_MODEL, seed=0,
+                  mode="full"):
+    """Index a synthetic library of the given scale and time indexing, updates and queries.
+
+    In fast `mode` each query is also run untimed in full mode to measure
+    how many of the full-rerank results the fast path keeps.
+    """
+    import data
+    from database import create_database
+    from tracing import Trace
+
+    work = Path(tempfile.mkdtemp(prefix="insightminer-bench-"))
+    try:
+        highlights = work / "highlights"
+        persist = work / "chroma_db"
+        cache_dir = work / "embedding_cache"  # cold cache so indexing cost is real
+        books, vocab = generate_library(highlights, scale, seed=seed)
+        print(f"📚 Scale {scale}x: {books} synthetic books")
+
+        start = time.perf_counter()
+        stats = create_database(highlights, persist, embedding_model, cache_dir)
+        create_seconds = time.perf_counter() - start
+
+        engine = data.SearchEngine(persist, highlights, embedding_model, reranker_model, cache_dir)
+
+        extra = work / "extra"
+        generate_library(extra, 1, seed=seed + 1, books=1)
+        new_file = highlights / "Book Synthetic added.md"
+        shutil.move(next(extra.glob("*.md")), new_file)
+        start = time.perf_counter()
+        engine.add_documents_from_files([new_file])
+        add_seconds = time.perf_counter() - start
+
+        rng = random.Random(seed)
+        totals, stages, paths, overlaps, skipped, asked = [], {}, {}, [], 0, []
+        for _ in range(queries):
+            query = " ".join(rng.choices(vocab, k=rng.randint(2, 5)))
+            asked.append(query)
+            # Measure the uncached path every time
+            data.result_cache.clear()
+            data.semantic_cache.clear()
+            engine.reranker.cache.clear()
+            trace = Trace("search")
+            results, _ = data.search_database(query, engine=engine, trace=trace, mode=mode)
+            trace.finish()
+            totals.append(trace.total)
+            for name, seconds in trace.seconds().items():
+                stages.setdefault(name, []).append(seconds)
+            path = trace.meta.get("rerank_path", "full")
+            paths[path] = paths.get(path, 0) + 1
+            skipped += trace.stages.get("near_duplicates", {}).get("items", 0)
+            if mode == "fast" and results:
+                full, _ = data.search_database(query, engine=engine, mode="full")
+                kept = {r["content"] for r in results} & {r["content"] for r in full}
+                overlaps.append(len(kept) / len(full) if full else 1.0)
+
+        # Paraphrases: the same words reordered, asked right after the original
+        paraphrase_totals, semantic_hits = [], 0
+        for query in asked:
+            words = query.split()
+            rng.shuffle(words)
+            data.semantic_cache.clear()
+            data.search_database(query, engine=engine, mode=mode)
+            data.result_cache.clear()
+            engine.reranker.cache.clear()
+            trace = Trace("search")
+            data.search_database(" ".join(words), engine=engine, trace=trace, mode=mode)
+            trace.finish()
+            paraphrase_totals.append(trace.total)
+            semantic_hits += trace.stages.get("semantic_cache", {}).get("items", 0)
+
+        return {
+            "scale": scale,
+            "books": books,
+            "chunks": stats["chunks"],
+            "near_duplicates": stats["duplicates"],
+            "create_database": {
+                "seconds": create_seconds,
+                "chunks_per_sec": stats["chunks"] / create_seconds if create_seconds else 0.0,
+            },
+            "add_documents_from_files": {"files": 1, "seconds": add_seconds},
+            "search_database": {
+                "queries": queries,
+                "mode": mode,
+                "rerank_paths": paths,
+                "near_duplicates_skipped": skipped,
+                "overlap_with_full": sum(overlaps) / len(overlaps) if overlaps else None,
+                "total": percentiles(totals),
+                "stages": {name: percentiles(samples) for name, samples in stages.items()},
+            },
+            "paraphrases": {
+                "queries": len(asked),
+                "semantic_hit_rate": semantic_hits / len(asked) if asked else 0.0,
+                "total": percentiles(paraphrase_totals),
+            },
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# --- Backend parity ---
+def _agreement(baseline, candidate, k):
+    """Mean top-k overlap and top-1 agreement between two rows-of-rankings."""
+    overlap = sum(len(set(b[:k]) & set(c[:k])) / k for b, c in zip(baseline, candidate))
+    top1 = sum(b[0] == c[0] for b, c in zip(baseline, candidate))
+    n = max(len(baseline), 1)
+    return {"top_k_overlap": overlap / n, "top1_agreement": top1 / n}
+
+
+def parity_check(backend, directory=SAMPLE_DIR, embedding_model=EMBEDDING_MODEL,
+                 reranker_model=RERANKER_MODEL, queries=30, k=5, seed=0):
+    """Compare rankings from `backend` against the fp32 models on the highlights corpus."""
+    import numpy as np
+    from models import build_cross_encoder, build_embeddings, parse_model_spec
+
+    chunks = sample_chunks(directory)
+    if not chunks:
+        print(f"⚠️ No chunks in {directory}; nothing to compare.")
+        return {"backend": backend, "chunks": 0}
+    rng = random.Random(seed)
+    # Queries are short spans lifted from the corpus, so each has a clear best match
+    questions = []
+    for chunk in rng.sample(chunks, min(queries, len(chunks))):
+        words = chunk.split()
+        start = rng.randint(0, max(len(words) - 8, 0))
+        questions.append(" ".join(words[start:start + 8]))
+
+    embedding_name = parse_model_spec(embedding_model)[0]
+    reranker_name = parse_model_spec(reranker_model)[0]
+    report = {"backend": backend, "chunks": len(chunks), "queries": len(questions), "k": k}
+
+    def unit(rows):
+        rows = np.asarray(rows, dtype=np.float32)
+        return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+    retrieval, seconds = {}, {}
+    for label, spec in (("fp32", embedding_name), (backend, f"{embedding_name}@{backend}")):
+        model = build_embeddings(spec)
+        start = time.perf_counter()
+        docs = unit(model.embed_documents(chunks))
+        query_vectors = unit([model.embed_query(q) for q in questions])
+        seconds[label] = time.perf_counter() - start
+        retrieval[label] = np.argsort(-(query_vectors @ docs.T), axis=1).tolist()
+    report["embeddings"] = {**_agreement(retrieval["fp32"], retrieval[backend], k), "seconds": seconds}
+
+    # Both rerankers score the same fp32 retrieval candidates
+    candidates = [row[:k * 4] for row in retrieval["fp32"]]
+    pairs = [(q, chunks[i]) for q, row in zip(questions, candidates) for i in row]
+    reranked, seconds = {}, {}
+    for label, spec in (("fp32", reranker_name), (backend, f"{reranker_name}@{backend}")):
+        model = build_cross_encoder(spec)
+        start = time.perf_counter()
+        scores = model.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        seconds[label] = time.perf_counter() - start
+        scores = np.asarray(scores, dtype=np.float32).reshape(len(candidates), -1)
+        reranked[label] = [[row[j] for j in np.argsort(-s)] for row, s in zip(candidates, scores)]
+    report["reranker"] = {**_agreement(reranked["fp32"], reranked[backend], k), "seconds": seconds}
+
+    print(f"🎯 {backend} vs fp32 over {len(questions)} queries on {len(chunks)} chunks (top-{k})")
+    for name in ("embeddings", "reranker"):
+        r = report[name]
+        speedup = r["seconds"]["fp32"] / max(r["seconds"][backend], 1e-9)
+        print(
+            f"  {name:<10} overlap {r['top_k_overlap']:.1%}  top-1 {r['top1_agreement']:.1%}  "
+            f"fp32 {r['seconds']['fp32']:.2f}s  {backend} {r['seconds'][backend]:.2f}s  ({speedup:.1f}x)"
+        )
+    return report
+
+
+def run_benchmarks(scales=(10, 100), queries=50, stand_in=False, output="bench_results.json", text=False,
+                   parity=None, mode="full"):
+    """Run the benchmark suite and write the results to `output` as JSON."""
+    from models import STAND_IN_EMBEDDING_MODEL, STAND_IN_RERANKER_MODEL
+
+    embedding_model = STAND_IN_EMBEDDING_MODEL if stand_in else EMBEDDING_MODEL
+    reranker_model = STAND_IN_RERANKER_MODEL if stand_in else RERANKER_MODEL
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "embedding_model": embedding_model,
+        "reranker_model": reranker_model,
+        "libraries": [],
+    }
+    if text:
+        report["text_processing"] = bench_text_processing()
+    if parity:
+        report["parity"] = parity_check(parity, embedding_model=embedding_model, reranker_model=reranker_model)
+
+    for scale in scales:
+        result = bench_library(scale, queries, embedding_model, reranker_model, mode=mode)
+        report["libraries"].append(result)
+        search = result["search_database"]["total"]
+        print(
+            f"⏱️ {scale}x: {result['chunks']} chunks indexed at "
+            f"{result['create_database']['chunks_per_sec']:.1f} chunks/sec, "
+            f"add {result['add_documents_from_files']['seconds'] * 1000:.0f} ms, "
+            f"search p50 {search['p50'] * 1000:.1f} ms / p95 {search['p95'] * 1000:.1f} ms / "
+            f"p99 {search['p99'] * 1000:.1f} ms"
+        )
+        if result["near_duplicates"] or result["search_database"]["near_duplicates_skipped"]:
+            print(
+                f"🧬 {result['near_duplicates']} near-duplicate chunks not stored, "
+                f"{result['search_database']['near_duplicates_skipped']} rerank candidates skipped as near-duplicates"
+            )
+        paraphrases = result["paraphrases"]
+        if paraphrases["queries"]:
+            print(
+                f"🔁 Paraphrases: {paraphrases['semantic_hit_rate']:.0%} reused a recent query's candidates, "
+                f"p50 {paraphrases['total']['p50'] * 1000:.1f} ms"
+            )
+        if mode == "fast" and result["search_database"]["overlap_with_full"] is not None:
+            fast = result["search_database"]
+            print(f"⚡ Rerank paths {fast['rerank_paths']}, "
+                  f"{fast['overlap_with_full']:.0%} of full-rerank results kept")
+
+    Path(output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"📝 Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    bench_text_processing()
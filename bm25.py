@@ -0,0 +1,121 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in is it its "
+    "me my not of on or our she so that the their them they this to was we were "
+    "what when which who will with you your".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(str(text).lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted-index BM25 retriever over the indexed chunks."""
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self.docs = {}  # chunk id -> [source, length]
+        self.postings = {}  # term -> {chunk id: term frequency}
+        self.total_length = 0
+
+    @classmethod
+    def load(cls, persist_directory, filename="bm25.json"):
+        index = cls(Path(persist_directory) / filename)
+        if index.path.exists():
+            try:
+                data = json.loads(index.path.read_text(encoding="utf-8"))
+                index.docs = data["docs"]
+                index.postings = data["postings"]
+                index.total_length = sum(length for _, length in index.docs.values())
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Ignoring unreadable keyword index {index.path}: {e}")
+                index.reset()
+        return index
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"docs": self.docs, "postings": self.postings}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.docs, self.postings, self.total_length = {}, {}, 0
+
+    def add(self, chunk_id, text, source):
+        if chunk_id in self.docs:
+            self.remove_many([chunk_id])
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.docs[chunk_id] = [source, length]
+        self.total_length += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def remove(self, chunk_id):
+        self.remove_many([chunk_id])
+
+    def remove_many(self, chunk_ids):
+        chunk_ids = [i for i in chunk_ids if i in self.docs]
+        if not chunk_ids:
+            return
+        # Chunks are short, so one scan of the postings beats keeping a forward index on disk
+        drop = set(chunk_ids)
+        for i in chunk_ids:
+            self.total_length -= self.docs.pop(i)[1]
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for i in drop.intersection(docs):
+                del docs[i]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=10, sources=None, ids=None):
+        """Return up to k (chunk id, score) pairs, best first.
+
+        `ids`, the chunks of the selected sources, takes the place of
+        `sources` (it includes near-duplicates stored under other sources)
+        and lets a filtered search touch only those chunks when they are
+        fewer than a term's postings.
+        """
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_len = self.total_length / n
+        scores = Counter()
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            if ids is not None:
+                if len(ids) < len(docs):
+                    docs = {i: docs[i] for i in ids if i in docs}
+                else:
+                    docs = {i: tf for i, tf in docs.items() if i in ids}
+            for chunk_id, tf in docs.items():
+                if ids is None and sources is not None and self.docs[chunk_id][0] not in sources:
+                    continue
+                length = self.docs[chunk_id][1]
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_len)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / norm
+        return scores.most_common(k)
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60):
+    """Fuse ranked id lists into [(id, score)] using weighted reciprocal-rank fusion."""
+    weights = weights or [1.0] * len(rankings)
+    fused = Counter()
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking):
+            fused[item] += weight / (k + rank + 1)
+    return fused.most_common()
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional time-to-live and hit/miss counters."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and self.ttl is not None and time.monotonic() - item[1] > self.ttl:
+                del self._data[key]
+                item = _MISSING
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def values(self):
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._data),
+        }
+
+
+class SemanticCache:
+    """Thread-safe LRU of values keyed by query embedding, matched by cosine similarity.
+
+    Each entry belongs to a `scope` (everything besides the query that
+    shapes the value); a lookup returns the most similar entry in the same
+    scope, if its similarity reaches `threshold`.
+    """
+
+    def __init__(self, maxsize=256, threshold=0.9, ttl=None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # (scope, query) -> (unit vector, value, stored_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding):
+        import numpy as np
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, scope, embedding):
+        """(value, matched query, similarity) of the closest entry in `scope`, or None."""
+        vector = self._unit(embedding)
+        with self._lock:
+            now = time.monotonic()
+            best, best_similarity = None, self.threshold
+            for key, (unit, _, stored_at) in list(self._data.items()):
+                if self.ttl is not None and now - stored_at > self.ttl:
+                    del self._data[key]
+                    continue
+                if key[0] != scope or unit.shape != vector.shape:
+                    continue
+                similarity = float(unit @ vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = key, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best)
+            self.hits += 1
+            return self._data[best][1], best[1], best_similarity
+
+    def put(self, scope, query, embedding, value):
+        if self.maxsize <= 0:
+            return
+        vector = self._unit(embedding)
+        with self._lock:
+            self._data[(scope, query)] = (vector, value, time.monotonic())
+            self._data.move_to_end((scope, query))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def values(self):
+        with self._lock:
+            return [value for _, value, _ in self._data.values()]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._data),
+        }
@@ -0,0 +1,77 @@
+import json
+import socket
+
+from config import KEYWORD_WEIGHT, RERANK_MODE, SERVER_ADDRESS, VECTOR_WEIGHT
+from tracing import Trace
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class QueryClient:
+    """Thin client for `run.py serve`, mirroring the local search API.
+
+    Each request uses its own connection, so one client can be shared
+    between threads (e.g. Streamlit sessions) without serializing them.
+    """
+
+    def __init__(self, address=SERVER_ADDRESS, timeout=300):
+        self.address = parse_address(address)
+        self.timeout = timeout
+
+    def request(self, op, **params):
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.sendall(json.dumps({"op": op, **params}).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise ConnectionError(f"Query server at {self.address[0]}:{self.address[1]} closed the connection")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "query server error"))
+        return response
+
+    def search_database(self, query, top_k=5, book_filter=None, vector_weight=VECTOR_WEIGHT,
+                        keyword_weight=KEYWORD_WEIGHT, return_trace=False, mode=RERANK_MODE, libraries=None):
+        response = self.request(
+            "search",
+            query=query,
+            top_k=top_k,
+            book_filter=list(book_filter or []),
+            vector_weight=vector_weight,
+            keyword_weight=keyword_weight,
+            mode=mode,
+            libraries=libraries or None,
+        )
+        results, insight = response["results"], response["insight"]
+        return (results, insight, Trace.from_dict(response["trace"])) if return_trace else (results, insight)
+
+    def add_documents_from_files(self, file_paths, library=None):
+        return self._stats(self.request("add", paths=[str(p) for p in file_paths], library=library))
+
+    def rebuild(self, libraries=None):
+        return self._stats(self.request("rebuild", libraries=libraries or None))
+
+    def start_rebuild(self, libraries=None):
+        return self.request("start_rebuild", libraries=libraries or None)["started"]
+
+    def rebuild_status(self):
+        return self.request("rebuild_status")["rebuild"]
+
+    def startup_times(self):
+        return self.status()["startup"]
+
+    def status(self):
+        return self.request("status")
+
+    def memory_report(self):
+        return self.request("memory")["memory"]
+
+    @staticmethod
+    def _stats(response):
+        stats = response["stats"]
+        if "trace" in stats:
+            stats["trace"] = Trace.from_dict(stats["trace"])
+        return stats
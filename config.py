@@ -0,0 +1,103 @@
+import os
+
+# --- Models ---
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Append "@int8" (dynamic quantization) or "@onnx" (ONNX Runtime) to either name for faster CPU inference
+INFERENCE_THREADS = int(os.environ.get("INSIGHTMINER_THREADS", "0"))  # per process; 0 = library default
+
+# --- Memory ---
+# Lean mode: smaller in-memory caches, compact result records, freed memory returned to the OS after writes
+MEMORY_LEAN = os.environ.get("INSIGHTMINER_LEAN", "0") == "1"
+
+# --- Paths ---
+HIGHLIGHTS_DIR = os.environ.get("INSIGHTMINER_HIGHLIGHTS_DIR", "highlights")
+CHROMA_DIR = os.environ.get("INSIGHTMINER_CHROMA_DIR", "chroma_db")
+MANIFEST_FILE = "manifest.json"
+QUOTE_COLLECTION = "quotes"  # Chroma collection holding the deduplicated quotes
+CHROMA_TELEMETRY = os.environ.get("INSIGHTMINER_CHROMA_TELEMETRY", "0") == "1"
+
+# --- Libraries ---
+# "name=folder,name=folder": one index per team under CHROMA_DIR/<name>, searched together or alone.
+# Unset, HIGHLIGHTS_DIR is the only library and is indexed in CHROMA_DIR itself
+LIBRARIES = os.environ.get("INSIGHTMINER_LIBRARIES", "")
+SHARD_WORKERS = int(os.environ.get("INSIGHTMINER_SHARD_WORKERS", "8"))  # libraries searched at once
+
+# --- Vector index (HNSW) ---
+# Space, M and ef_construction apply to new collections; `run.py database compact` applies them to existing ones
+HNSW_SPACE = os.environ.get("INSIGHTMINER_HNSW_SPACE", "l2")  # "l2", "cosine" or "ip"
+HNSW_M = int(os.environ.get("INSIGHTMINER_HNSW_M", "16"))  # graph links per node
+HNSW_EF_CONSTRUCTION = int(os.environ.get("INSIGHTMINER_HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.environ.get("INSIGHTMINER_HNSW_EF_SEARCH", "100"))  # candidates per query; higher = better recall
+RECALL_QUERIES = int(os.environ.get("INSIGHTMINER_RECALL_QUERIES", "100"))  # sampled queries for the recall@k check
+
+# --- Index generations ---
+# Rebuilds write a new generation under CHROMA_DIR/generations and switch to it once it validates
+INDEX_KEEP_GENERATIONS = int(os.environ.get("INSIGHTMINER_KEEP_GENERATIONS", "1"))  # previous ones kept on disk
+INDEX_SWITCH_GRACE = float(os.environ.get("INSIGHTMINER_SWITCH_GRACE", "30"))  # seconds before closing the old one
+
+# --- Chunking ---
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+CHUNK_SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+
+# --- Near-duplicate chunks ---
+# Chunks whose 64-bit SimHash fingerprints differ in at most this many bits are stored once; -1 stores every copy
+DEDUP_INDEX_DISTANCE = int(os.environ.get("INSIGHTMINER_DEDUP_INDEX_DISTANCE", "3"))
+# Search candidates this close to a better-ranked one skip the reranker; -1 reranks them all
+DEDUP_QUERY_DISTANCE = int(os.environ.get("INSIGHTMINER_DEDUP_QUERY_DISTANCE", "10"))
+
+# --- Embedding cache ---
+EMBEDDING_CACHE_DIR = os.environ.get("INSIGHTMINER_EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_SIZE = int(os.environ.get("INSIGHTMINER_EMBEDDING_CACHE_SIZE", "100000"))
+
+# --- Reranking ---
+RERANK_BATCH_SIZE = int(os.environ.get("INSIGHTMINER_RERANK_BATCH_SIZE", "64"))
+RERANK_CACHE_SIZE = int(os.environ.get("INSIGHTMINER_RERANK_CACHE_SIZE", "5000" if MEMORY_LEAN else "50000"))
+QUOTE_CANDIDATES = int(os.environ.get("INSIGHTMINER_QUOTE_CANDIDATES", "10"))  # quotes looked up per query
+RERANK_MODE = os.environ.get("INSIGHTMINER_RERANK_MODE", "full")  # "full", or "fast" to rerank only close calls
+FAST_RERANK_MARGIN = float(os.environ.get("INSIGHTMINER_FAST_RERANK_MARGIN", "0.05"))  # vector similarity gap
+FAST_RERANK_TOP = int(os.environ.get("INSIGHTMINER_FAST_RERANK_TOP", "6"))  # ambiguous candidates reranked at most
+
+# --- Query result cache ---
+QUERY_CACHE_SIZE = int(os.environ.get("INSIGHTMINER_QUERY_CACHE_SIZE", "32" if MEMORY_LEAN else "256"))
+QUERY_CACHE_TTL = float(os.environ.get("INSIGHTMINER_QUERY_CACHE_TTL", "600"))  # seconds, 0 = no expiry
+# Paraphrases: a query this cosine-similar to a recent one with the same books reuses its candidates
+SEMANTIC_CACHE_SIZE = int(os.environ.get("INSIGHTMINER_SEMANTIC_CACHE_SIZE", "32" if MEMORY_LEAN else "256"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("INSIGHTMINER_SEMANTIC_CACHE_THRESHOLD", "0.9"))
+QUERY_BATCH_SIZE = int(os.environ.get("INSIGHTMINER_QUERY_BATCH_SIZE", "64"))  # questions per batch in --batch mode
+
+# --- Hybrid retrieval ---
+VECTOR_WEIGHT = float(os.environ.get("INSIGHTMINER_VECTOR_WEIGHT", "1.0"))
+KEYWORD_WEIGHT = float(os.environ.get("INSIGHTMINER_KEYWORD_WEIGHT", "1.0"))
+RRF_K = 60
+RERANK_CANDIDATE_FACTOR = 2  # chunks handed to the reranker = top_k * factor
+
+# --- Book-filtered search ---
+# Filters selecting up to this many chunks are searched exactly over just those chunks
+FILTER_EXACT_MAX_CHUNKS = int(os.environ.get("INSIGHTMINER_FILTER_EXACT_MAX_CHUNKS", "20000"))
+FILTER_VECTOR_CACHE_SIZE = int(
+    os.environ.get("INSIGHTMINER_FILTER_VECTOR_CACHE_SIZE", "16" if MEMORY_LEAN else "256")
+)  # books kept in memory
+
+# --- Ingestion ---
+INGEST_WORKERS = int(os.environ.get("INSIGHTMINER_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_BATCH_SIZE = int(os.environ.get("INSIGHTMINER_INGEST_BATCH_SIZE", "128"))  # chunks per embed/write
+INGEST_QUEUE_SIZE = 4 * INGEST_BATCH_SIZE  # queued chunks before the loader blocks
+INGEST_POOL_MIN_FILES = 8  # below this, loading in-process beats starting workers
+
+# --- File watcher ---
+WATCH_DEBOUNCE = float(os.environ.get("INSIGHTMINER_WATCH_DEBOUNCE", "1.0"))  # quiet seconds before indexing
+WATCH_MAX_DELAY = float(os.environ.get("INSIGHTMINER_WATCH_MAX_DELAY", "10"))  # index at least this often during bursts
+WATCH_IN_APP = os.environ.get("INSIGHTMINER_WATCH", "0") == "1"  # run the watcher inside the Streamlit process
+
+# --- Tracing ---
+TRACE_LOG = os.environ.get("INSIGHTMINER_TRACE_LOG", "")  # JSONL path; empty disables logging
+
+# --- Query server ---
+SERVER_HOST = os.environ.get("INSIGHTMINER_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("INSIGHTMINER_SERVER_PORT", "8765"))
+SERVER_ADDRESS = os.environ.get("INSIGHTMINER_SERVER", "")  # host:port; set to make the CLI and UI thin clients
+SERVER_WORKERS = int(os.environ.get("INSIGHTMINER_SERVER_WORKERS", "16"))  # searches in flight at once
+BATCH_WINDOW_MS = float(os.environ.get("INSIGHTMINER_BATCH_WINDOW_MS", "5"))  # wait this long to fill a batch
+BATCH_MAX_SIZE = int(os.environ.get("INSIGHTMINER_BATCH_MAX_SIZE", "64"))  # requests per model call
@@ -1,218 +1,563 @@
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import DirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import CrossEncoder
-from utils import clean_text, CleanTextLoader
-import re
-
-# --- Constants ---
-EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
-RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+from cache import LRUCache, SemanticCache
+from config import (
+    CHROMA_DIR,
+    DEDUP_QUERY_DISTANCE,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_MODEL,
+    HIGHLIGHTS_DIR,
+    KEYWORD_WEIGHT,
+    MANIFEST_FILE,
+    MEMORY_LEAN,
+    QUERY_BATCH_SIZE,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    QUOTE_CANDIDATES,
+    FAST_RERANK_MARGIN,
+    FILTER_EXACT_MAX_CHUNKS,
+    FAST_RERANK_TOP,
+    RERANK_CANDIDATE_FACTOR,
+    RERANK_MODE,
+    RERANKER_MODEL,
+    RRF_K,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    SERVER_WORKERS,
+    SHARD_WORKERS,
+    VECTOR_WEIGHT,
+)
+from bm25 import reciprocal_rank_fusion
+from indexing import (
+    Chunk,
+    LibraryIndex,
+    collection_space,
+    exact_distances,
+    add_stats,
+    format_stats,
+    get_chunks,
+    new_stats,
+    open_collection,
+)
+from generations import activate, active_directory, build_in_subprocess, collect_garbage, release_later
+from lazy import Deferred
+from libraries import configured_libraries, select_libraries
+from neardup import distance as fingerprint_distance, simhash
+from memory import deep_size, model_bytes, release_memory, rss
+from tracing import Trace
+from text_processing import (
+    WHITESPACE_RE,
+    chunk_analysis,
+    extract_and_filter_quotes,
+    format_content,
+)
+import os
+import sys
+import threading
+import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# What lean mode keeps of each result ("library" only when several are configured)
+RESULT_FIELDS = ("content", "source", "path", "score", "library")
+
+# Results of search_database, keyed by (query, top_k, books, index generation)
+result_cache = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL or None)
+# Reranker candidates and quote pools of recent queries, found by query embedding
+semantic_cache = SemanticCache(
+    maxsize=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=QUERY_CACHE_TTL or None
+)
 
 # --- Initialize models (Lazy Loading) ---
+class Shard:
+    """One library's Chroma collection, sidecar indexes and index generations.
+
+    `root` is the library's database root; searches read its current
+    generation. The models come from the SearchEngine that owns it.
+    """
+
+    def __init__(self, engine, library, label=""):
+        self.engine = engine
+        self.name = library.name
+        self.label = label
+        self.root = library.persist_directory
+        self.persist_directory = active_directory(self.root)
+        self.highlights_dir = library.highlights_dir
+        self.generation = 0
+        # Uploads, rebuilds and the file watcher may update the index from different threads
+        self._write_lock = threading.Lock()
+
+        def load_db():
+            from models import LazyEmbeddings
+
+            # Chroma only needs the embedding model once something is embedded
+            return open_collection(self.persist_directory, LazyEmbeddings(engine._embedding_function))
+
+        def load_index():
+            # Searches only read: another process may be writing, and writes repair the index first
+            index = LibraryIndex(self._db.get(), self.persist_directory, engine.embedding_model, repair=False)
+            self._index_mtime = self._manifest_mtime()
+            return index
+
+        self._index_mtime = None
+        suffix = f" ({label})" if label else ""
+        self._db = Deferred(f"chroma{suffix}", load_db, engine._loaded)
+        self._index = Deferred(f"index{suffix}", load_index, engine._loaded)
+
+    @property
+    def db(self):
+        return self._db.get()
+
+    @property
+    def index(self):
+        return self._index.get()
+
+    def _manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.persist_directory, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return 0
+
+    @property
+    def index_generation(self):
+        """Changes whenever this or another process modifies the library's index."""
+        return (self.persist_directory, self.generation, self._manifest_mtime())
+
+    def refresh_index(self):
+        """Follow a generation switch or reload the manifest if another process changed the index.
+
+        While a write in this process holds the lock, the index in memory is
+        the one being written; the write bumps the generation when it ends.
+        """
+        if not self._index.ready or not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            if active_directory(self.root) != self.persist_directory:
+                self._follow_current()
+                return
+            mtime = self._manifest_mtime()
+            if mtime != self._index_mtime:
+                index = LibraryIndex(self.db, self.persist_directory, self.engine.embedding_model, repair=False)
+                self._index = Deferred.resolved("index", index)
+                self._index_mtime = mtime
+        finally:
+            self._write_lock.release()
+
+    def _follow_current(self):
+        """Switch to the generation CURRENT names, if another process activated a new one."""
+        active = active_directory(self.root)
+        if active == self.persist_directory:
+            return
+        db = open_collection(active, self.db.embeddings)
+        self._switch(active, db, LibraryIndex(db, active, self.engine.embedding_model, repair=False))
+        print(f"🔀 Switched {self.label or 'the library'} to index generation {Path(active).name}")
+
+    def _switch(self, directory, db, index):
+        old = self.persist_directory
+        self._db = Deferred.resolved("chroma", db)
+        self._index = Deferred.resolved("index", index)
+        self.persist_directory = str(directory)
+        self._bump_generation()
+        release_later(old)
+
+    def _bump_generation(self):
+        self.generation += 1
+        self._index_mtime = self._manifest_mtime()
+        result_cache.clear()
+        semantic_cache.clear()
+
+    def rebuild(self, trace, progress=None):
+        """Build a new generation of this library in a worker process, then switch to it."""
+        from models import LazyEmbeddings
+
+        engine = self.engine
+        path, stats = build_in_subprocess(
+            engine.embedding_model,
+            self.highlights_dir,
+            self.root,
+            engine.embedding_cache_dir,
+            trace=trace,
+            progress=progress,
+        )
+        if progress:
+            progress("switching", 0, 0)
+        db = open_collection(path, LazyEmbeddings(engine._embedding_function))
+        index = LibraryIndex(db, str(path), engine.embedding_model)
+        with self._write_lock:
+            # Pick up files added or removed while the generation was being built
+            catch_up = index.sync_directory(self.highlights_dir, trace=trace)
+            for key in ("files_changed", "embedded", "removed"):
+                stats[key] += catch_up[key]
+            activate(self.root, path)
+            self._switch(path, db, index)
+        removed = collect_garbage(self.root)
+        print(
+            f"🔀 {self.label + ' now serving' if self.label else 'Now serving'} generation {path.name}"
+            + (f"; {removed} old generations removed" if removed else "")
+        )
+        return stats
+
+    def index_files(self, file_paths, trace):
+        with self._write_lock:
+            self._follow_current()
+            self.index.repair_keywords()
+            stats = self.index.index_files(file_paths, trace=trace)
+            self._bump_generation()
+        return stats
+
+    def remove_sources(self, sources, trace):
+        with self._write_lock:
+            self._follow_current()
+            self.index.repair_keywords()
+            stats = self.index.remove_sources(sources, trace=trace)
+            self._bump_generation()
+        return stats
+
+
 class SearchEngine:
+    """Models shared by every library, and a Shard for each library.
+
+    Components load concurrently on background threads; each accessor
+    blocks only until the component it returns is ready. `libraries`
+    ({name: Library}) defaults to `highlights_dir` indexed in
+    `persist_directory`; `get()` uses the configured libraries.
+    """
+
     _instance = None
 
     @classmethod
     def get(cls):
         if cls._instance is None:
-            print("⏳ Loading models... (this might take a moment)")
-            cls._instance = cls()
-            print("✅ Models loaded!")
+            print("⏳ Loading models in the background...")
+            cls._instance = cls(libraries=configured_libraries())
         return cls._instance
 
     @classmethod
     def reset(cls):
-        """Reset the singleton instance (useful before rebuilding DB)."""
+        """Reset the singleton instance and free what it held (useful before rebuilding DB)."""
         if cls._instance:
             print("🔄 Resetting search engine instance...")
-            # Try to release resources if possible
-            del cls._instance
-            cls._instance = None
-
-    def __init__(self):
-        self.embedding_function = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-        self.db = Chroma(persist_directory="chroma_db", embedding_function=self.embedding_function)
-        self.reranker = CrossEncoder(RERANKER_MODEL)
-
-    def rebuild(self):
-        """Rebuild the database using the existing connection."""
-        print("🔄 Rebuilding database...")
-        
-        # 1. Clear existing data
-        try:
-            # Try to delete the collection entirely
-            self.db.delete_collection()
-            print("🗑️ Collection deleted.")
-        except Exception as e:
-            print(f"⚠️ Warning during collection deletion: {e}")
-            # Fallback: Try to delete all documents if collection deletion failed
-            try:
-                # Empty dictionary means match all in some versions, or might need workarounds
-                # But safer to just try delete_collection. 
-                # If that failed, maybe the DB connection is stale.
-                pass
-            except:
-                pass
-
-        # 2. Re-initialize DB (creates new collection if deleted, or reconnects)
-        # Force a reload of the client if possible
-        self.db = Chroma(persist_directory="chroma_db", embedding_function=self.embedding_function)
-
-        # 3. Load and Process Documents
-        print("📂 Loading documents...")
-        loader = DirectoryLoader("highlights", glob="**/*.md", loader_cls=CleanTextLoader)
-        docs = loader.load()
-
-        if not docs:
-            print("⚠️ No documents found in 'highlights/'")
-            return
+            instance, cls._instance = cls._instance, None
+            freed = instance.close()
+            print(f"🧹 Released {freed / 2**20:.0f} MB")
 
-        print("✂️ Splitting documents...")
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800, chunk_overlap=150, separators=["\n\n", "\n", ".", " ", ""]
-        )
-        chunks = splitter.split_documents(docs)
+    def __init__(
+        self,
+        persist_directory=CHROMA_DIR,
+        highlights_dir=HIGHLIGHTS_DIR,
+        embedding_model=EMBEDDING_MODEL,
+        reranker_model=RERANKER_MODEL,
+        embedding_cache_dir=EMBEDDING_CACHE_DIR,
+        libraries=None,
+    ):
+        if libraries is None:
+            libraries = configured_libraries("", highlights_dir, persist_directory)
+        self.libraries = libraries
+        self.embedding_model = embedding_model
+        self.embedding_cache_dir = str(embedding_cache_dir)
+        self.startup = Trace("startup")
+        self._rebuild_lock = threading.Lock()  # one generation is built at a time
+        self._progress = {"state": "idle"}
 
-        # 4. Add to DB
-        print(f"💾 Adding {len(chunks)} chunks to database...")
-        self.db.add_documents(chunks)
-        print("✅ Database rebuild complete!")
+        def load_embedding_function():
+            from models import load_embeddings
 
-    def add_documents_from_files(self, file_paths):
-        """Add specific files to the database, removing old versions first."""
-        print(f"📂 Processing {len(file_paths)} new documents...")
-        
-        # 1. Remove existing chunks for these files to avoid duplicates
-        for file_path in file_paths:
-            source_path = str(file_path)
-            try:
-                # Clean up old entries for this file
-                # The 'source' metadata field typically stores the relative path
-                print(f"🧹 Cleaning existing entries for: {source_path}")
-                self.db.delete(where={"source": source_path})
-            except Exception as e:
-                print(f"⚠️ Note: Could not clean existing entries for {source_path} (might be new): {e}")
+            return load_embeddings(embedding_model, cache_dir=embedding_cache_dir)
+
+        def load_reranker_model():
+            from models import load_reranker
+
+            return load_reranker(reranker_model)
+
+        self._embedding_function = Deferred("embedding_model", load_embedding_function, self._loaded)
+        self._reranker = Deferred("reranker", load_reranker_model, self._loaded)
+        several = len(libraries) > 1
+        self.shards = {name: Shard(self, library, name if several else "") for name, library in libraries.items()}
+
+    def _loaded(self, component):
+        self.startup.add(component.name, component.seconds)
+        # Single write so messages from concurrent loaders don't interleave
+        if component.failed:
+            print(f"❌ Failed to load {component.name} after {component.seconds:.1f}s\n", end="", flush=True)
+        else:
+            print(f"✅ {component.name} ready in {component.seconds:.1f}s\n", end="", flush=True)
+
+    def _deferred(self):
+        loaders = [self._embedding_function, self._reranker]
+        for shard in self.shards.values():
+            loaders += [shard._db, shard._index]
+        return loaders
+
+    @property
+    def embedding_function(self):
+        return self._embedding_function.get()
+
+    @property
+    def reranker(self):
+        return self._reranker.get()
+
+    # The first library's, for callers that only know one
+    @property
+    def shard(self):
+        return next(iter(self.shards.values()))
+
+    @property
+    def db(self):
+        return self.shard.db
+
+    @property
+    def index(self):
+        return self.shard.index
+
+    @property
+    def persist_directory(self):
+        return self.shard.persist_directory
+
+    @property
+    def highlights_dir(self):
+        return self.shard.highlights_dir
+
+    def select(self, libraries=None):
+        """Shards of the named libraries (all of them when none are named)."""
+        return [self.shards[library.name] for library in select_libraries(self.libraries, libraries)]
 
-        # 2. Load new content
-        docs = []
-        for file_path in file_paths:
+    def startup_times(self):
+        """Seconds each component took to load (None while still loading)."""
+        return {d.name: d.seconds for d in self._deferred()}
+
+    def close(self):
+        """Free the models, Chroma clients and caches; returns the bytes handed back to the OS."""
+        with self._rebuild_lock:
+            self._wait_for_loaders()
+        self._embedding_function = self._reranker = None
+        for shard in self.shards.values():
+            shard._db = shard._index = None
+        result_cache.clear()
+        semantic_cache.clear()
+        if "chromadb" in sys.modules:
+            from chromadb.api.client import SharedSystemClient
+
+            # Stops the Rust bindings that hold the HNSW graphs and sqlite connections
+            SharedSystemClient.clear_system_cache()
+        return release_memory()
+
+    def _wait_for_loaders(self):
+        # A loader that is still running would otherwise keep its result alive
+        for d in self._deferred():
+            d.wait()
+
+    def memory_report(self):
+        """Resident memory and the estimated bytes held by each loaded component."""
+        components = {}
+        if self._embedding_function.ready and not self._embedding_function.failed:
+            embeddings = self.embedding_function
+            components["embedding_model"] = model_bytes(embeddings.embeddings)
+            components["embedding_cache"] = deep_size(embeddings.cache.rows)
+        if self._reranker.ready and not self._reranker.failed:
+            components["reranker_model"] = model_bytes(self.reranker.model)
+            components["reranker_cache"] = deep_size(self.reranker.cache.values())
+        for shard in self.shards.values():
+            if not shard._index.ready or shard._index.failed:
+                continue
+            index = shard.index
+            with index.lock.read():
+                sizes = {
+                    "keyword_index": deep_size(index.keywords.docs) + deep_size(index.keywords.postings),
+                    "manifest": deep_size(index.manifest.files),
+                    "near_duplicates": deep_size(index.near_duplicates.fingerprints),
+                    "filter_vectors": sum(
+                        deep_size(ids) + vectors.nbytes for ids, vectors in index._vectors.values()
+                    ),
+                }
+            for name, size in sizes.items():
+                components[name] = components.get(name, 0) + size
+        components["result_cache"] = deep_size(result_cache.values())
+        components["semantic_cache"] = deep_size(semantic_cache.values())
+        total = rss()
+        # Chroma's Rust core, torch's runtime and the interpreter itself
+        components["chroma_and_runtime"] = max(0, total - sum(components.values()))
+        return {"rss": total, "components": components}
+
+    def _release_after_write(self):
+        if MEMORY_LEAN:
+            # Only indexing reads the embedding cache index; queries never do
+            self.embedding_function.cache.unload()
+            release_memory()
+
+    def wait_until_ready(self):
+        for d in self._deferred():
+            d.get()
+        return self
+
+    @property
+    def index_generation(self):
+        """Changes whenever this or another process modifies any library's index."""
+        return tuple(shard.index_generation for shard in self.shards.values())
+
+    def refresh_index(self):
+        """Follow generation switches and manifest changes made by other processes."""
+        for shard in self.shards.values():
+            shard.refresh_index()
+
+    def rebuild(self, libraries=None):
+        """Re-index the libraries' highlights folders into new generations and switch to them.
+
+        Each build runs in a worker process, and searches keep using the
+        current generation until the new one has been built and validated.
+        Content embedded before comes from the embedding cache.
+        """
+        shards = self.select(libraries)
+        with self._rebuild_lock:
+            return self._rebuild(shards)
+
+    def start_rebuild(self, libraries=None):
+        """Run `rebuild` on a background thread; False if one is already running."""
+        shards = self.select(libraries)
+        if not self._rebuild_lock.acquire(blocking=False):
+            return False
+
+        def run():
             try:
-                loader = CleanTextLoader(str(file_path))
-                docs.extend(loader.load())
+                self._rebuild(shards)
             except Exception as e:
-                print(f"⚠️ Error loading {file_path}: {e}")
-        
-        if not docs:
-            print("⚠️ No valid documents loaded.")
-            return
+                print(f"❌ Rebuild failed: {e}")
+            finally:
+                self._rebuild_lock.release()
 
-        print("✂️ Splitting documents...")
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800, chunk_overlap=150, separators=["\n\n", "\n", ".", " ", ""]
+        self._progress = {"state": "running", "phase": "starting", "done": 0, "total": 0, "started": time.time()}
+        threading.Thread(target=run, name="rebuild", daemon=True).start()
+        return True
+
+    def rebuild_status(self):
+        """State of the latest rebuild: idle, running, done or failed, with its progress."""
+        status = dict(self._progress)
+        if "started" in status:
+            status["seconds"] = status.get("finished", time.time()) - status["started"]
+        status["generation"] = ", ".join(
+            f"{shard.label} {Path(shard.persist_directory).name}".strip() for shard in self.shards.values()
         )
-        chunks = splitter.split_documents(docs)
+        return status
 
-        print(f"💾 Adding {len(chunks)} chunks to database...")
-        self.db.add_documents(chunks)
-        print("✅ Added new documents successfully!")
+    def _report_progress(self, phase, done, total):
+        self._progress = {**self._progress, "phase": phase, "done": done, "total": total}
 
-# --- Helper functions ---
-def format_content(content, width=80):
-    """Format text nicely with one quote per line."""
-    if not content:
-        return ""
-
-    # Remove unwanted artifacts
-    content = clean_text(content)
-    content = re.sub(r"\bQuotes\b", "", content)
-
-    # Split quotes into separate lines
-    quotes = re.findall(r'"([^"]+)"', content)
-    if quotes:
-        cleaned_quotes = []
-        seen = set()
-        for q in quotes:
-            q = q.strip()
-            if q and q not in seen:
-                seen.add(q)
-                if not q.endswith((".", "!", "?")):
-                    q += "."
-                q = q[0].upper() + q[1:]
-                cleaned_quotes.append(q)
-        return "\n".join(cleaned_quotes)
-
-    # Fallback: split into paragraphs
-    paragraphs = [p.strip() for p in content.split("\n") if p.strip()]
-    lines = []
-    for para in paragraphs:
-        words = para.split()
-        line = []
-        for word in words:
-            if len(" ".join(line + [word])) <= width:
-                line.append(word)
-            else:
-                lines.append(" ".join(line))
-                line = [word]
-        if line:
-            lines.append(" ".join(line))
-        lines.append("")
+    def _rebuild(self, shards):
+        print("🔄 Rebuilding database into a new generation...")
+        trace = Trace("rebuild")
+        if self._progress.get("state") != "running":
+            self._progress = {"state": "running", "phase": "starting", "done": 0, "total": 0, "started": time.time()}
+        stats = new_stats()
+        try:
+            for shard in shards:
+                print(f"📂 Indexing {shard.label or 'documents'}...")
+                report = self._report_progress
+                if shard.label:
+                    def report(phase, done, total, label=shard.label):
+                        self._report_progress(f"{label}: {phase}", done, total)
+                add_stats(stats, shard.rebuild(trace, report))
+        except Exception as e:
+            self._progress = {**self._progress, "state": "failed", "error": str(e), "finished": time.time()}
+            raise
 
-    return "\n".join(lines)
+        stats["trace"] = trace.finish()
+        self._progress = {
+            **self._progress, "state": "done", "stats": format_stats(stats), "finished": time.time(),
+        }
+        print(f"✅ Database rebuild complete! {format_stats(stats)}")
+        self._release_after_write()
+        return stats
 
+    def _route(self, paths, library=None):
+        """{shard: paths} by the library folder each path lies in; `library` names it outright."""
+        if library:
+            return {self.select([library])[0]: list(paths)}
+        routed = {}
+        for path in paths:
+            shard = next(
+                (self.shards[library.name] for library in self.libraries.values() if library.owns(path)), self.shard
+            )
+            routed.setdefault(shard, []).append(path)
+        return routed
 
-def extract_and_filter_quotes(text):
-    """Extract and filter quotes from text."""
-    cleaned = clean_text(str(text))
-    if not cleaned:
-        return []
+    def add_documents_from_files(self, file_paths, library=None):
+        """Add specific files to their library, replacing old versions of them."""
+        print(f"📂 Processing {len(file_paths)} new documents...")
+        trace = Trace("add_documents", files=len(file_paths))
+        stats = new_stats()
+        for shard, paths in self._route(file_paths, library).items():
+            add_stats(stats, shard.index_files(paths, trace))
+        stats["trace"] = trace.finish()
+        print(f"✅ Added new documents successfully! {format_stats(stats)}")
+        print(f"🧠 {self.embedding_function.cache.describe()}")
+        self._release_after_write()
+        return stats
 
-    quotes = re.findall(r'"([^"]+)"', cleaned)
-    quotes += re.findall(r"•\s*(.+?)(?=\n|$)", cleaned)
+    def remove_documents(self, sources, library=None):
+        """Drop every chunk indexed for the given files, e.g. after they were deleted."""
+        trace = Trace("remove_documents", files=len(sources))
+        stats = new_stats()
+        for shard, paths in self._route([str(s) for s in sources], library).items():
+            add_stats(stats, shard.remove_sources(paths, trace))
+        stats["trace"] = trace.finish()
+        print(f"🗑️ Removed {len(sources)} documents ({stats['removed']} chunks)")
+        return stats
 
-    valid_quotes = []
-    for q in quotes:
-        q = q.strip()
-        words = q.split()
+    def indexed_sources(self, folder):
+        """Indexed sources inside `folder`, e.g. one that was just deleted or moved away."""
+        folder = Path(folder).resolve()
+        sources = []
+        for shard in self.shards.values():
+            with shard.index.lock.read():
+                files = list(shard.index.manifest.files)
+            sources.extend(s for s in files if folder in Path(s).resolve().parents)
+        return sources
 
-        if (
-            (6 <= len(words) <= 40)
-            and not q.lower().startswith(("chapter", "section", "note"))
-            and not q.endswith((":", "-", "..."))
-            and not any(word.isupper() for word in words[:3])
-        ):
-            q = q.rstrip(",.;")
-            valid_quotes.append(q)
+# --- Helper functions ---
+def dedupe_quotes(quote_lists):
+    """Merge quote lists, dropping case-insensitive duplicates."""
+    seen = set()
+    unique_quotes = []
+    for quotes in quote_lists:
+        for q in quotes:
+            q_lower = q.lower()
+            if q_lower not in seen:
+                seen.add(q_lower)
+                unique_quotes.append(q)
+    return unique_quotes
 
-    return valid_quotes
 
+def collect_quotes(texts):
+    """Extract quotes from all texts, dropping case-insensitive duplicates."""
+    return dedupe_quotes(extract_and_filter_quotes(t) for t in texts)
 
-def generate_quality_insight(texts, query):
-    """Generate clean, coherent, relevant insights from sources."""
+
+def generate_quality_insight(texts, query, quote_scores=None):
+    """Generate clean, coherent, relevant insights from sources.
+
+    `quote_scores` maps quotes to reranker scores the caller already computed;
+    without it the quotes are scored here.
+    """
     if not texts or not query:
         return "🔍 No content provided for summarization."
 
-    valid_quotes = []
-    for t in texts:
-        valid_quotes.extend(extract_and_filter_quotes(t))
+    return insight_from_quotes(collect_quotes(texts), query, quote_scores)
 
-    if not valid_quotes:
-        return "🔍 No strong insights found in the sources."
 
-    seen = set()
-    unique_quotes = []
-    for q in valid_quotes:
-        q_lower = q.lower()
-        if q_lower not in seen:
-            seen.add(q_lower)
-            unique_quotes.append(q)
+def insight_from_quotes(unique_quotes, query, quote_scores=None, rerank=True):
+    """Pick the five most relevant quotes and format them as an insight.
+
+    With `rerank=False` the first five quotes are used in the order given.
+    """
+    if not unique_quotes:
+        return "🔍 No strong insights found in the sources."
 
-    if len(unique_quotes) > 5:
+    if len(unique_quotes) > 5 and not rerank:
+        top_quotes = unique_quotes[:5]
+    elif len(unique_quotes) > 5:
         try:
-            engine = SearchEngine.get()
-            pairs = [(query, q) for q in unique_quotes]
-            scores = engine.reranker.predict(pairs)
+            if quote_scores is not None and all(q in quote_scores for q in unique_quotes):
+                scores = [quote_scores[q] for q in unique_quotes]
+            else:
+                scores = SearchEngine.get().reranker.score(query, unique_quotes)
             scored_quotes = sorted(
                 zip(unique_quotes, scores), key=lambda x: x[1], reverse=True
             )
@@ -225,7 +570,7 @@ def generate_quality_insight(texts, query):
 
     insight = f"✨ Top Insights About '{query}' ✨\n\n"
     for i, q in enumerate(top_quotes, 1):
-        q = re.sub(r"\s+", " ", q).strip()
+        q = WHITESPACE_RE.sub(" ", q).strip()
         if q and not q.endswith((".", "!", "?")):
             q += "."
         q = q[0].upper() + q[1:]
@@ -237,41 +582,423 @@ def generate_quality_insight(texts, query):
     return insight
 
 
-def search_database(query, top_k=5, book_filter=None):
-    """Retrieve top results and generate insights via return values."""
-    try:
-        engine = SearchEngine.get()
-        
-        filter_dict = None
-        if book_filter:
-            # Construct the source path as expected in metadata
-            # usually "highlights/Filename.md"
-            sources = [f"highlights/{b}" for b in book_filter]
-            if len(sources) == 1:
-                filter_dict = {"source": sources[0]}
-            else:
-                filter_dict = {"source": {"$in": sources}}
-            
-        results = engine.db.similarity_search_with_score(query, k=top_k * 3, filter=filter_dict)
-    except Exception as e:
-        return [], f"❌ Search error: {e}"
+def search_database(
+    query,
+    top_k=5,
+    book_filter=None,
+    vector_weight=VECTOR_WEIGHT,
+    keyword_weight=KEYWORD_WEIGHT,
+    engine=None,
+    trace=None,
+    return_trace=False,
+    mode=RERANK_MODE,
+    libraries=None,
+):
+    """Retrieve top results and generate insights via return values.
+
+    Vector and BM25 keyword hits are merged with reciprocal-rank fusion,
+    weighted by `vector_weight` and `keyword_weight`, before reranking.
+    `libraries` names the libraries to search (default: all); they are
+    searched in parallel and their best hits reranked together.
+    In "fast" `mode` the reranker only sees candidates whose vector scores
+    are too close to call (see `_rerank_plan`); the path taken is recorded
+    as ``trace.meta["rerank_path"]``. A query whose embedding is within
+    SEMANTIC_CACHE_THRESHOLD cosine similarity of a recent one with the same
+    books reranks that query's candidates instead of retrieving its own
+    (``trace.meta["semantic_match"]`` names it).
+    With `return_trace=True` a third value, the per-stage Trace, is returned.
+    """
+    if trace is None:
+        trace = Trace("search", query=query, top_k=top_k, book_filter=list(book_filter or []))
+    results, insight = _search(
+        query, top_k, book_filter, vector_weight, keyword_weight, engine, trace, mode, libraries
+    )
+    trace.finish()
+    return (results, insight, trace) if return_trace else (results, insight)
+
+
+def iter_search(
+    query,
+    top_k=5,
+    book_filter=None,
+    vector_weight=VECTOR_WEIGHT,
+    keyword_weight=KEYWORD_WEIGHT,
+    engine=None,
+    trace=None,
+    mode=RERANK_MODE,
+    libraries=None,
+):
+    """search_database, yielding each stage's output as soon as it is ready.
+
+    Yields ("candidates", results) in fused order before reranking (not for
+    cached or empty searches), then ("results", results), ("insight", insight)
+    and finally ("trace", trace) once the trace is finished.
+    """
+    if trace is None:
+        trace = Trace("search", query=query, top_k=top_k, book_filter=list(book_filter or []))
+    yield from _search_steps(
+        query, top_k, book_filter, vector_weight, keyword_weight, engine, trace, mode, libraries
+    )
+    yield "trace", trace.finish()
+
+
+def _cache_key(engine, shards, query, top_k, book_filter, vector_weight, keyword_weight, mode):
+    return (
+        tuple(shard.name for shard in shards),
+        query.strip(),
+        top_k,
+        tuple(sorted(book_filter or ())),
+        vector_weight,
+        keyword_weight,
+        mode,
+        engine.index_generation,
+    )
+
+
+def _candidate_scope(engine, shards, top_k, book_filter, vector_weight, keyword_weight):
+    """What besides the query decides the reranker candidates; semantic cache hits must share it."""
+    return (
+        tuple(shard.name for shard in shards),
+        top_k,
+        tuple(sorted(book_filter or ())),
+        vector_weight,
+        keyword_weight,
+        engine.index_generation,
+    )
+
+
+def _reuse_candidates(scope, embedding):
+    """Copies of (candidates, quotes, quote sources, match) from a paraphrase answered recently, or None.
+
+    Only retrieval is skipped: the candidates are reranked against the new
+    query, so a near miss still orders its results for the question asked.
+    """
+    if SEMANTIC_CACHE_SIZE <= 0:
+        return None
+    hit = semantic_cache.get(scope, embedding)
+    if hit is None:
+        return None
+    (processed, quotes, quote_sources), matched, similarity = hit
+    match = {"query": matched, "similarity": round(similarity, 4)}
+    return [dict(r) for r in processed], quotes, quote_sources, match
+
+
+def _remember_candidates(scope, query, embedding, processed, quotes, quote_sources):
+    # Copied before ranking, which rescores and sorts the records in place
+    if SEMANTIC_CACHE_SIZE > 0:
+        semantic_cache.put(scope, query.strip(), embedding, ([dict(r) for r in processed], quotes, quote_sources))
+
 
-    processed = []
-    for doc, score in results:
+def _source_filter(shard, book_filter):
+    """(sources, Chroma where-filter) for a book filter, or (None, None)."""
+    if not book_filter:
+        return None, None
+    # Construct the source path as expected in metadata
+    # usually "highlights/Filename.md"
+    sources = [f"{shard.highlights_dir}/{b}" for b in book_filter]
+    if len(sources) == 1:
+        return sources, {"source": sources[0]}
+    return sources, {"source": {"$in": sources}}
+
+
+def _similarity_fn(db):
+    """Maps Chroma distances to similarities for the collection's distance space."""
+    if collection_space(db._collection) == "l2":
+        # Squared L2 between the unit-length vectors both embedding models produce
+        return lambda distance: 1.0 - distance / 2
+    return lambda distance: 1.0 - distance
+
+
+def _filtered_vector_search(shard, embeddings, sources, k, filter_dict):
+    """Vector search within `sources` for each embedding; a list of (doc, distance) lists.
+
+    Selections small enough are searched exactly over just their own vectors,
+    so the cost follows the chosen books rather than the library; larger
+    ones use Chroma's filtered query.
+    """
+    import numpy as np
+
+    if len(shard.index.source_chunk_ids(sources)) > FILTER_EXACT_MAX_CHUNKS:
+        return _vector_search_many(shard.db, embeddings, k, filter_dict)
+
+    ids, vectors = shard.index.source_vectors(sources)
+    if not ids:
+        return [[] for _ in embeddings]
+    distances = exact_distances(vectors, embeddings, collection_space(shard.db._collection))
+    k = min(k, len(ids))
+    tops = []
+    for row in distances:
+        top = np.argpartition(row, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        tops.append(top[np.argsort(row[top])])
+    wanted = {ids[i] for top in tops for i in top}
+    docs = {doc.id: doc for doc in get_chunks(shard.db, wanted)}
+    return [
+        [(docs[ids[i]], float(row[i])) for i in top if ids[i] in docs]
+        for top, row in zip(tops, distances)
+    ]
+
+
+def _shard_hits(shard, queries, embeddings, k, book_filter, trace, tag=False):
+    """One library's hits for each query: (vector hits, keyword hits, chunks by id).
+
+    Vector hits are (chunk id, similarity) and keyword hits (chunk id, BM25
+    score), best first. Keyword-only chunks are fetched here, from the
+    library that holds them; with `tag`, chunks name their library.
+    """
+    sources, filter_dict = _source_filter(shard, book_filter)
+    source_ids = set(shard.index.source_chunk_ids(sources)) if sources else None
+    if sources and not source_ids:
+        # None of the selected books are in this library
+        return [([], [], {}) for _ in queries]
+
+    with trace.stage("keyword_search"):
+        keyword_hits = [
+            shard.index.keyword_search(
+                q, k=k, sources=set(sources) if sources else None, ids=source_ids
+            )
+            for q in queries
+        ]
+    with trace.stage("vector_search"):
+        if sources:
+            vector_results = _filtered_vector_search(shard, embeddings, sources, k, filter_dict)
+        else:
+            vector_results = _vector_search_many(shard.db, embeddings, k, filter_dict)
+
+    with trace.stage("fetch_chunks"):
+        similarity = _similarity_fn(shard.db)
+        found = [{doc.id: doc for doc, _ in results} for results in vector_results]
+        missing = {
+            chunk_id
+            for docs_by_id, hits in zip(found, keyword_hits)
+            for chunk_id, _ in hits
+            if chunk_id not in docs_by_id
+        }
+        fetched = {doc.id: doc for doc in get_chunks(shard.db, missing)} if missing else {}
+        out = []
+        for results, hits, docs_by_id in zip(vector_results, keyword_hits, found):
+            docs_by_id.update((chunk_id, fetched[chunk_id]) for chunk_id, _ in hits if chunk_id in fetched)
+            if sources:
+                _relabel(shard, docs_by_id, sources)
+            if tag:
+                docs_by_id = {
+                    chunk_id: Chunk(doc.id, doc.page_content, {**doc.metadata, "library": shard.name})
+                    for chunk_id, doc in docs_by_id.items()
+                }
+            vector = [(doc.id, similarity(distance)) for doc, distance in results]
+            out.append((vector, hits, docs_by_id))
+    return out
+
+
+# Libraries are searched concurrently on these threads
+_shard_pool = ThreadPoolExecutor(SHARD_WORKERS, thread_name_prefix="shard")
+
+
+def _fan_out(fn, shards):
+    """fn(shard) for each shard, on the shard pool when there are several."""
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    return list(_shard_pool.map(fn, shards))
+
+
+def _retrieve(engine, shards, queries, embeddings, k, book_filter, trace):
+    """Hits for each query across `shards`: the `k` best vector and keyword hits of them all.
+
+    Shards are searched in parallel; their per-stage times are kept in
+    ``trace.meta["shards"]`` and the wall time of the whole fan-out in the
+    "fan_out" stage.
+    """
+    tag = len(engine.shards) > 1
+    if len(shards) == 1:
+        per_shard = [_shard_hits(shards[0], queries, embeddings, k, book_filter, trace, tag)]
+    else:
+        traces = {shard.name: Trace(shard.name) for shard in shards}
+        with trace.stage("fan_out", items=len(shards)):
+            per_shard = _fan_out(
+                lambda shard: _shard_hits(shard, queries, embeddings, k, book_filter, traces[shard.name], tag),
+                shards,
+            )
+        trace.meta["shards"] = {
+            name: {stage: round(entry["seconds"] * 1000, 2) for stage, entry in t.stages.items()}
+            for name, t in traces.items()
+        }
+        merged = []
+        for i in range(len(queries)):
+            docs_by_id = {}
+            for hits in per_shard:
+                docs_by_id.update(hits[i][2])
+            merged.append((
+                _best((hit for hits in per_shard for hit in hits[i][0]), k),
+                _best((hit for hits in per_shard for hit in hits[i][1]), k),
+                docs_by_id,
+            ))
+        return merged
+    return per_shard[0]
+
+
+def _best(hits, k):
+    # Similarities share one embedding space; BM25 scores are close enough across libraries to rank by
+    return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
+
+
+def _fuse(vector_hits, keyword_hits, vector_weight, keyword_weight):
+    return reciprocal_rank_fusion(
+        [[chunk_id for chunk_id, _ in vector_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+        weights=[vector_weight, keyword_weight],
+        k=RRF_K,
+    )
+
+
+def _candidates(fused, docs_by_id, top_k, similarities, fingerprints=None):
+    """Reranker candidates in fused order, their deduplicated quotes and the near-duplicates skipped.
+
+    `similarities` maps chunk ids to vector similarity; keyword-only hits
+    have none. With `fingerprints` (chunk id -> SimHash), a candidate within
+    DEDUP_QUERY_DISTANCE bits of a better-ranked one is passed over, so the
+    rerank budget goes to distinct passages.
+    """
+    processed, kept, skipped = [], [], 0
+    for chunk_id, score in fused:
+        doc = docs_by_id.get(chunk_id)
+        if doc is None:
+            continue
         content = doc.page_content
-        if content and len(clean_text(content).split()) > 10:
+        if not content:
+            continue
+        word_count, quotes = chunk_analysis(content, doc.metadata)
+        if word_count > 10:
+            if fingerprints is not None:
+                fingerprint = fingerprints.get(chunk_id)
+                if fingerprint is None:
+                    fingerprint = simhash(content)
+                if any(fingerprint_distance(fingerprint, f) <= DEDUP_QUERY_DISTANCE for f in kept):
+                    skipped += 1
+                    continue
+                kept.append(fingerprint)
             source = doc.metadata.get("source", "unknown")
             filename = source.split("/")[-1].replace(".md", "").replace("Book ", "")
-            processed.append(
-                {"content": content, "raw_score": float(score), "source": filename}
-            )
+            record = {
+                "content": content,
+                "raw_score": float(score),
+                "vector_score": similarities.get(chunk_id),
+                "source": filename,
+                "path": source,
+                "quotes": quotes,
+            }
+            if "library" in doc.metadata:
+                record["library"] = doc.metadata["library"]
+            processed.append(record)
+            if len(processed) >= top_k * RERANK_CANDIDATE_FACTOR:
+                break
+    return processed, dedupe_quotes(r["quotes"] for r in processed), skipped
 
-    if not processed:
-        return [], "🔍 No quality results found"
 
-    if len(processed) > 2:
-        pairs = [(query, r["content"]) for r in processed]
-        rerank_scores = engine.reranker.predict(pairs)
+def _fingerprints(shards):
+    if DEDUP_QUERY_DISTANCE < 0:
+        return None
+    if len(shards) == 1:
+        return shards[0].index.near_duplicates.fingerprints
+    # Near-duplicates are caught across libraries too
+    return ChainMap(*(shard.index.near_duplicates.fingerprints for shard in shards))
+
+
+def _relabel(shard, docs_by_id, sources):
+    """Show a chunk stored under an unselected book as the selected book that duplicates it."""
+    selected = set(sources)
+    for chunk_id, doc in list(docs_by_id.items()):
+        if doc.metadata.get("source") in selected:
+            continue
+        alias = next((s for s in sorted(shard.index.duplicate_sources(chunk_id)) if s in selected), None)
+        if alias is not None:
+            docs_by_id[chunk_id] = Chunk(doc.id, doc.page_content, {**doc.metadata, "source": alias})
+
+
+def _quote_pool(shards, embedding, processed, chunk_quotes):
+    """Candidate insight quotes and a quote -> sources map.
+
+    The nearest pre-indexed quotes from the candidates' books, or, for
+    libraries without a quote collection yet, the candidates' own quotes
+    (with no source map).
+    """
+    indexed = [shard for shard in shards if shard.index.quotes.count]
+    if not processed or not indexed:
+        return chunk_quotes, None
+
+    def search(shard):
+        books = {r["path"] for r in processed if r.get("library", shard.name) == shard.name}
+        return shard.index.quotes.search(embedding, QUOTE_CANDIDATES, books, distances=True) if books else []
+
+    hits = [hit for found in _fan_out(search, indexed) for hit in found]
+    if len(indexed) > 1:
+        hits = sorted(hits, key=lambda hit: hit[2])[:QUOTE_CANDIDATES]
+    quote_sources = {}
+    for q, sources, _ in hits:
+        quote_sources.setdefault(q, []).extend(s for s in sources if s not in quote_sources.get(q, ()))
+    return list(quote_sources), quote_sources
+
+
+def _rerank_plan(processed, quotes, top_k, mode, quote_sources=None):
+    """Decide which candidates and quotes the reranker scores.
+
+    "full" reranks every candidate and quote. In fast mode, candidates whose
+    vector similarity clears the top-k boundary by `FAST_RERANK_MARGIN` are
+    kept as-is and those clearly below it are dropped; if what is left fits
+    the remaining slots nothing is reranked ("skip"), otherwise up to
+    `FAST_RERANK_TOP` of the ambiguous ones are ("partial"). Slots still
+    open are filled from "fill": the other ambiguous candidates, then the
+    rest, in fused order. With no confident candidate and many ambiguous
+    ones it falls back to "full".
+    """
+    full = {"path": "full", "rerank": list(range(len(processed))) if len(processed) > 2 else [],
+            "keep": [], "quotes": quotes, "pool": quotes, "quote_sources": quote_sources}
+    sims = sorted((r["vector_score"] for r in processed if r["vector_score"] is not None), reverse=True)
+    if mode != "fast" or not sims:
+        return full
+
+    boundary = sims[min(top_k, len(sims)) - 1]
+    locked, ambiguous = [], []
+    for i, r in enumerate(processed):
+        sim = r["vector_score"]
+        if sim is not None and sim >= boundary + FAST_RERANK_MARGIN:
+            locked.append(i)
+        elif (sim is None and i < top_k) or (sim is not None and sim > boundary - FAST_RERANK_MARGIN):
+            ambiguous.append(i)
+
+    slots = top_k - len(locked)
+    placed = set(locked + ambiguous)
+    rest = [i for i in range(len(processed)) if i not in placed]
+    if len(ambiguous) <= slots:
+        return {"path": "skip", "rerank": [], "keep": sorted(locked + ambiguous), "fill": rest, "quotes": [],
+                "pool": quotes, "quote_sources": quote_sources, "boundary": boundary}
+    if not locked and len(ambiguous) > FAST_RERANK_TOP:
+        return full
+    rerank = ambiguous[:FAST_RERANK_TOP]
+    if quote_sources is None:
+        quotes = dedupe_quotes(processed[i]["quotes"] for i in locked + rerank)
+    return {"path": "partial", "rerank": rerank, "keep": locked, "fill": ambiguous[FAST_RERANK_TOP:] + rest,
+            "quotes": quotes if len(quotes) > 5 else [], "pool": quotes,
+            "quote_sources": quote_sources, "boundary": boundary}
+
+
+def _rerank_passages(processed, plan):
+    # Chunks and their quotes are scored in the same reranker batch
+    return [processed[i]["content"] for i in plan["rerank"]] + plan["quotes"]
+
+
+def _rank(top_k, processed, plan, scores):
+    """Apply reranker scores; returns the top results and the quote scores."""
+    n = len(plan["rerank"])
+    quote_scores = dict(zip(plan["quotes"], scores[n:]))
+
+    if plan["path"] != "full":
+        # Fast paths pick the results (reranked ones fill the slots after the kept ones),
+        # then list them by the vector similarity they report
+        for r in processed:
+            r["score"] = r["vector_score"] if r["vector_score"] is not None else plan["boundary"]
+        reranked = sorted(zip(plan["rerank"], scores[:n]), key=lambda x: x[1], reverse=True)
+        order = plan["keep"] + [i for i, _ in reranked] + plan["fill"]
+        top_results = sorted((processed[i] for i in order[:top_k]), key=lambda r: r["score"], reverse=True)
+    elif n:
+        rerank_scores = scores[:n]
         min_s, max_s = min(rerank_scores), max(rerank_scores)
         for i, score in enumerate(rerank_scores):
             processed[i]["score"] = (
@@ -280,28 +1007,284 @@ def search_database(query, top_k=5, book_filter=None):
                 else 0.5
             )
         processed.sort(key=lambda x: x["score"], reverse=True)
+        top_results = processed[:top_k]
     else:
         for r in processed:
             r["score"] = r["raw_score"]
+        top_results = processed[:top_k]
+    return top_results, quote_scores
+
+
+def _insight(query, top_results, plan, quote_scores, trace):
+    with trace.stage("insight"):
+        if plan["quote_sources"] is not None:
+            # Looked-up quotes arrive nearest first; keep those from the books shown
+            books = {r["path"] for r in top_results}
+            quotes = [q for q in plan["pool"] if books.intersection(plan["quote_sources"][q])] or plan["pool"]
+        else:
+            quotes = dedupe_quotes(r["quotes"] for r in top_results)
+        return insight_from_quotes(quotes, query, quote_scores, rerank=plan["path"] != "skip")
 
-    top_results = processed[:top_k]
-    insight = generate_quality_insight([r["content"] for r in top_results], query)
-    
-    return top_results, insight
 
+def _records(results):
+    """Result dicts as returned and cached; lean mode keeps only the fields front ends show."""
+    if MEMORY_LEAN:
+        return [{k: r[k] for k in RESULT_FIELDS if k in r} for r in results]
+    return [dict(r) for r in results]
+
+
+def _finish(query, top_k, processed, plan, scores, trace):
+    """Apply reranker scores and build the insight from the top results."""
+    top_results, quote_scores = _rank(top_k, processed, plan, scores)
+    return top_results, _insight(query, top_results, plan, quote_scores, trace)
+
+
+def _search(query, top_k, book_filter, vector_weight, keyword_weight, engine, trace, mode=RERANK_MODE,
+            libraries=None):
+    results, insight = [], ""
+    for kind, value in _search_steps(
+        query, top_k, book_filter, vector_weight, keyword_weight, engine, trace, mode, libraries
+    ):
+        if kind == "results":
+            results = value
+        elif kind == "insight":
+            insight = value
+    return results, insight
+
+
+def _search_steps(query, top_k, book_filter, vector_weight, keyword_weight, engine, trace, mode=RERANK_MODE,
+                  libraries=None):
+    """The search pipeline as ("candidates" | "results" | "insight", value) events.
+
+    "candidates" is the fused order before reranking and may be skipped;
+    "results" and "insight" always follow, in that order.
+    """
+    try:
+        with trace.stage("load_engine"):
+            engine = engine or SearchEngine.get()
+            shards = engine.select(libraries)
+            engine.refresh_index()
+    except Exception as e:
+        yield "results", []
+        yield "insight", f"❌ Search error: {e}"
+        return
+
+    key = _cache_key(engine, shards, query, top_k, book_filter, vector_weight, keyword_weight, mode)
+    with trace.stage("result_cache"):
+        cached = result_cache.get(key)
+    if cached is not None:
+        trace.count("result_cache", 1)
+        trace.meta["rerank_path"] = "cached"
+        results, insight = cached
+        yield "results", [dict(r) for r in results]
+        yield "insight", insight
+        return
+
+    scope = _candidate_scope(engine, shards, top_k, book_filter, vector_weight, keyword_weight)
+    try:
+        with trace.stage("embed_query"):
+            query_embedding = engine.embedding_function.embed_query(query)
+        with trace.stage("semantic_cache"):
+            reused = _reuse_candidates(scope, query_embedding)
+        if reused is not None:
+            trace.count("semantic_cache", 1)
+            trace.meta["semantic_match"] = reused[3]
+        else:
+            vector_hits, keyword_hits, docs_by_id = _retrieve(
+                engine, shards, [query], [query_embedding], top_k * 3, book_filter, trace
+            )[0]
+            trace.count("keyword_search", len(keyword_hits))
+            trace.count("vector_search", len(vector_hits))
+            with trace.stage("fusion"):
+                fused = _fuse(vector_hits, keyword_hits, vector_weight, keyword_weight)
+    except Exception as e:
+        yield "results", []
+        yield "insight", f"❌ Search error: {e}"
+        return
+
+    if reused is None:
+        with trace.stage("quote_extraction"):
+            processed, quotes, skipped = _candidates(
+                fused, docs_by_id, top_k, dict(vector_hits), _fingerprints(shards)
+            )
+        trace.count("quote_extraction", len(quotes))
+        trace.count("near_duplicates", skipped)
+    else:
+        processed, quotes, quote_sources, _ = reused
+
+    if not processed:
+        result_cache.put(key, ([], "🔍 No quality results found"))
+        yield "results", []
+        yield "insight", "🔍 No quality results found"
+        return
+
+    yield "candidates", [
+        {**r, "score": r["vector_score"] if r["vector_score"] is not None else 0.0}
+        for r in processed[:top_k]
+    ]
+
+    if reused is None:
+        with trace.stage("quote_lookup"):
+            quotes, quote_sources = _quote_pool(shards, query_embedding, processed, quotes)
+        trace.count("quote_lookup", len(quotes))
+        _remember_candidates(scope, query, query_embedding, processed, quotes, quote_sources)
+
+    plan = _rerank_plan(processed, quotes, top_k, mode, quote_sources)
+    trace.meta["rerank_path"] = plan["path"]
+    passages = _rerank_passages(processed, plan)
+    with trace.stage("rerank", items=len(passages)):
+        scores = engine.reranker.score(query, passages) if passages else []
+
+    top_results, quote_scores = _rank(top_k, processed, plan, scores)
+    records = _records(top_results)
+    yield "results", [dict(r) for r in records]
+    insight = _insight(query, top_results, plan, quote_scores, trace)
+    result_cache.put(key, (records, insight))
+    yield "insight", insight
+
+
+def _vector_search_many(db, embeddings, k, filter_dict):
+    """One Chroma query for many embeddings; a list of (Chunk, distance) lists."""
+    if not embeddings:
+        return []
+    results = db._collection.query(
+        query_embeddings=embeddings,
+        n_results=k,
+        where=filter_dict,
+        include=["documents", "metadatas", "distances"],
+    )
+    return [
+        [
+            (Chunk(chunk_id, text, metadata or {}), distance)
+            for text, metadata, chunk_id, distance in zip(
+                results["documents"][i], results["metadatas"][i], results["ids"][i], results["distances"][i]
+            )
+        ]
+        for i in range(len(embeddings))
+    ]
+
+
+def search_many(
+    queries,
+    top_k=5,
+    book_filter=None,
+    vector_weight=VECTOR_WEIGHT,
+    keyword_weight=KEYWORD_WEIGHT,
+    engine=None,
+    trace=None,
+    mode=RERANK_MODE,
+    libraries=None,
+):
+    """search_database for many queries, sharing each model call across all of them.
+
+    Queries are embedded in one batch, searched in one Chroma query per
+    library, and every (query, passage) pair is reranked together;
+    paraphrases of recent queries reuse their candidates and skip retrieval.
+    Returns a list of (results, insight) in query order;
+    ``trace.meta["rerank_paths"]`` counts the rerank path each query took.
+    """
+    queries = list(queries)
+    trace = trace or Trace("search_many", queries=len(queries), top_k=top_k)
+    with trace.stage("load_engine"):
+        engine = engine or SearchEngine.get()
+        shards = engine.select(libraries)
+        engine.refresh_index()
+
+    keys = [
+        _cache_key(engine, shards, q, top_k, book_filter, vector_weight, keyword_weight, mode) for q in queries
+    ]
+    outputs = [result_cache.get(key) for key in keys]
+    todo = [i for i, out in enumerate(outputs) if out is None]
+    trace.count("result_cache", len(queries) - len(todo))
+    paths = trace.meta.setdefault("rerank_paths", {})
+    if len(todo) < len(queries):
+        paths["cached"] = paths.get("cached", 0) + len(queries) - len(todo)
+    if not todo:
+        return [([dict(r) for r in results], insight) for results, insight in outputs]
+
+    scope = _candidate_scope(engine, shards, top_k, book_filter, vector_weight, keyword_weight)
+    with trace.stage("embed_query", items=len(todo)):
+        embeddings = engine.embedding_function.embed_queries([queries[i] for i in todo])
+    with trace.stage("semantic_cache"):
+        reused = [_reuse_candidates(scope, embedding) for embedding in embeddings]
+    trace.count("semantic_cache", sum(r is not None for r in reused))
+    fresh = [j for j, r in enumerate(reused) if r is None]
+
+    hits = []
+    if fresh:
+        hits = _retrieve(
+            engine, shards, [queries[todo[j]] for j in fresh], [embeddings[j] for j in fresh],
+            top_k * 3, book_filter, trace,
+        )
+    trace.count("keyword_search", sum(len(keyword) for _, keyword, _ in hits))
+    trace.count("vector_search", sum(len(vector) for vector, _, _ in hits))
+    with trace.stage("fusion"):
+        fusions = [_fuse(vector, keyword, vector_weight, keyword_weight) for vector, keyword, _ in hits]
+
+    with trace.stage("quote_extraction"):
+        fingerprints = _fingerprints(shards)
+        candidates = list(reused)
+        for j, fused, (vector, _, docs_by_id) in zip(fresh, fusions, hits):
+            processed, quotes, skipped = _candidates(fused, docs_by_id, top_k, dict(vector), fingerprints)
+            candidates[j] = (processed, quotes)
+            trace.count("near_duplicates", skipped)
+
+    with trace.stage("quote_lookup"):
+        pools = [(r[1], r[2]) if r is not None else None for r in reused]
+        for j in fresh:
+            processed, quotes = candidates[j]
+            pools[j] = _quote_pool(shards, embeddings[j], processed, quotes)
+            if processed:
+                _remember_candidates(scope, queries[todo[j]], embeddings[j], processed, *pools[j])
+        candidates = [(c[0], c[1]) for c in candidates]
+
+    pairs, spans, plans = [], [], []
+    for i, (processed, _), (quotes, quote_sources) in zip(todo, candidates, pools):
+        plan = _rerank_plan(processed, quotes, top_k, mode, quote_sources)
+        plans.append(plan)
+        if processed:
+            paths[plan["path"]] = paths.get(plan["path"], 0) + 1
+        passages = _rerank_passages(processed, plan) if processed else []
+        spans.append((len(pairs), len(pairs) + len(passages)))
+        pairs.extend((queries[i], p) for p in passages)
+    with trace.stage("rerank", items=len(pairs)):
+        scores = engine.reranker.score_pairs(pairs) if pairs else []
+
+    for i, (processed, _), plan, (start, end) in zip(todo, candidates, plans, spans):
+        if not processed:
+            outputs[i] = ([], "🔍 No quality results found")
+        else:
+            top_results, insight = _finish(queries[i], top_k, processed, plan, scores[start:end], trace)
+            outputs[i] = (_records(top_results), insight)
+        result_cache.put(keys[i], outputs[i])
+    return [([dict(r) for r in results], insight) for results, insight in outputs]
+
+
+def describe_caches():
+    exact, semantic = result_cache.stats(), semantic_cache.stats()
+    return (
+        f"🧠 Result cache: {exact['hits']} hits ({exact['hit_rate']:.0%}); "
+        f"semantic cache: {semantic['hits']} paraphrase hits ({semantic['hit_rate']:.0%}), "
+        f"{semantic['entries']} entries"
+    )
+
+
+def query_database(query, top_k=5, show_timings=False, client=None, mode=RERANK_MODE, libraries=None):
+    """CLI wrapper for search_database, or for a query server when `client` is given."""
+    search = client.search_database if client is not None else search_database
+    results, insight, trace = search(query, top_k, return_trace=True, mode=mode, libraries=libraries)
 
-def query_database(query, top_k=5):
-    """CLI wrapper for search_database."""
-    results, insight = search_database(query, top_k)
-    
     if not results:
         print(insight) # Will contain error or "no results" message
-        return
+        if show_timings:
+            print(trace.describe())
+        return trace
 
     print(f"\n🔍 Top {len(results)} Results for: '{query}'\n")
     for i, res in enumerate(results, 1):
         print(f"📌 Result {i} (Relevance: {res['score']:.2f})")
-        print(f"📚 Source: {res['source']}")
+        library = f" ({res['library']})" if res.get("library") else ""
+        print(f"📚 Source: {res['source']}{library}")
         print("━" * 80)
         print(format_content(res["content"]))
         print()
@@ -311,3 +1294,42 @@ def query_database(query, top_k=5):
     print("═" * 80)
     print(insight)
     print("\n" + "═" * 80 + "\n")
+    if mode == "fast":
+        print(f"⚡ Fast mode: {trace.meta.get('rerank_path', 'full')} rerank")
+    if show_timings:
+        print(trace.describe())
+    return trace
+
+
+def query_batch(questions, output, top_k=5, batch_size=QUERY_BATCH_SIZE, client=None, mode=RERANK_MODE,
+                libraries=None):
+    """Answer every question and stream one JSON line per question to `output`.
+
+    Locally, questions go through search_many `batch_size` at a time; with
+    a query server `client`, they are sent concurrently and batched there.
+    """
+    import json
+
+    questions = [q.strip() for q in questions if q.strip()]
+    trace = Trace("query_batch", queries=len(questions), top_k=top_k)
+    with open(output, "w", encoding="utf-8") as f:
+        for start in range(0, len(questions), batch_size):
+            chunk = questions[start:start + batch_size]
+            if client is not None:
+                with trace.stage("server", items=len(chunk)), ThreadPoolExecutor(SERVER_WORKERS) as pool:
+                    answers = list(pool.map(
+                        lambda q: client.search_database(q, top_k, mode=mode, libraries=libraries), chunk
+                    ))
+            else:
+                answers = search_many(chunk, top_k, trace=trace, mode=mode, libraries=libraries)
+            for question, (results, insight) in zip(chunk, answers):
+                record = {"query": question, "results": results, "insight": insight}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            print(f"📝 {min(start + batch_size, len(questions))}/{len(questions)} questions answered")
+    trace.finish()
+    rate = len(questions) / trace.total if trace.total else 0.0
+    print(f"✅ {len(questions)} questions in {trace.total:.1f}s ({rate:.1f} queries/sec) → {output}")
+    if client is None:
+        print(describe_caches())
+    return trace
@@ -1,51 +1,199 @@
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from utils import clean_text
+from config import (
+    CHROMA_DIR,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MODEL,
+    HIGHLIGHTS_DIR,
+    QUOTE_COLLECTION,
+)
+from embedding_cache import EmbeddingCache
+from index_health import (
+    collection_stats,
+    compact_collection,
+    dir_size,
+    format_bytes,
+    orphaned_segments,
+    recall_at_k,
+    remove_orphaned_segments,
+    vacuum_catalogue,
+)
+from generations import activate, active_directory, build_generation, collect_garbage
+from indexing import CHUNK_COLLECTION, IndexManifest, format_stats, open_client
+from models import load_embeddings
+from snapshot import export_snapshot, import_snapshot
+from tracing import Trace
 from shutil import rmtree
 import time
 import os
 
 
-# --- Load documents ---
-class CleanTextLoader(TextLoader):
-    def load(self):
-        docs = super().load()
-        for doc in docs:
-            doc.page_content = clean_text(doc.page_content)
-        return docs
+def clean_database(persist_directory=CHROMA_DIR):
+    """Delete the database folder.
 
+    It is renamed out of the way first, so a failed delete never leaves a
+    half-removed database where the app would open it.
+    """
+    if not os.path.exists(persist_directory):
+        return True
+    trash = f"{os.path.normpath(persist_directory)}.deleting-{os.getpid()}"
+    try:
+        os.replace(persist_directory, trash)
+    except OSError as e:
+        print(f"❌ Could not remove {persist_directory}: {e}. Is the app or server still using it?")
+        return False
+    rmtree(trash, ignore_errors=True)
+    if os.path.exists(trash):
+        print(f"⚠️ Some files in {trash} could not be deleted; remove it once nothing uses them.")
+    return True
 
-def clean_database():
-    if os.path.exists("chroma_db"):
-        try:
-            rmtree("chroma_db")
-        except OSError as e:
-            print(f"⚠️ Error cleaning DB: {e}. Retrying...")
-            time.sleep(1)
-            try:
-                rmtree("chroma_db")
-            except OSError:
-                print("❌ Failed to fully clean DB. Attempting to proceed anyway.")
+
+def create_database(
+    highlights_dir=HIGHLIGHTS_DIR,
+    persist_directory=CHROMA_DIR,
+    embedding_model=EMBEDDING_MODEL,
+    embedding_cache_dir=EMBEDDING_CACHE_DIR,
+):
+    # --- Local embedding model ---
+    embedding_function = load_embeddings(embedding_model, cache_dir=embedding_cache_dir)
+
+    # --- Build a new generation beside the live one; content seen before is embedded from cache ---
+    trace = Trace("create_database")
+    path, _, index, stats = build_generation(
+        embedding_function, embedding_model, highlights_dir, persist_directory, trace=trace
+    )
+    activate(persist_directory, path)
+    removed = collect_garbage(persist_directory)
+    total = len(index.keywords.docs)
+
+    print(f"✅ Database created with {total} chunks: {format_stats(stats)}")
+    _describe_duplicates(*index.duplicate_stats())
+    print(f"🔀 Now serving generation {path.name}" + (f"; {removed} old generations removed" if removed else ""))
+    print(f"🧠 {embedding_function.cache.describe()}")
+    stats["chunks"] = total
+    stats["trace"] = trace.finish()
+    print(trace.describe())
+    return stats
 
 
-def create_database():
-    loader = DirectoryLoader("highlights", glob="**/*.md", loader_cls=CleanTextLoader)
-    docs = loader.load()
+def _describe_duplicates(chunks, stored):
+    if chunks > stored:
+        print(
+            f"🧬 {chunks - stored} of {chunks} chunks are near-duplicates sharing a stored copy "
+            f"({(chunks - stored) / chunks:.1%} fewer vectors)"
+        )
 
-    # --- Semantic chunking for better context ---
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800, chunk_overlap=150, separators=["\n\n", "\n", ".", " ", ""]
+
+def _describe(stats):
+    print(
+        f"📚 {stats['name']}: {stats['count']} vectors, space {stats['space']}, M {stats['M']}, "
+        f"ef_construction {stats['ef_construction']}, ef_search {stats['ef_search']}"
+    )
+    print(
+        f"   HNSW graph: {stats['graph_elements']} elements, {stats['deleted']} deleted "
+        f"({stats['deleted_ratio']:.1%}), {stats['unflushed']} log entries not yet flushed, "
+        f"{format_bytes(stats['bytes'])}"
     )
-    chunks = splitter.split_documents(docs)
 
-    # --- Local embedding model ---
-    embedding_function = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2"
+
+def database_stats(persist_directory=CHROMA_DIR, recall_k=None):
+    """Print size and fragmentation of the collections; optionally their recall@k."""
+    if not os.path.exists(persist_directory):
+        print(f"❌ No database at {persist_directory}. Run `python run.py database create` first.")
+        return None
+    persist_directory = active_directory(persist_directory)
+    client = open_client(persist_directory)
+    orphaned = sum(dir_size(p) for p in orphaned_segments(persist_directory))
+    print(
+        f"📊 {persist_directory}: {format_bytes(dir_size(persist_directory))} on disk "
+        f"({format_bytes(orphaned)} in segments of dropped collections)"
     )
+    chunks = [c for entry in IndexManifest.load(persist_directory).files.values() for c in entry["chunks"]]
+    _describe_duplicates(len(chunks), sum("dup_of" not in c for c in chunks))
+    results = []
+    for name in (CHUNK_COLLECTION, QUOTE_COLLECTION):
+        stats = collection_stats(client, persist_directory, name)
+        _describe(stats)
+        if recall_k:
+            stats["recall"] = recall_at_k(client.get_collection(name), recall_k)
+            print(f"   recall@{recall_k} vs exact search: {stats['recall']:.3f}")
+        results.append(stats)
+    return results
 
-    # --- Create Chroma DB ---
-    Chroma.from_documents(chunks, embedding_function, persist_directory="chroma_db")
 
-    print(f"✅ Database created with {len(chunks)} chunks")
+def compact_database(persist_directory=CHROMA_DIR, recall_k=None):
+    """Rebuild every ANN index from its stored embeddings and drop leftover segment files."""
+    if not os.path.exists(persist_directory):
+        print(f"❌ No database at {persist_directory}. Run `python run.py database create` first.")
+        return None
+    persist_directory = active_directory(persist_directory)
+    client = open_client(persist_directory)
+    before = dir_size(persist_directory)
+    for name in (CHUNK_COLLECTION, QUOTE_COLLECTION):
+        if recall_k:
+            print(f"🎯 {name} recall@{recall_k} before: {recall_at_k(client.get_collection(name), recall_k):.3f}")
+        start = time.perf_counter()
+        copied = compact_collection(client, name)
+        print(f"🧹 Compacted {name}: {copied} vectors re-indexed in {time.perf_counter() - start:.1f}s")
+        _describe(collection_stats(client, persist_directory, name))
+        if recall_k:
+            print(f"🎯 {name} recall@{recall_k} after: {recall_at_k(client.get_collection(name), recall_k):.3f}")
+    dropped = remove_orphaned_segments(persist_directory) + vacuum_catalogue(persist_directory)
+    after = dir_size(persist_directory)
+    change = f"{format_bytes(before - after)} smaller" if after <= before else f"{format_bytes(after - before)} larger"
+    print(
+        f"✅ Compaction complete: {format_bytes(before)} -> {format_bytes(after)} on disk ({change}: "
+        f"{format_bytes(dropped)} of old segments and free pages deleted, "
+        f"{format_bytes(max(0, dropped + after - before))} written by the rebuilt indexes)"
+    )
+    return {"before": before, "after": after, "reclaimed": before - after}
+
+
+def export_database(path, persist_directory=CHROMA_DIR):
+    """Write the current index to a snapshot folder another node can import."""
+    if not os.path.exists(persist_directory):
+        print(f"❌ No database at {persist_directory}. Run `python run.py database create` first.")
+        return None
+    trace = Trace("export_database")
+    try:
+        meta = export_snapshot(path, persist_directory, trace=trace)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None
+    collections = meta["collections"]
+    print(
+        f"📦 Exported {collections[CHUNK_COLLECTION]['count']} chunks and {collections[QUOTE_COLLECTION]['count']} "
+        f"quotes of {meta['files']} files ({meta['embedding_model']}) to {path}: {format_bytes(dir_size(path))}"
+    )
+    print(trace.finish().describe())
+    return meta
+
+
+def import_database(
+    path,
+    highlights_dir=HIGHLIGHTS_DIR,
+    persist_directory=CHROMA_DIR,
+    embedding_model=EMBEDDING_MODEL,
+    embedding_cache_dir=EMBEDDING_CACHE_DIR,
+):
+    """Serve a snapshot's index as a new generation, without embedding anything.
+
+    Its vectors also go into the embedding cache, so a later `database
+    create` re-embeds only files changed since the export.
+    """
+    trace = Trace("import_database")
+    cache = EmbeddingCache(embedding_cache_dir, embedding_model, max_entries=EMBEDDING_CACHE_SIZE)
+    try:
+        generation, meta = import_snapshot(
+            path, highlights_dir, persist_directory, embedding_model, embedding_cache=cache, trace=trace
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None
+    collections = meta["collections"]
+    print(
+        f"📥 Imported {collections[CHUNK_COLLECTION]['count']} chunks and {collections[QUOTE_COLLECTION]['count']} "
+        f"quotes of {meta['files']} files exported {meta['created'][:19]}"
+    )
+    print(f"🔀 Now serving generation {generation.name}")
+    print(trace.finish().describe())
+    return meta
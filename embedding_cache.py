@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a background rebuild and uploads then must not add to the cache at once
+    fcntl = None
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies share a cache entry."""
+    return " ".join(str(text).split())
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk cache of float32 vectors for a single embedding model.
+
+    Vectors live in a memory-mapped ``vectors.f32`` file. ``index.json`` maps
+    each text hash to its row and a last-used tick for LRU eviction, and
+    ``index.log`` appends the rows written since, so a write costs only its
+    own entries until the log is folded back into the index. Both are read on
+    first use, since only indexing needs them. Several processes may share a
+    cache: writers hold a lock file exclusively and readers hold it shared
+    while they catch up on the log and copy vectors out, so a row is never
+    read while another process reuses it.
+    """
+
+    INITIAL_CAPACITY = 1024
+    MIN_LOG_ENTRIES = 1024
+
+    def __init__(self, cache_dir, model_name, max_entries=100_000):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.dir = Path(cache_dir) / slug
+        self.index_path = self.dir / "index.json"
+        self.log_path = self.dir / "index.log"
+        self.vectors_path = self.dir / "vectors.f32"
+        self.model_name = model_name
+        self.max_entries = max_entries
+
+        self.dim = None
+        self.capacity = 0
+        self.rows = OrderedDict()  # key -> [row, last_used_tick], least recently used first
+        self.tick = 0
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loaded = False
+        self._keys = {}  # row -> key
+        self._free = set()
+        self._log_offset = 0
+        self._log_entries = 0
+        self._saved_mtime = None
+        self._lock = threading.Lock()
+
+    def _index_mtime(self):
+        try:
+            return self.index_path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        """Read the index if another process rewrote it, then apply log entries not seen yet."""
+        if not self.loaded or self._saved_mtime != self._index_mtime():
+            self._reset()
+            self.loaded = True
+            self._saved_mtime = self._index_mtime()
+            if self.index_path.exists() and self.vectors_path.exists():
+                try:
+                    data = json.loads(self.index_path.read_text(encoding="utf-8"))
+                    self.dim = data["dim"]
+                    self.rows = OrderedDict(sorted(data["rows"].items(), key=lambda kv: kv[1][1]))
+                    self.tick = data.get("tick", 0)
+                    self._keys = {row: key for key, (row, _) in self.rows.items()}
+                    self._map(data["capacity"])
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"⚠️ Ignoring unreadable embedding cache {self.dir}: {e}")
+                    self._reset()
+                    self.loaded = True
+        if self.dim is not None:
+            self._replay()
+
+    def _replay(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                tail = f.read()
+        except OSError:
+            return
+        capacity = self.capacity
+        for line in tail.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # cut short by a writer that crashed
+            if "capacity" in entry:
+                capacity = max(capacity, entry["capacity"])
+            else:
+                self._assign(entry["k"], entry["r"])
+            self._log_entries += 1
+        self._log_offset += len(tail)
+        if capacity > self.capacity:
+            self._map(capacity)
+
+    def _assign(self, key, row):
+        """Point `key` at `row`, dropping whichever key held the row before."""
+        previous = self._keys.pop(row, None)
+        if previous is not None and previous != key:
+            self.rows.pop(previous, None)
+        old = self.rows.pop(key, None)
+        if old is not None and old[0] != row:
+            del self._keys[old[0]]
+            self._free.add(old[0])
+        self._free.discard(row)
+        self.tick += 1
+        self.rows[key] = [row, self.tick]
+        self._keys[row] = key
+
+    def _map(self, capacity):
+        """Map `capacity` rows of the vectors file; rows past the old end start out free."""
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        self._free.update(r for r in range(self.capacity, capacity) if r not in self._keys)
+        self.capacity = capacity
+        self.vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim)
+        )
+
+    def unload(self):
+        """Drop the index and the mapping; the next lookup reads them again."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.dim, self.capacity, self.rows, self.tick, self.vectors = None, 0, OrderedDict(), 0, None
+        self._keys, self._free = {}, set()
+        self._log_offset = self._log_entries = 0
+        self.loaded = False
+
+    @contextmanager
+    def _file_lock(self, shared=False):
+        """Hold the cache's lock file: shared to read rows, exclusive to extend and save them."""
+        if fcntl is None or (shared and not self.dir.exists()):
+            yield
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / "lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _grow(self, needed):
+        """Make room for `needed` rows, doubling the file up to max_entries; True if it grew."""
+        target = max(self.capacity, self.INITIAL_CAPACITY)
+        while target < needed and target < self.max_entries:
+            target *= 2
+        target = min(target, self.max_entries)
+        if target <= self.capacity:
+            return False
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(target * self.dim * 4)
+        self._map(target)
+        return True
+
+    def _take_row(self):
+        """A free row, evicting the least recently used entry if there is none."""
+        if self._free:
+            return self._free.pop()
+        key, (row, _) = self.rows.popitem(last=False)
+        del self._keys[row]
+        self.evictions += 1
+        return row
+
+    def get_many(self, texts):
+        """Return a list with a vector (or None) per text."""
+        with self._lock, self._file_lock(shared=True):
+            self._load()
+            out = []
+            for text in texts:
+                key = text_key(text)
+                entry = self.rows.get(key)
+                if entry is None or self.vectors is None:
+                    self.misses += 1
+                    out.append(None)
+                    continue
+                self.hits += 1
+                self.tick += 1
+                entry[1] = self.tick
+                self.rows.move_to_end(key)
+                out.append(self.vectors[entry[0]].tolist())
+            return out
+
+    def put_many(self, texts, vectors):
+        if not texts:
+            return
+        with self._lock, self._file_lock():
+            self._load()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+            pending = {}
+            for text, vec in zip(texts, vectors):
+                key = text_key(text)
+                if key not in self.rows:
+                    pending.setdefault(key, vec)
+            items = list(pending.items())[: self.max_entries]
+            if not items:
+                return
+
+            entries = []
+            if self._grow(len(self.rows) + len(items)):
+                entries.append({"capacity": self.capacity})
+            for key, vec in items:
+                row = self._take_row()
+                self.vectors[row] = np.asarray(vec, dtype=np.float32)
+                self._assign(key, row)
+                entries.append({"k": key, "r": row})
+            self.vectors.flush()
+            log_limit = max(self.MIN_LOG_ENTRIES, len(self.rows))
+            if self._saved_mtime is None or self._log_entries + len(entries) > log_limit:
+                self._save()
+            else:
+                self._append(entries)
+
+    def _append(self, entries):
+        with open(self.log_path, "ab") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in entries).encode("utf-8"))
+            self._log_offset = f.tell()
+        self._log_entries += len(entries)
+
+    def _save(self):
+        """Write the whole index and start an empty log."""
+        data = {
+            "model": self.model_name,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "tick": self.tick,
+            "rows": self.rows,
+        }
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+        open(self.log_path, "wb").close()
+        self._log_offset = self._log_entries = 0
+        self._saved_mtime = self._index_mtime()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.rows),
+            "evictions": self.evictions,
+        }
+
+    def describe(self):
+        s = self.stats()
+        entries = f"{s['entries']} entries" if self.loaded else "index not loaded"
+        return (
+            f"Embedding cache: {s['hits']} hits, {s['misses']} misses "
+            f"({s['hit_rate']:.0%} hit rate), {entries}, {s['evictions']} evicted"
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for texts not seen before."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vec in zip(missing, computed):
+                vectors[i] = list(vec)
+            self.cache.put_many([texts[i] for i in missing], computed)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        """Several queries in one model call; like embed_query, these skip the cache."""
+        return self.embeddings.embed_documents(list(texts))
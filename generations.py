@@ -0,0 +1,281 @@
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from config import (
+    CHROMA_DIR,
+    EMBEDDING_CACHE_DIR,
+    INDEX_KEEP_GENERATIONS,
+    INDEX_SWITCH_GRACE,
+    MANIFEST_FILE,
+    QUOTE_COLLECTION,
+)
+from index_health import COPY_BATCH_SIZE
+from indexing import (
+    CHUNK_COLLECTION,
+    IndexManifest,
+    LibraryIndex,
+    close_client,
+    hnsw_metadata,
+    open_client,
+    open_collection,
+    stored_id,
+)
+from tracing import Trace
+
+# CHROMA_DIR/CURRENT names the live generation under CHROMA_DIR/generations/.
+# Databases built before generations keep their files directly in CHROMA_DIR.
+CURRENT_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+BUILD_NICENESS = 10  # background builds yield the CPU to searches
+
+
+def active_directory(root=CHROMA_DIR):
+    """The index directory searches should read: the current generation, or `root` for older layouts."""
+    try:
+        name = (Path(root) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except OSError:
+        return str(root)
+    return str(Path(root) / GENERATIONS_DIR / name) if name else str(root)
+
+
+def generations(root=CHROMA_DIR):
+    """Generation directories, oldest first (names sort by creation time)."""
+    path = Path(root) / GENERATIONS_DIR
+    return sorted(p for p in path.iterdir() if p.is_dir()) if path.is_dir() else []
+
+
+def new_generation(root=CHROMA_DIR):
+    name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{threading.get_ident() % 10000}"
+    path = Path(root) / GENERATIONS_DIR / name
+    path.mkdir(parents=True)
+    return path
+
+
+def activate(root, path):
+    """Point CURRENT at `path`; readers see either the old or the new generation, never a mix."""
+    pointer = Path(root) / CURRENT_FILE
+    tmp = pointer.with_suffix(".tmp")
+    tmp.write_text(Path(path).name, encoding="utf-8")
+    os.replace(tmp, pointer)
+
+
+def collect_garbage(root=CHROMA_DIR, keep=INDEX_KEEP_GENERATIONS):
+    """Delete generations older than the current one and the `keep` before it.
+
+    The previous generations stay so other processes can finish their
+    queries and notice the switch. Files from before generations count as
+    the oldest generation. Returns the number of generations removed.
+    """
+    active = Path(active_directory(root))
+    if active == Path(root):
+        return 0
+    older = [p for p in generations(root) if p.name < active.name]
+    doomed = older[: max(0, len(older) - keep)]
+    legacy = [p for p in Path(root).iterdir() if p.name not in (GENERATIONS_DIR, CURRENT_FILE)]
+    for path in doomed:
+        close_client(path)
+        shutil.rmtree(path, ignore_errors=True)
+    if legacy and len(older) >= keep:
+        close_client(root)
+        for path in legacy:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+        return len(doomed) + 1
+    return len(doomed)
+
+
+def release_later(path, delay=INDEX_SWITCH_GRACE):
+    """Close a replaced generation's Chroma client once in-flight queries have had time to finish."""
+    timer = threading.Timer(delay, close_client, args=(path,))
+    timer.daemon = True
+    timer.start()
+
+
+def validate(index, highlights_dir):
+    """Raise if a freshly built index is not fit to serve."""
+    manifest_ids = index.stored_chunk_ids()
+    count = index.db._collection.count()
+    if count != len(manifest_ids):
+        raise RuntimeError(f"collection holds {count} chunks but the manifest lists {len(manifest_ids)}")
+    if set(index.keywords.docs) != manifest_ids:
+        raise RuntimeError("keyword index does not match the manifest")
+    quote_ids = {q for entry in index.manifest.files.values() for q in entry.get("quotes", ())}
+    if index.quotes.count != len(quote_ids):
+        raise RuntimeError(f"quote index holds {index.quotes.count} quotes, expected {len(quote_ids)}")
+    if not manifest_ids and any(Path(highlights_dir).glob("**/*.md")):
+        raise RuntimeError(f"no chunks were indexed from {highlights_dir}")
+    if manifest_ids:
+        probe = index.db._collection.get(limit=1, include=["embeddings"])
+        found = index.db._collection.query(query_embeddings=probe["embeddings"], n_results=1, include=[])
+        if not found["ids"][0]:
+            raise RuntimeError("vector search returned nothing")
+
+
+def _copy_entries(source, target, ids=None):
+    """Copy entries (all, or those with `ids`) with their embeddings; returns the ids copied."""
+    copied = set()
+    if ids is None:
+        total = source.count()
+        batches = (dict(limit=COPY_BATCH_SIZE, offset=offset) for offset in range(0, total, COPY_BATCH_SIZE))
+    else:
+        ids = sorted(ids)
+        batches = (dict(ids=ids[start:start + COPY_BATCH_SIZE]) for start in range(0, len(ids), COPY_BATCH_SIZE))
+    for batch in batches:
+        data = source.get(include=["embeddings", "documents", "metadatas"], **batch)
+        if data["ids"]:
+            target.add(
+                ids=data["ids"],
+                embeddings=data["embeddings"],
+                documents=data["documents"],
+                metadatas=data["metadatas"],
+            )
+            copied.update(data["ids"])
+    return copied
+
+
+def seed_generation(source, path, embedding_model):
+    """Copy the chunks, quotes and sidecar indexes of the generation in `source` into `path`.
+
+    A build then only indexes files changed since, instead of writing every
+    chunk again. Stored vectors are copied as they are. Files whose chunks
+    could not all be copied, e.g. removed by a write meanwhile, are left out
+    of the copied manifest, so the build indexes them afresh. Returns the
+    number of files carried over.
+    """
+    manifest = IndexManifest.load(source, embedding_model)
+    if not manifest.is_compatible():
+        return 0
+    client, target = open_client(source), open_client(path)
+    wanted = {stored_id(c) for entry in manifest.files.values() for c in entry["chunks"]}
+    copied, chunks = set(), None
+    for name, ids in ((CHUNK_COLLECTION, wanted), (QUOTE_COLLECTION, None)):
+        try:
+            collection = client.get_collection(name)
+        except Exception:  # older layouts may lack the quote collection; the build fills it
+            continue
+        new = target.get_or_create_collection(name, metadata=hnsw_metadata(), embedding_function=None)
+        found = _copy_entries(collection, new, ids)
+        if name == CHUNK_COLLECTION:
+            copied, chunks = found, new
+
+    files = dict(manifest.files)
+    while True:
+        owned = {c["id"] for entry in files.values() for c in entry["chunks"] if "dup_of" not in c}
+        kept = {
+            source_path: entry
+            for source_path, entry in files.items()
+            if all(stored_id(c) in copied and stored_id(c) in owned for c in entry["chunks"])
+        }
+        if len(kept) == len(files):
+            break
+        files = kept
+    unowned = sorted(copied - owned)
+    if unowned:
+        chunks.delete(ids=unowned)
+    manifest.files = files
+    manifest.path = Path(path) / MANIFEST_FILE
+    manifest.save()
+    keywords = Path(source) / "bm25.json"
+    if keywords.exists():
+        shutil.copy2(keywords, Path(path) / "bm25.json")
+    return len(manifest.files)
+
+
+def build_generation(embedding_function, embedding_model, highlights_dir, root=CHROMA_DIR, trace=None,
+                     progress=None):
+    """Index `highlights_dir` into a new generation and validate it, without activating it.
+
+    The generation starts as a copy of the current one, so only files
+    changed since are indexed. Returns (path, db, index, stats); a failed
+    build leaves nothing behind.
+    """
+    path = new_generation(root)
+    trace = trace if trace is not None else Trace("build_generation")
+    try:
+        if progress:
+            progress("copying", 0, 0)
+        with trace.stage("seed_generation"):
+            seeded = seed_generation(active_directory(root), path, embedding_model)
+        trace.count("seed_generation", seeded)
+        db = open_collection(path, embedding_function)
+        index = LibraryIndex(db, str(path), embedding_model)
+        index.progress = progress
+        stats = index.sync_directory(highlights_dir, trace=trace)
+        # Copied quotes may be stale or lack metadata newer releases add, even with no file changed
+        index.sync_quotes(trace, full=True)
+        if progress:
+            progress("validating", 0, 0)
+        validate(index, highlights_dir)
+        index.progress = None
+    except BaseException:
+        close_client(path)
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return path, db, index, stats
+
+
+def _build_worker(embedding_model, highlights_dir, root, cache_dir, events):
+    from models import load_embeddings
+
+    if hasattr(os, "nice"):
+        os.nice(BUILD_NICENESS)
+    try:
+        trace = Trace("build_generation")
+        embedding_function = load_embeddings(embedding_model, cache_dir=cache_dir)
+        path, _, _, stats = build_generation(
+            embedding_function,
+            embedding_model,
+            highlights_dir,
+            root,
+            trace=trace,
+            progress=lambda *update: events.put(("progress", *update)),
+        )
+        print(f"🧠 {embedding_function.cache.describe()}")
+        events.put(("done", str(path), stats, trace.stages))
+    except BaseException as e:
+        events.put(("error", f"{type(e).__name__}: {e}"))
+
+
+def build_in_subprocess(embedding_model, highlights_dir, root=CHROMA_DIR, cache_dir=EMBEDDING_CACHE_DIR,
+                        trace=None, progress=None):
+    """`build_generation` in a separate process, so searches in this one keep their speed.
+
+    Chroma holds the GIL while it writes, which would otherwise stall every
+    query thread for the length of each batch. Returns (path, stats).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    events = ctx.Queue()
+    worker = ctx.Process(
+        target=_build_worker,
+        args=(embedding_model, str(highlights_dir), str(root), str(cache_dir), events),
+        name="build-generation",
+    )
+    worker.start()
+    try:
+        while True:
+            try:
+                kind, *payload = events.get(timeout=1)
+            except queue.Empty:
+                if not worker.is_alive():
+                    raise RuntimeError(f"index build process exited with code {worker.exitcode}")
+                continue
+            if kind == "progress" and progress:
+                progress(*payload)
+            elif kind == "error":
+                raise RuntimeError(payload[0])
+            elif kind == "done":
+                path, stats, stages = payload
+                break
+    finally:
+        worker.join()
+    if trace is not None:
+        for name, entry in stages.items():
+            trace.add(name, entry["seconds"], entry["items"])
+    return Path(path), stats
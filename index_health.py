@@ -0,0 +1,201 @@
+import os
+import random
+import re
+import shutil
+import sqlite3
+import struct
+from pathlib import Path
+
+from config import INGEST_BATCH_SIZE, RECALL_QUERIES
+from indexing import collection_space, exact_distances, hnsw_config, hnsw_metadata
+
+# Chroma persists each HNSW graph as hnswlib files, with a format version in front of the header
+_HEADER = struct.Struct("<iQQQQQQiIQQQdQ")
+_DELETE_MARK = 0x01  # in byte 2 of every element's level-0 link list
+_SEGMENT_DIR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+COPY_BATCH_SIZE = 8 * INGEST_BATCH_SIZE
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+def _catalogue(persist_directory):
+    """Vector segment ids per collection id and unflushed log entries per segment, from Chroma's sqlite."""
+    path = Path(persist_directory) / "chroma.sqlite3"
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        segments = dict(conn.execute("SELECT collection, id FROM segments WHERE scope = 'VECTOR'"))
+        all_segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        flushed = dict(conn.execute("SELECT segment_id, seq_id FROM max_seq_id"))
+        unflushed = {}
+        for collection, segment in segments.items():
+            unflushed[segment] = conn.execute(
+                "SELECT COUNT(*) FROM embeddings_queue WHERE topic LIKE ? AND seq_id > ?",
+                (f"%/{collection}", flushed.get(segment, 0)),
+            ).fetchone()[0]
+    finally:
+        conn.close()
+    return segments, all_segments, unflushed
+
+
+def read_graph(segment_dir):
+    """(elements, deleted) in the persisted HNSW graph; (0, 0) before its first flush."""
+    import numpy as np
+
+    header = Path(segment_dir) / "header.bin"
+    if not header.exists() or header.stat().st_size < _HEADER.size:
+        return 0, 0
+    fields = _HEADER.unpack(header.read_bytes()[:_HEADER.size])
+    elements, element_size = fields[3], fields[4]
+    if not elements:
+        return 0, 0
+    data = np.memmap(Path(segment_dir) / "data_level0.bin", dtype=np.uint8, mode="r", shape=(elements, element_size))
+    deleted = int(np.count_nonzero(data[:, 2] & _DELETE_MARK))
+    return elements, deleted
+
+
+def collection_stats(client, persist_directory, name):
+    collection = client.get_collection(name)
+    config = hnsw_config(collection)
+    segments, _, unflushed = _catalogue(persist_directory)
+    segment = segments.get(str(collection.id))
+    segment_dir = Path(persist_directory) / segment if segment else None
+    elements, deleted = read_graph(segment_dir) if segment_dir else (0, 0)
+    return {
+        "name": name,
+        "count": collection.count(),
+        "space": collection_space(collection),
+        "M": config.get("max_neighbors"),
+        "ef_construction": config.get("ef_construction"),
+        "ef_search": config.get("ef_search"),
+        "graph_elements": elements,
+        "deleted": deleted,
+        "deleted_ratio": deleted / elements if elements else 0.0,
+        "unflushed": unflushed.get(segment, 0),
+        "bytes": dir_size(segment_dir) if segment_dir and segment_dir.exists() else 0,
+    }
+
+
+def orphaned_segments(persist_directory):
+    """Segment folders left behind by dropped collections."""
+    _, known, _ = _catalogue(persist_directory)
+    return [
+        p for p in Path(persist_directory).iterdir()
+        if p.is_dir() and _SEGMENT_DIR_RE.match(p.name) and p.name not in known
+    ]
+
+
+def compact_collection(client, name):
+    """Rebuild `name`'s HNSW graph from its stored embeddings, with the configured settings.
+
+    Vectors, documents and metadata are copied into a fresh collection,
+    which then takes the old one's name; nothing is re-embedded.
+    """
+    old = client.get_collection(name)
+    staging = f"{name}.compact"
+    if staging in {c.name for c in client.list_collections()}:
+        client.delete_collection(staging)
+    metadata = {k: v for k, v in (old.metadata or {}).items() if not k.startswith("hnsw:")}
+    new = client.create_collection(staging, metadata={**metadata, **hnsw_metadata()}, embedding_function=None)
+
+    total = old.count()
+    for offset in range(0, total, COPY_BATCH_SIZE):
+        data = old.get(limit=COPY_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if data["ids"]:
+            new.add(
+                ids=data["ids"],
+                embeddings=data["embeddings"],
+                documents=data["documents"],
+                metadatas=data["metadatas"],
+            )
+    if new.count() != total:
+        client.delete_collection(staging)
+        raise RuntimeError(f"Copy of '{name}' is incomplete ({new.count()} of {total}); left it unchanged")
+
+    old.modify(name=f"{name}.old")
+    new.modify(name=name)
+    client.delete_collection(f"{name}.old")
+    return total
+
+
+def remove_orphaned_segments(persist_directory):
+    freed = 0
+    for path in orphaned_segments(persist_directory):
+        freed += dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+    return freed
+
+
+def vacuum_catalogue(persist_directory):
+    """Shrink Chroma's sqlite after a compaction.
+
+    Merges the full-text index segments the bulk copy left behind, then
+    gives the pages freed by dropped collections back to the filesystem.
+    """
+    path = Path(persist_directory) / "chroma.sqlite3"
+    before = path.stat().st_size
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO embedding_fulltext_search(embedding_fulltext_search) VALUES ('optimize')")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return before - path.stat().st_size
+
+
+def recall_at_k(collection, k=10, queries=RECALL_QUERIES, seed=0):
+    """Mean recall@k of Chroma's ANN search against an exact scan.
+
+    Sampled stored vectors serve as queries, each excluding itself. An ANN
+    hit counts if it is no further than the exact k-th neighbour, so ties
+    between duplicate vectors are not penalised.
+    """
+    import numpy as np
+
+    total = collection.count()
+    if total <= k:
+        return 1.0
+    ids = collection.get(include=[])["ids"]
+    sample = random.Random(seed).sample(ids, min(queries, len(ids)))
+    data = collection.get(ids=sample, include=["embeddings"])
+    sample, vectors = data["ids"], np.asarray(data["embeddings"], dtype=np.float32)
+    space = collection_space(collection)
+
+    ann = collection.query(query_embeddings=vectors, n_results=k + 1, include=["distances"])
+
+    # Exact k+1 nearest per query, scanning the stored vectors a page at a time
+    best_ids = [[] for _ in sample]
+    best = np.full((len(sample), 0), np.inf, dtype=np.float32)
+    for offset in range(0, total, COPY_BATCH_SIZE):
+        page = collection.get(limit=COPY_BATCH_SIZE, offset=offset, include=["embeddings"])
+        if not page["ids"]:
+            break
+        distances = exact_distances(np.asarray(page["embeddings"], dtype=np.float32), vectors, space)
+        merged = np.hstack([best, distances])
+        keep = np.argsort(merged, axis=1)[:, : k + 1]
+        best_ids = [[(prev + page["ids"])[j] for j in row] for prev, row in zip(best_ids, keep)]
+        best = np.take_along_axis(merged, keep, axis=1)
+
+    recalls = []
+    for qid, ann_ids, ann_dist, exact_ids, exact_dist in zip(sample, ann["ids"], ann["distances"], best_ids, best):
+        exact = [d for i, d in zip(exact_ids, exact_dist) if i != qid][:k]
+        found = [d for i, d in zip(ann_ids, ann_dist) if i != qid][:k]
+        threshold = exact[-1] + 1e-4 if exact else np.inf
+        recalls.append(sum(d <= threshold for d in found) / len(exact) if exact else 1.0)
+    return float(np.mean(recalls))
@@ -0,0 +1,594 @@
+import json
+import os
+from pathlib import Path
+
+from bm25 import BM25Index
+from cache import LRUCache
+from config import (
+    CHROMA_TELEMETRY,
+    EMBEDDING_MODEL,
+    FILTER_VECTOR_CACHE_SIZE,
+    HIGHLIGHTS_DIR,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    HNSW_M,
+    HNSW_SPACE,
+    MANIFEST_FILE,
+    QUOTE_COLLECTION,
+)
+from ingest import BatchWriter, content_hash, iter_split_files
+from lazy import ReadWriteLock
+from neardup import SimHashIndex, simhash
+from quote_index import QuoteIndex, quote_id
+from tracing import Trace
+
+
+CHUNK_COLLECTION = "langchain"  # langchain_chroma's default name, kept for existing databases
+
+
+def hnsw_metadata():
+    """Collection metadata carrying the configured HNSW settings."""
+    return {
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": HNSW_EF_SEARCH,
+    }
+
+
+def open_client(persist_directory):
+    import chromadb
+
+    # Telemetry flushes over the network at exit, adding seconds to every CLI run
+    settings = chromadb.config.Settings(anonymized_telemetry=CHROMA_TELEMETRY)
+    return chromadb.PersistentClient(path=str(persist_directory), settings=settings)
+
+
+def close_client(persist_directory):
+    """Stop the Chroma system serving `persist_directory` so its files can be released.
+
+    Clients for the same path share one system, so every collection opened
+    from it stops working.
+    """
+    import sys
+
+    if "chromadb" not in sys.modules:
+        return
+    from chromadb.api.client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(str(persist_directory), None)
+    if system is not None:
+        system.stop()
+
+
+def open_collection(persist_directory, embedding_function, collection_name=CHUNK_COLLECTION):
+    """Open a persistent Chroma collection with the settings every caller shares.
+
+    New collections get the configured HNSW settings. Space, M and
+    ef_construction of an existing one only change on `database compact`;
+    ef_search is updated in place.
+    """
+    from langchain_chroma import Chroma
+
+    db = Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        client=open_client(persist_directory),
+        collection_metadata=hnsw_metadata(),
+    )
+    if hnsw_config(db._collection).get("ef_search", HNSW_EF_SEARCH) != HNSW_EF_SEARCH:
+        db._collection.modify(configuration={"hnsw": {"ef_search": HNSW_EF_SEARCH}})
+    return db
+
+
+def hnsw_config(collection):
+    return (collection.configuration_json or {}).get("hnsw") or {}
+
+
+def collection_space(collection):
+    return hnsw_config(collection).get("space") or (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def exact_distances(vectors, queries, space):
+    """Chroma-compatible distances, one row per query."""
+    import numpy as np
+
+    queries = np.asarray(queries, dtype=np.float32)
+    dots = queries @ vectors.T
+    if space == "l2":
+        # Chroma's l2 space is squared euclidean distance
+        return (queries * queries).sum(1)[:, None] - 2 * dots + (vectors * vectors).sum(1)[None, :]
+    if space == "cosine":
+        norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(vectors, axis=1)[None, :]
+        return 1.0 - dots / np.maximum(norms, 1e-12)
+    return 1.0 - dots
+
+
+class Chunk:
+    """A stored chunk as search uses it; far lighter than a LangChain Document."""
+
+    __slots__ = ("id", "page_content", "metadata")
+
+    def __init__(self, id, page_content, metadata):
+        self.id = id
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+def get_chunks(db, ids):
+    """Chunk records for `ids`, read straight from the collection."""
+    if not ids:
+        return []
+    data = db._collection.get(ids=list(ids), include=["documents", "metadatas"])
+    return [Chunk(i, text, meta or {}) for i, text, meta in zip(data["ids"], data["documents"], data["metadatas"])]
+
+
+def chunk_ids(source, chunks):
+    """Deterministic ids so an unchanged chunk keeps its id across rebuilds."""
+    ids, seen = [], {}
+    for chunk in chunks:
+        base = content_hash(f"{source}\n{chunk.page_content}")[:32]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}-{n}")
+    return ids
+
+
+def stored_id(chunk):
+    """Id a manifest chunk is stored under: its own, or that of the near-duplicate stored for it."""
+    return chunk.get("dup_of", chunk["id"])
+
+
+def new_stats():
+    return {"files_changed": 0, "reused": 0, "embedded": 0, "duplicates": 0, "removed": 0}
+
+
+def add_stats(total, stats):
+    """Add the counts of `stats` into `total`, e.g. across libraries."""
+    for key in new_stats():
+        total[key] += stats.get(key, 0)
+    return total
+
+
+def format_stats(stats):
+    duplicates = f", {stats['duplicates']} near-duplicates not stored" if stats.get("duplicates") else ""
+    return (
+        f"{stats['reused']} chunks reused, {stats['embedded']} re-embedded{duplicates}, "
+        f"{stats['removed']} removed ({stats['files_changed']} files changed)"
+    )
+
+
+class IndexManifest:
+    """Content hashes of every indexed file and the chunks it produced."""
+
+    # 2: chunks carry word_count/quotes metadata
+    # 3: files list the ids of their quotes in the quote collection
+    # 4: chunks carry a SimHash; near-duplicates name the chunk stored for them in "dup_of"
+    VERSION = 4
+
+    def __init__(self, path, embedding_model=EMBEDDING_MODEL):
+        self.path = Path(path)
+        self.exists = False
+        self.expected_model = embedding_model
+        self.embedding_model = embedding_model
+        self.files = {}
+
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == self.VERSION:
+                    self.embedding_model = data.get("embedding_model")
+                    self.files = data.get("files", {})
+                    self.exists = True
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Ignoring unreadable index manifest {self.path}: {e}")
+
+    @classmethod
+    def load(cls, persist_directory, embedding_model=EMBEDDING_MODEL):
+        return cls(Path(persist_directory) / MANIFEST_FILE, embedding_model)
+
+    def is_compatible(self):
+        """True if the collection was built by this manifest with the current model."""
+        return self.exists and self.embedding_model == self.expected_model
+
+    def reset(self):
+        self.embedding_model = self.expected_model
+        self.files = {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": self.VERSION,
+            "embedding_model": self.embedding_model,
+            "files": self.files,
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.exists = True
+
+
+class LibraryIndex:
+    """A Chroma collection plus the manifest, keyword and quote indexes kept beside it.
+
+    Searches may read it while one writer updates it; `lock` keeps the
+    in-memory indexes consistent between them. With `repair=False`
+    (readers) a keyword index out of step with the manifest is left as
+    loaded, since a writer may be halfway through updating both.
+    """
+
+    def __init__(self, db, persist_directory, embedding_model=EMBEDDING_MODEL, repair=True):
+        self.db = db
+        self.lock = ReadWriteLock()
+        self.persist_directory = persist_directory
+        self.manifest = IndexManifest.load(persist_directory, embedding_model)
+        self.keywords = BM25Index.load(persist_directory)
+        self.quotes = QuoteIndex(open_collection(persist_directory, db.embeddings, QUOTE_COLLECTION))
+        self._quote_texts = {}  # quote id -> text, for quotes of files indexed since the last sync
+        self._touched_quotes = set()  # ids of quotes that files changed since the last sync referenced
+        self._vectors = LRUCache(maxsize=FILTER_VECTOR_CACHE_SIZE)  # (source, hash) -> (ids, vectors)
+        self.progress = None  # optional callback(phase, done, total) while indexing
+        self.near_duplicates = SimHashIndex()  # fingerprints of the stored chunks
+        self._dependents = {}  # stored chunk id -> sources with a near-duplicate of it
+        self._orphans = set()  # sources whose stored copy was deleted, to re-index
+        for source, entry in self.manifest.files.items():
+            self._track(source, entry)
+
+        if repair:
+            self.repair_keywords()
+        elif self.manifest.exists and not self.keywords.path.exists():
+            self.rebuild_keywords(save=False)
+
+    def repair_keywords(self):
+        """Rebuild the keyword index if it does not cover exactly the stored chunks."""
+        if self.manifest.exists and set(self.keywords.docs) != self.stored_chunk_ids():
+            self.rebuild_keywords()
+
+    def stored_chunk_ids(self):
+        """Ids of the chunks held in the collection (near-duplicates are not)."""
+        return {c["id"] for entry in self.manifest.files.values() for c in entry["chunks"] if "dup_of" not in c}
+
+    def duplicate_stats(self):
+        """(chunks in the manifest, chunks stored) across the library."""
+        chunks = sum(len(entry["chunks"]) for entry in self.manifest.files.values())
+        return chunks, len(self.stored_chunk_ids())
+
+    def duplicate_sources(self, chunk_id):
+        """Sources with a near-duplicate of the stored chunk `chunk_id`."""
+        with self.lock.read():
+            return tuple(self._dependents.get(chunk_id, ()))
+
+    def keyword_search(self, query, k=10, sources=None, ids=None):
+        with self.lock.read():
+            return self.keywords.search(query, k=k, sources=sources, ids=ids)
+
+    def _track(self, source, entry):
+        for c in entry["chunks"]:
+            if "dup_of" in c:
+                self._dependents.setdefault(c["dup_of"], set()).add(source)
+            elif "simhash" in c:
+                self.near_duplicates.add(c["id"], c["simhash"])
+
+    def _untrack(self, source, entry):
+        for c in entry["chunks"]:
+            if "dup_of" in c:
+                sources = self._dependents.get(c["dup_of"])
+                if sources:
+                    sources.discard(source)
+                    if not sources:
+                        del self._dependents[c["dup_of"]]
+            else:
+                self.near_duplicates.remove(c["id"])
+
+    def _orphan(self, ids, source=None):
+        """Queue files whose near-duplicates pointed at the deleted chunks `ids`."""
+        for chunk_id in ids:
+            for dependent in self._dependents.pop(chunk_id, ()):
+                if dependent != source and dependent in self.manifest.files:
+                    self._orphans.add(dependent)
+
+    def is_compatible(self):
+        return self.manifest.is_compatible()
+
+    def reset(self):
+        """Empty the collection and every sidecar index."""
+        self.db.reset_collection()
+        with self.lock.write():
+            self.manifest.reset()
+            self.keywords.reset()
+            self.near_duplicates = SimHashIndex()
+            self._dependents, self._orphans = {}, set()
+            self._quote_texts, self._touched_quotes = {}, set()
+        self.quotes.reset()
+
+    def rebuild_keywords(self, save=True):
+        """Recreate the keyword index from the text stored in the collection."""
+        print("🔤 Rebuilding keyword index...")
+        keywords = BM25Index(self.keywords.path)
+        ids = sorted(self.stored_chunk_ids())
+        if ids:
+            data = self.db.get(ids=ids, include=["documents", "metadatas"])
+            for chunk_id, text, meta in zip(data["ids"], data["documents"], data["metadatas"]):
+                keywords.add(chunk_id, text, (meta or {}).get("source"))
+        with self.lock.write():
+            self.keywords = keywords
+        if save:
+            keywords.save()
+
+    def sync_quotes(self, trace=None, full=False):
+        """Add and remove quote-collection entries to match the manifest.
+
+        Only quotes of files changed since the last sync are checked, unless
+        `full`, which reads the whole collection (e.g. one copied from an
+        older generation).
+        """
+        trace = trace if trace is not None else Trace("sync_quotes")
+        with trace.stage("sync_quotes"):
+            result = self.quotes.sync(
+                self.manifest.files, self._quote_texts, self._fetch_quote_texts, progress=self._report("quotes"),
+                ids=None if full else self._touched_quotes,
+            )
+        self._quote_texts, self._touched_quotes = {}, set()
+        trace.count("sync_quotes", result["added"])
+        return result
+
+    def _report(self, phase):
+        if self.progress is None:
+            return None
+        return lambda done, total: self.progress(phase, done, total)
+
+    def _fetch_quote_texts(self, ids):
+        """Recover quote text from chunk metadata, e.g. after an interrupted sync."""
+        wanted = set(ids)
+        chunk_ids = list(dict.fromkeys(
+            stored_id(c)
+            for entry in self.manifest.files.values()
+            if wanted.intersection(entry.get("quotes", ()))
+            for c in entry["chunks"]
+        ))
+        texts = {}
+        if chunk_ids:
+            for meta in self.db.get(ids=chunk_ids, include=["metadatas"])["metadatas"]:
+                for q in json.loads((meta or {}).get("quotes", "[]")):
+                    if quote_id(q) in wanted:
+                        texts.setdefault(quote_id(q), q)
+        return texts
+
+    def save(self):
+        self.manifest.save()
+        self.keywords.save()
+
+    def index_files(self, file_paths, stats=None, trace=None):
+        """Re-split and re-embed only the files (and chunks) whose content changed.
+
+        Changed files are loaded and split in worker processes and streamed to
+        a background writer that embeds and stores them in bounded batches.
+        """
+        stats = stats if stats is not None else new_stats()
+        trace = trace if trace is not None else Trace("index_files")
+
+        changed = {}
+        with trace.stage("hash_files", items=len(file_paths)):
+            for file_path in file_paths:
+                source = str(file_path)
+                try:
+                    file_hash = content_hash(Path(file_path).read_bytes())
+                except OSError as e:
+                    print(f"⚠️ Error loading {source}: {e}")
+                    continue
+
+                entry = self.manifest.files.get(source)
+                if entry and entry["hash"] == file_hash:
+                    stats["reused"] += len(entry["chunks"])
+                else:
+                    changed[source] = file_hash
+
+        if not changed:
+            return stats
+
+        print(f"✂️ Loading and splitting {len(changed)} changed files...")
+        writer = BatchWriter(self.db, on_flush=self.manifest.save)
+        report = self._report("files")
+        try:
+            loaded = iter_split_files(changed)
+            while True:
+                with trace.stage("load_split"):
+                    item = next(loaded, None)
+                if item is None:
+                    break
+                source, chunks, error = item
+                if error:
+                    print(f"⚠️ Error loading {source}: {error}")
+                    continue
+                trace.count("load_split", 1)
+                # Time spent here is mostly backpressure from the writer
+                with trace.stage("queue_chunks", items=len(chunks)):
+                    self._queue_file(writer, source, changed[source], chunks, stats)
+                if report:
+                    report(stats["files_changed"], len(changed))
+        finally:
+            with trace.stage("drain_writer"):
+                writer.close()
+            trace.add("embed_write", writer.write_seconds, writer.written)
+
+        with trace.stage("save_keywords"):
+            self.keywords.save()
+        print(f"⚡ Indexed {stats['embedded']} chunks at {writer.throughput():.1f} chunks/sec")
+        self._reindex_orphans(stats, trace)
+        self.sync_quotes(trace)
+        return stats
+
+    def _reindex_orphans(self, stats, trace):
+        """Store chunks again whose near-duplicate copy was deleted with another file."""
+        while self._orphans:
+            sources, self._orphans = sorted(self._orphans), set()
+            print(f"🧬 Re-indexing {len(sources)} files whose stored near-duplicates were removed...")
+            for source in sources:
+                self.manifest.files[source]["hash"] = None
+            self.index_files(sources, stats, trace)
+
+    def _queue_file(self, writer, source, file_hash, chunks, stats):
+        ids = chunk_ids(source, chunks)
+        entry = self.manifest.files.get(source)
+        if entry is None:
+            # Untracked file: drop anything indexed for it before the manifest existed
+            writer.delete(where={"source": source})
+        # Never hold the lock while handing work to the writer: it takes the lock to commit
+        with self.lock.write():
+            stale, fresh, new_entry, quotes = self._plan_file(source, file_hash, chunks, ids, entry, stats)
+        if stale:
+            writer.delete(ids=stale)
+        for i, c in fresh:
+            writer.add(i, c)
+
+        def commit():
+            with self.lock.write():
+                self.keywords.remove_many(stale)
+                for i, c in fresh:
+                    self.keywords.add(i, c.page_content, source)
+                self.manifest.files[source] = new_entry
+            for qid, q in quotes.items():
+                self._quote_texts.setdefault(qid, q)
+            self._touched_quotes.update(new_entry["quotes"], entry.get("quotes", ()) if entry else ())
+
+        writer.commit(commit)
+
+    def _plan_file(self, source, file_hash, chunks, ids, entry, stats):
+        """Work out a file's stale, fresh and near-duplicate chunks and track its new entry."""
+        new_ids = set(ids)
+        if entry is None:
+            old, stale = {}, []
+        else:
+            stale = [c["id"] for c in entry["chunks"] if "dup_of" not in c and c["id"] not in new_ids]
+            # Only chunks the file still has are kept; a near-duplicate whose stored copy is gone is indexed afresh
+            gone = set(stale)
+            old = {
+                c["id"]: c for c in entry["chunks"]
+                if c["id"] in new_ids
+                and ("dup_of" not in c or (c["dup_of"] in self.near_duplicates and c["dup_of"] not in gone))
+            }
+            self._untrack(source, entry)
+            self._orphan(stale, source)
+            # Fingerprints of deleted chunks stay out, so an edited chunk can't alias its old version
+            for c in old.values():
+                if "dup_of" not in c and "simhash" in c:
+                    self.near_duplicates.add(c["id"], c["simhash"])
+
+        records, fresh, duplicates = [], [], 0
+        for i, c in zip(ids, chunks):
+            if i in old:
+                records.append(old[i])
+                continue
+            fingerprint = simhash(c.page_content)
+            record = {"id": i, "hash": content_hash(c.page_content), "simhash": fingerprint}
+            copy = self.near_duplicates.find(fingerprint)
+            if copy is None:
+                fresh.append((i, c))
+                # Later chunks in this batch may duplicate it before it is written
+                self.near_duplicates.add(i, fingerprint)
+            else:
+                record["dup_of"] = copy
+                duplicates += 1
+            records.append(record)
+
+        stats["files_changed"] += 1
+        stats["reused"] += len(chunks) - len(fresh) - duplicates
+        stats["embedded"] += len(fresh)
+        stats["duplicates"] += duplicates
+        stats["removed"] += len(stale)
+
+        quotes = {}
+        for c in chunks:
+            for q in json.loads(c.metadata.get("quotes", "[]")):
+                quotes.setdefault(quote_id(q), q)
+
+        new_entry = {"hash": file_hash, "chunks": records, "quotes": list(quotes)}
+        self._track(source, new_entry)
+        return stale, fresh, new_entry, quotes
+
+    def remove_sources(self, sources, stats=None, trace=None):
+        """Delete every chunk indexed for the given sources."""
+        stats = stats if stats is not None else new_stats()
+        trace = trace if trace is not None else Trace("remove_sources")
+        with trace.stage("remove_sources", items=len(sources)):
+            removed = self._remove_sources(sources, stats)
+        if self._orphans:
+            self._reindex_orphans(stats, trace)
+        if removed:
+            self.sync_quotes(trace)
+        return stats
+
+    def _remove_sources(self, sources, stats):
+        removed, ids = 0, []
+        with self.lock.write():
+            for source in sources:
+                entry = self.manifest.files.pop(str(source), None)
+                if entry is None:
+                    continue
+                removed += 1
+                self._untrack(source, entry)
+                self._touched_quotes.update(entry.get("quotes", ()))
+                ids.extend(c["id"] for c in entry["chunks"] if "dup_of" not in c)
+            self._orphan(ids)
+            self.keywords.remove_many(ids)
+        if ids:
+            self.db.delete(ids=ids)
+        stats["removed"] += len(ids)
+        self.save()
+        return removed
+
+    def source_chunk_ids(self, sources):
+        """Stored chunk ids of the given sources, straight from the manifest.
+
+        Near-duplicates map to the chunk stored for them, which may belong to
+        another source.
+        """
+        files = self.manifest.files
+        with self.lock.read():
+            return list(dict.fromkeys(stored_id(c) for s in sources if s in files for c in files[s]["chunks"]))
+
+    def source_vectors(self, sources):
+        """(ids, float32 matrix) of the stored vectors for `sources`.
+
+        Per-source blocks are cached by file hash, so repeated filtered
+        searches only pay for the books they select.
+        """
+        import numpy as np
+
+        ids, blocks = [], []
+        for source in sources:
+            with self.lock.read():
+                entry = self.manifest.files.get(source)
+            if entry is None:
+                continue
+            copies = tuple(c["dup_of"] for c in entry["chunks"] if "dup_of" in c)
+            key = (source, entry["hash"], copies)
+            block = self._vectors.get(key)
+            if block is None:
+                wanted = list(dict.fromkeys(stored_id(c) for c in entry["chunks"]))
+                data = self.db.get(ids=wanted, include=["embeddings"])
+                block = (list(data["ids"]), np.asarray(data["embeddings"], dtype=np.float32))
+                self._vectors.put(key, block)
+            ids.extend(block[0])
+            blocks.append(block[1])
+        if not ids:
+            return [], None
+        vectors = np.vstack(blocks)
+        if len(set(ids)) < len(ids):
+            # Books sharing a stored near-duplicate
+            first = {chunk_id: i for i, chunk_id in reversed(list(enumerate(ids)))}
+            rows = sorted(first.values())
+            ids, vectors = [ids[i] for i in rows], vectors[rows]
+        return ids, vectors
+
+    def sync_directory(self, directory=HIGHLIGHTS_DIR, trace=None):
+        """Bring the collection in line with the markdown files in `directory`."""
+        trace = trace if trace is not None else Trace("sync_directory")
+        with trace.stage("list_files"):
+            paths = sorted(Path(directory).glob("**/*.md"))
+        current = {str(p) for p in paths}
+
+        stats = self.index_files(paths, trace=trace)
+        removed = [s for s in self.manifest.files if s not in current]
+        self.remove_sources(removed, stats, trace=trace)
+        return stats
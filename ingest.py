@@ -0,0 +1,175 @@
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from config import (
+    CHUNK_OVERLAP,
+    CHUNK_SEPARATORS,
+    CHUNK_SIZE,
+    INGEST_BATCH_SIZE,
+    INGEST_POOL_MIN_FILES,
+    INGEST_QUEUE_SIZE,
+    INGEST_WORKERS,
+)
+from text_processing import annotate_chunk
+
+
+def content_hash(data):
+    """SHA-256 hex digest of a string or bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=CHUNK_SEPARATORS
+    )
+
+
+def load_and_split(source):
+    """Load, clean, split and annotate one file. Runs inside the worker processes."""
+    from utils import CleanTextLoader
+
+    try:
+        docs = CleanTextLoader(source).load()
+    except Exception as e:
+        return source, None, str(e)
+    chunks = make_splitter().split_documents(docs)
+    for chunk in chunks:
+        annotate_chunk(chunk)
+    return source, chunks, None
+
+
+def iter_split_files(sources, workers=INGEST_WORKERS):
+    """Yield (source, chunks, error) as files finish loading, in completion order.
+
+    Small batches are handled inline; larger ones go to a process pool with at
+    most two files per worker in flight so memory stays bounded.
+    """
+    sources = list(sources)
+    if workers <= 1 or len(sources) < INGEST_POOL_MIN_FILES:
+        for source in sources:
+            yield load_and_split(source)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = iter(sources)
+        in_flight = set()
+        while True:
+            while len(in_flight) < workers * 2:
+                source = next(pending, None)
+                if source is None:
+                    break
+                in_flight.add(pool.submit(load_and_split, source))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class BatchWriter:
+    """Background thread that embeds and writes chunks to Chroma in bounded batches.
+
+    The producer blocks on a bounded queue when the writer falls behind.
+    Commit callbacks run on the writer thread once the chunks queued before
+    them have landed, followed by ``on_flush``.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, on_flush=None, batch_size=INGEST_BATCH_SIZE, queue_size=INGEST_QUEUE_SIZE):
+        self.db = db
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.buffer = []
+        self.deletes = []  # ids removed in one call at the next flush
+        self.commits = []
+        self.written = 0
+        self.write_seconds = 0.0
+        self.error = None
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, chunk_id, doc):
+        self._put(("add", chunk_id, doc))
+
+    def delete(self, ids=None, where=None):
+        self._put(("delete", ids, where))
+
+    def commit(self, callback):
+        """Run `callback` once everything queued before it has been written."""
+        self._put(("commit", callback))
+
+    def _put(self, item):
+        if self.error:
+            raise self.error
+        self.queue.put(item)
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self._thread.join()
+        if self.error:
+            raise self.error
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._STOP:
+                break
+            if self.error:
+                continue  # drain so the producer never blocks forever
+            try:
+                kind = item[0]
+                if kind == "add":
+                    self.buffer.append(item[1:])
+                    if len(self.buffer) >= self.batch_size:
+                        self._flush()
+                elif kind == "delete":
+                    if item[1] is not None:
+                        # Ids hash their source and text, so they never collide with queued adds
+                        self.deletes.extend(item[1])
+                    else:
+                        self.db.delete(where=item[2])
+                elif kind == "commit":
+                    self.commits.append(item[1])
+                    if not self.buffer:
+                        self._flush()
+            except Exception as e:
+                self.error = e
+        if not self.error:
+            try:
+                self._flush()
+            except Exception as e:
+                self.error = e
+
+    def _flush(self):
+        if self.deletes:
+            self.db.delete(ids=self.deletes)
+            self.deletes = []
+        if self.buffer:
+            ids = [i for i, _ in self.buffer]
+            start = time.perf_counter()
+            self.db.add_documents([d for _, d in self.buffer], ids=ids)
+            self.write_seconds += time.perf_counter() - start
+            self.written += len(self.buffer)
+            self.buffer = []
+            print(f"💾 {self.written} chunks written ({self.throughput():.1f} chunks/sec)")
+        commits, self.commits = self.commits, []
+        for callback in commits:
+            callback()
+        if commits and self.on_flush:
+            self.on_flush()
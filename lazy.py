@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Deferred:
+    """A value built on a background thread; ``get()`` blocks until it is ready."""
+
+    def __init__(self, name, loader, on_ready=None):
+        self.name = name
+        self.seconds = None
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._on_ready = on_ready
+        self._thread = threading.Thread(
+            target=self._run, args=(loader,), name=f"load-{name}", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def resolved(cls, name, value):
+        deferred = cls.__new__(cls)
+        deferred.name, deferred.seconds = name, 0.0
+        deferred._value, deferred._error, deferred._on_ready = value, None, None
+        deferred._done = threading.Event()
+        deferred._done.set()
+        return deferred
+
+    def _run(self, loader):
+        start = time.perf_counter()
+        try:
+            self._value = loader()
+        except BaseException as e:  # re-raised to whoever calls get()
+            self._error = e
+        self.seconds = time.perf_counter() - start
+        self._done.set()
+        if self._on_ready:
+            self._on_ready(self)
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def wait(self):
+        """Block until loading has finished, successfully or not."""
+        self._done.wait()
+        return self
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class ReadWriteLock:
+    """Many readers or one writer; a waiting writer holds off new readers.
+
+    Not re-entrant: a thread must not take the lock again while holding it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
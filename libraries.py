@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+from config import CHROMA_DIR, HIGHLIGHTS_DIR, LIBRARIES
+
+
+class Library:
+    """A highlights folder and the database root it is indexed into."""
+
+    __slots__ = ("name", "highlights_dir", "persist_directory")
+
+    def __init__(self, name, highlights_dir, persist_directory):
+        self.name = name
+        self.highlights_dir = str(highlights_dir)
+        self.persist_directory = str(persist_directory)
+
+    def owns(self, path):
+        """Whether `path` lies inside this library's highlights folder."""
+        try:
+            Path(path).resolve().relative_to(Path(self.highlights_dir).resolve())
+        except ValueError:
+            return False
+        return True
+
+    def source(self, path):
+        """`path` written the way the index stores it: inside this folder as given in the config."""
+        relative = Path(path).resolve().relative_to(Path(self.highlights_dir).resolve())
+        return str(Path(self.highlights_dir) / relative)
+
+
+def configured_libraries(spec=LIBRARIES, highlights_dir=HIGHLIGHTS_DIR, persist_directory=CHROMA_DIR):
+    """{name: Library} in configured order.
+
+    `spec` is "name=folder" pairs separated by commas; each library gets its
+    own database root under `persist_directory`. Without one, `highlights_dir`
+    is the only library and is indexed in `persist_directory` itself.
+    """
+    if not spec.strip():
+        name = Path(highlights_dir).name or "highlights"
+        return {name: Library(name, highlights_dir, persist_directory)}
+    libraries = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, _, folder = (part.strip() for part in entry.partition("="))
+        if not name or not folder:
+            raise ValueError(f"Library '{entry.strip()}' should look like name=folder")
+        if name in libraries:
+            raise ValueError(f"Library '{name}' is configured twice")
+        libraries[name] = Library(name, folder, os.path.join(persist_directory, name))
+    return libraries
+
+
+def select_libraries(libraries, names=None):
+    """The libraries called `names` (a list or comma-separated string), or all of them."""
+    if isinstance(names, str):
+        names = [n.strip() for n in names.split(",")]
+    names = [n for n in names or () if n]
+    if not names:
+        return list(libraries.values())
+    unknown = [n for n in names if n not in libraries]
+    if unknown:
+        raise ValueError(f"Unknown library '{unknown[0]}'; configured: {', '.join(libraries)}")
+    return [libraries[n] for n in dict.fromkeys(names)]
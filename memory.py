@@ -0,0 +1,76 @@
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+
+
+def rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def release_memory():
+    """Collect garbage and hand freed heap pages back to the OS; returns the bytes released."""
+    before = rss()
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    # glibc keeps freed arenas mapped; without a trim RSS never shrinks after large frees
+    libc = ctypes.util.find_library("c")
+    if libc and sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL(libc).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+    return max(0, before - rss())
+
+
+def deep_size(obj, _seen=None):
+    """Approximate bytes held by plain Python containers, strings and numbers."""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def model_bytes(model):
+    """Bytes of torch parameters and buffers behind a model wrapper (0 for stand-ins and ONNX)."""
+    for attr in (None, "embeddings", "_client", "model"):
+        inner = model if attr is None else getattr(model, attr, None)
+        if inner is None:
+            continue
+        if callable(getattr(inner, "parameters", None)) and callable(getattr(inner, "buffers", None)):
+            tensors = list(inner.parameters()) + list(inner.buffers())
+            return sum(t.numel() * t.element_size() for t in tensors)
+        if inner is not model:
+            found = model_bytes(inner)
+            if found:
+                return found
+    return 0
+
+
+def format_mb(n):
+    return f"{n / 2**20:8.1f} MB"
+
+
+def describe(report):
+    """Multi-line table of a memory report, largest component first."""
+    lines = [f"🧮 Memory: {format_mb(report['rss']).strip()} resident"]
+    for name, size in sorted(report["components"].items(), key=lambda x: x[1], reverse=True):
+        lines.append(f"  {name:<22}{format_mb(size)}")
+    return "\n".join(lines)
@@ -0,0 +1,154 @@
+import hashlib
+import math
+
+from langchain_core.embeddings import Embeddings
+from config import (
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MODEL,
+    INFERENCE_THREADS,
+    RERANK_BATCH_SIZE,
+    RERANK_CACHE_SIZE,
+    RERANKER_MODEL,
+)
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from rerank import CachedReranker
+from bm25 import TOKEN_RE
+
+# Model names starting with this prefix load the small built-in stand-ins below
+STAND_IN_PREFIX = "stand-in/"
+STAND_IN_EMBEDDING_MODEL = "stand-in/hashing-256"
+STAND_IN_RERANKER_MODEL = "stand-in/token-overlap"
+
+# CPU inference backends, selected with a "@backend" suffix on the model name
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def parse_model_spec(spec):
+    """Split "name@backend" into (name, backend); a bare name runs fp32 torch."""
+    name, sep, backend = spec.rpartition("@")
+    if not sep:
+        return spec, "torch"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}' in '{spec}' (expected one of {', '.join(BACKENDS)})")
+    return name, backend
+
+
+def limit_threads(threads=INFERENCE_THREADS):
+    """Cap torch's intra-op threads so several workers can share one machine."""
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+def _onnx_kwargs(threads):
+    kwargs = {"backend": "onnx"}
+    if threads > 0:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        kwargs["model_kwargs"] = {"session_options": options}
+    return kwargs
+
+
+def quantize_int8(module):
+    """Dynamic int8 quantization of the Linear layers, in place."""
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class HashingEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: no download, no torch, deterministic."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _embed(self, text):
+        vec = [0.0] * self.dim
+        for token in TOKEN_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+            vec[h % self.dim] += 1.0 if h & (1 << 31) else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class LazyEmbeddings(Embeddings):
+    """Forwards to an embedding function that may still be loading in the background."""
+
+    def __init__(self, deferred):
+        self.deferred = deferred
+
+    def embed_documents(self, texts):
+        return self.deferred.get().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.deferred.get().embed_query(text)
+
+
+class TokenOverlapReranker:
+    """CrossEncoder stand-in scoring pairs by query-token overlap."""
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        scores = []
+        for query, passage in pairs:
+            q = set(TOKEN_RE.findall(query.lower()))
+            p = set(TOKEN_RE.findall(passage.lower()))
+            scores.append(len(q & p) / (len(q) or 1))
+        return scores
+
+
+def build_embeddings(model_name=EMBEDDING_MODEL, threads=INFERENCE_THREADS):
+    """The bare embedding model for `model_name`, on the backend its suffix selects."""
+    name, backend = parse_model_spec(model_name)
+    if name.startswith(STAND_IN_PREFIX):
+        return HashingEmbeddings()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    limit_threads(threads)
+    if backend == "onnx":
+        return HuggingFaceEmbeddings(model_name=name, model_kwargs=_onnx_kwargs(threads))
+    embeddings = HuggingFaceEmbeddings(model_name=name)
+    if backend == "int8":
+        quantize_int8(embeddings._client)
+    return embeddings
+
+
+def build_cross_encoder(model_name=RERANKER_MODEL, threads=INFERENCE_THREADS):
+    """The bare CrossEncoder for `model_name`, on the backend its suffix selects."""
+    name, backend = parse_model_spec(model_name)
+    if name.startswith(STAND_IN_PREFIX):
+        return TokenOverlapReranker()
+
+    from sentence_transformers import CrossEncoder
+
+    limit_threads(threads)
+    if backend == "onnx":
+        return CrossEncoder(name, **_onnx_kwargs(threads))
+    model = CrossEncoder(name)
+    if backend == "int8":
+        quantize_int8(model.model)
+    return model
+
+
+def load_embeddings(model_name=EMBEDDING_MODEL, cache_dir=EMBEDDING_CACHE_DIR):
+    """Embedding function backed by the on-disk embedding cache."""
+    # The cache is keyed by the full name, so each backend keeps its own vectors
+    cache = EmbeddingCache(cache_dir, model_name, max_entries=EMBEDDING_CACHE_SIZE)
+    return CachedEmbeddings(build_embeddings(model_name), cache)
+
+
+def load_reranker(model_name=RERANKER_MODEL):
+    """CrossEncoder with batched scoring and a (query, passage) score cache."""
+    model = build_cross_encoder(model_name)
+    return CachedReranker(model, batch_size=RERANK_BATCH_SIZE, cache_size=RERANK_CACHE_SIZE)
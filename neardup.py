@@ -0,0 +1,83 @@
+import hashlib
+import re
+
+from config import DEDUP_INDEX_DISTANCE
+
+_WORD_RE = re.compile(r"\w+")
+SHINGLE_WORDS = 3
+BITS = 64
+
+
+def simhash(text, shingle=SHINGLE_WORDS):
+    """64-bit SimHash over word shingles; near-identical texts differ in only a few bits."""
+    import numpy as np
+
+    words = _WORD_RE.findall(str(text).lower())
+    if len(words) > shingle:
+        grams = [" ".join(words[i:i + shingle]) for i in range(len(words) - shingle + 1)]
+    else:
+        grams = [" ".join(words)] if words else []
+    if not grams:
+        return 0
+    digests = b"".join(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest() for g in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(grams), BITS)
+    majority = bits.sum(axis=0) * 2 > len(grams)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def distance(a, b):
+    """Number of differing bits between two fingerprints."""
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """Fingerprints of stored chunks, searchable for near-duplicates.
+
+    Fingerprints are split into ``max_distance + 1`` bands; two within
+    `max_distance` bits agree exactly on at least one band, so a lookup
+    only compares ids sharing a band. A negative distance turns lookups off.
+    """
+
+    def __init__(self, max_distance=DEDUP_INDEX_DISTANCE):
+        self.max_distance = max_distance
+        self.fingerprints = {}  # chunk id -> fingerprint
+        n = max(0, max_distance + 1)
+        edges = [round(i * BITS / n) for i in range(n + 1)] if n else []
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._buckets = [{} for _ in self._bands]
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def _keys(self, fingerprint):
+        return [(fingerprint >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, chunk_id, fingerprint):
+        self.remove(chunk_id)
+        self.fingerprints[chunk_id] = fingerprint
+        for bucket, key in zip(self._buckets, self._keys(fingerprint)):
+            bucket.setdefault(key, set()).add(chunk_id)
+
+    def remove(self, chunk_id):
+        fingerprint = self.fingerprints.pop(chunk_id, None)
+        if fingerprint is None:
+            return
+        for bucket, key in zip(self._buckets, self._keys(fingerprint)):
+            ids = bucket.get(key)
+            if ids:
+                ids.discard(chunk_id)
+                if not ids:
+                    del bucket[key]
+
+    def find(self, fingerprint):
+        """Id of the closest stored fingerprint within `max_distance`, or None."""
+        best, best_distance = None, self.max_distance + 1
+        for bucket, key in zip(self._buckets, self._keys(fingerprint)):
+            for chunk_id in bucket.get(key, ()):
+                d = distance(fingerprint, self.fingerprints[chunk_id])
+                if d < best_distance or (d == best_distance and best is not None and chunk_id < best):
+                    best, best_distance = chunk_id, d
+        return best
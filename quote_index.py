@@ -0,0 +1,132 @@
+import json
+
+from config import INGEST_BATCH_SIZE
+from ingest import content_hash
+
+# Quotes carry one "in:<source>" flag per source, so filters match every book a quote appears in
+SOURCE_KEY = "in:"
+
+
+def quote_id(quote):
+    """Case- and whitespace-insensitive id, so a quote is stored once per library."""
+    return content_hash(" ".join(quote.lower().split()))[:32]
+
+
+class QuoteIndex:
+    """Deduplicated, pre-cleaned quotes in their own Chroma collection.
+
+    Each quote records the sources it appears in: ``sources`` lists them as
+    JSON, an ``in:<source>`` flag per source lets filters match any of them,
+    and ``source`` holds the first (all that quotes indexed before the flags
+    carried, so filters still look at it).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.count = db._collection.count()
+
+    def reset(self):
+        self.db.reset_collection()
+        self.count = 0
+
+    def sync(self, files, texts, fetch_texts=None, progress=None, ids=None):
+        """Make the collection hold exactly the quotes `files` reference.
+
+        `files` is the manifest's {source: entry} map, whose entries list
+        quote ids; `texts` maps ids to quote text for newly seen quotes and
+        `fetch_texts(ids)` recovers any others. With `ids`, only those quotes
+        (the ones the changed files reference, before and after) are read
+        and fixed; otherwise the whole collection is. `progress(done, total)`
+        is called after each batch of added quotes.
+        """
+        wanted = {}
+        for source, entry in files.items():
+            for qid in entry.get("quotes", ()):
+                wanted.setdefault(qid, set()).add(source)
+        if ids is not None:
+            ids = set(ids)
+            if not ids:
+                return {"added": 0, "removed": 0, "moved": 0}
+            wanted = {qid: wanted[qid] for qid in ids if qid in wanted}
+
+        current, flagged = {}, {}
+        for existing in self._existing(ids):
+            for qid, meta in zip(existing["ids"], existing["metadatas"]):
+                meta = meta or {}
+                current[qid] = set(json.loads(meta.get("sources", "[]")))
+                flagged[qid] = {key[len(SOURCE_KEY):] for key in meta if key.startswith(SOURCE_KEY)}
+
+        stale = [qid for qid in current if qid not in wanted]
+        missing = [qid for qid in wanted if qid not in current]
+        # Quotes indexed before the per-source flags get them here too
+        moved = [qid for qid in wanted if qid in current and not current[qid] == flagged[qid] == wanted[qid]]
+
+        unknown = [qid for qid in missing if qid not in texts]
+        if unknown and fetch_texts:
+            texts = {**texts, **fetch_texts(unknown)}
+        missing = [qid for qid in missing if qid in texts]
+
+        if stale:
+            self.db.delete(ids=stale)
+        for start in range(0, len(missing), INGEST_BATCH_SIZE):
+            batch = missing[start:start + INGEST_BATCH_SIZE]
+            self.db.add_texts(
+                [texts[qid] for qid in batch],
+                metadatas=[self.metadata(wanted[qid]) for qid in batch],
+                ids=batch,
+            )
+            if progress:
+                progress(start + len(batch), len(missing))
+        if moved:
+            self.db._collection.update(
+                ids=moved,
+                metadatas=[self.metadata(wanted[qid], current[qid] | flagged[qid]) for qid in moved],
+            )
+
+        self.count = self.db._collection.count() if ids is not None else len(current) - len(stale) + len(missing)
+        if stale or missing:
+            print(f"💬 Quote index: {len(missing)} added, {len(stale)} removed ({self.count} quotes)")
+        return {"added": len(missing), "removed": len(stale), "moved": len(moved)}
+
+    def _existing(self, ids):
+        """Stored entries for `ids` in batches, or the whole collection for None."""
+        if ids is None:
+            yield self.db.get(include=["metadatas"])
+            return
+        ids = sorted(ids)
+        for start in range(0, len(ids), INGEST_BATCH_SIZE):
+            yield self.db.get(ids=ids[start:start + INGEST_BATCH_SIZE], include=["metadatas"])
+
+    @staticmethod
+    def metadata(sources, previous=()):
+        """Metadata for a quote found in `sources`; flags of `previous` sources no longer in it are cleared."""
+        sources = sorted(sources)
+        meta = {"source": sources[0], "sources": json.dumps(sources)}
+        meta.update({SOURCE_KEY + s: None for s in set(previous).difference(sources)})
+        meta.update({SOURCE_KEY + s: True for s in sources})
+        return meta
+
+    def search(self, embedding, k, sources=None, distances=False):
+        """[(quote, sources)] nearest to `embedding`, optionally from any of `sources`.
+
+        `sources` lists every source the quote appears in. With `distances`,
+        each pair also carries its distance, so hits from several libraries
+        can be merged.
+        """
+        if not self.count:
+            return []
+        where = None
+        if sources:
+            sources = sorted(sources)
+            where = {"$or": [{"source": {"$in": sources}}, *({SOURCE_KEY + s: True} for s in sources)]}
+        found = self.db._collection.query(
+            query_embeddings=[embedding],
+            n_results=min(k, self.count),
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        hits = [
+            (text, json.loads((meta or {}).get("sources") or "[]") or [(meta or {}).get("source")], distance)
+            for text, meta, distance in zip(found["documents"][0], found["metadatas"][0], found["distances"][0])
+        ]
+        return hits if distances else [(text, source) for text, source, _ in hits]
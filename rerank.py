@@ -0,0 +1,49 @@
+import hashlib
+
+from cache import LRUCache
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def passage_key(passage):
+    return hashlib.sha1(str(passage).encode("utf-8")).hexdigest()
+
+
+class CachedReranker:
+    """CrossEncoder wrapper that batches scoring and caches (query, passage) scores."""
+
+    def __init__(self, model, batch_size=64, cache_size=50_000):
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = LRUCache(maxsize=cache_size)
+        self.predict_calls = 0
+
+    def score(self, query, passages):
+        """Score every passage against `query` with at most one model call."""
+        return self.score_pairs([(query, p) for p in passages])
+
+    def score_pairs(self, pairs):
+        """Score (query, passage) pairs, sending only uncached ones to the model in one batch."""
+        keys = [(normalize_query(q), passage_key(p)) for q, p in pairs]
+        scores = [self.cache.get(key, _MISSING) for key in keys]
+
+        missing = [i for i, s in enumerate(scores) if s is _MISSING]
+        if missing:
+            self.predict_calls += 1
+            predicted = self.model.predict(
+                [pairs[i] for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            for i, s in zip(missing, predicted):
+                scores[i] = float(s)
+                self.cache.put(keys[i], scores[i])
+        return scores
+
+    def predict(self, pairs, **kwargs):
+        """CrossEncoder-compatible alias for score_pairs."""
+        return self.score_pairs(list(pairs))
@@ -1,5 +1,102 @@
 import argparse
 
+from config import RERANK_MODE, SERVER_ADDRESS, SERVER_HOST, SERVER_PORT
+
+
+def run_query(question, profile=False, server=None, mode=RERANK_MODE, libraries=None):
+    from data import query_database
+
+    client = None
+    if server:
+        from client import QueryClient
+
+        client = QueryClient(server)
+
+    if not profile:
+        query_database(question, client=client, mode=mode, libraries=libraries)
+        return
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.runcall(
+        query_database, question, show_timings=True, client=client, mode=mode, libraries=libraries
+    )
+    print("🔥 Top hotspots (cumulative time):")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+def run_batch(path, output, top_k=5, server=None, mode=RERANK_MODE, libraries=None):
+    from data import query_batch
+
+    client = None
+    if server:
+        from client import QueryClient
+
+        client = QueryClient(server)
+    with open(path, encoding="utf-8") as f:
+        questions = f.readlines()
+    query_batch(questions, output, top_k, client=client, mode=mode, libraries=libraries)
+
+
+def run_memory(question, server=None):
+    from memory import describe, rss
+
+    if server:
+        from client import QueryClient
+
+        print(describe(QueryClient(server).memory_report()))
+        return
+
+    baseline = rss()
+    import data
+
+    engine = data.SearchEngine.get().wait_until_ready()
+    data.search_database(question, engine=engine)
+    print(f"🧮 Before loading anything: {baseline / 2**20:.1f} MB")
+    print(describe(engine.memory_report()))
+    data.SearchEngine.reset()
+    print(f"🧮 After reset: {rss() / 2**20:.1f} MB")
+
+
+def run_database(command, names=None, recall_k=None, path=None):
+    """Run a `database` command once per selected library.
+
+    With several libraries configured, snapshots go to one subfolder of
+    `path` per library.
+    """
+    import os
+
+    from database import (
+        clean_database,
+        compact_database,
+        create_database,
+        database_stats,
+        export_database,
+        import_database,
+    )
+    from libraries import configured_libraries, select_libraries
+
+    configured = configured_libraries()
+    libraries = select_libraries(configured, names)
+    for library in libraries:
+        snapshot = os.path.join(path, library.name) if path and len(configured) > 1 else path
+        if len(libraries) > 1:
+            print(f"📚 Library {library.name} ({library.highlights_dir})")
+        if command == "create":
+            create_database(library.highlights_dir, library.persist_directory)
+        elif command == "clean":
+            clean_database(library.persist_directory)
+        elif command == "stats":
+            database_stats(library.persist_directory, recall_k=recall_k)
+        elif command == "compact":
+            compact_database(library.persist_directory, recall_k=recall_k)
+        elif command == "export":
+            export_database(snapshot, library.persist_directory)
+        elif command == "import":
+            import_database(snapshot, library.highlights_dir, library.persist_directory)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -10,39 +107,127 @@ def main():
 
     # Database group
     db_parser = subparsers.add_parser(
-        "database", help="Create or delete the local database."
+        "database", help="Create, inspect, compact or delete the local database."
     )
     db_subparsers = db_parser.add_subparsers(dest="db_command")
 
-    db_subparsers.add_parser(
+    create_parser = db_subparsers.add_parser(
         "create", help="Build the database from your markdown files."
     )
-    db_subparsers.add_parser("clean", help="Delete the database folder.")
+    clean_parser = db_subparsers.add_parser("clean", help="Delete the database folder.")
+    stats_parser = db_subparsers.add_parser(
+        "stats", help="Show vector counts, on-disk size and deleted-element ratio of the ANN indexes."
+    )
+    compact_parser = db_subparsers.add_parser(
+        "compact", help="Rebuild the ANN indexes from stored embeddings (no re-embedding) with the current HNSW settings."
+    )
+    for sub in (stats_parser, compact_parser):
+        sub.add_argument(
+            "--recall", type=int, nargs="?", const=10, metavar="K",
+            help="Also measure recall@K (default 10) of the ANN search against an exact scan.",
+        )
+    export_parser = db_subparsers.add_parser(
+        "export", help="Write the index (chunks, metadata and embeddings) to a snapshot folder for other nodes."
+    )
+    import_parser = db_subparsers.add_parser(
+        "import", help="Serve a snapshot made with the same embedding model, without re-embedding."
+    )
+    for sub in (export_parser, import_parser):
+        sub.add_argument("path", help="Snapshot folder.")
+    for sub in (create_parser, clean_parser, stats_parser, compact_parser, export_parser, import_parser):
+        sub.add_argument(
+            "--library", metavar="NAME[,NAME]", help="Only these configured libraries (default: all)."
+        )
 
     # Query
     query_parser = subparsers.add_parser(
         "query", help="Ask questions to your database (or use interactive mode)."
     )
     query_parser.add_argument("question", nargs="?", help="Your question (optional).")
+    query_parser.add_argument(
+        "--profile", action="store_true", help="Run each query under cProfile and print stage timings and hotspots."
+    )
+
+    query_parser.add_argument(
+        "--server", default=SERVER_ADDRESS or None, metavar="HOST:PORT",
+        help="Send queries to a running `serve` process instead of loading models here.",
+    )
+
+    query_parser.add_argument(
+        "--fast", action="store_const", const="fast", default=RERANK_MODE, dest="mode",
+        help="Rerank only candidates the embedding scores can't separate (reports the path taken).",
+    )
+    query_parser.add_argument(
+        "--batch", metavar="FILE", help="Answer every question in FILE (one per line) in batches."
+    )
+    query_parser.add_argument(
+        "--output", default="results.jsonl", help="JSONL file for --batch results (default: results.jsonl)."
+    )
+    query_parser.add_argument("--top-k", type=int, default=5, help="Results per question in --batch mode.")
+    query_parser.add_argument(
+        "--library", metavar="NAME[,NAME]", help="Search only these libraries (default: all of them)."
+    )
+
+    # Query server
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run a local query server that micro-batches concurrent searches."
+    )
+    serve_parser.add_argument("--host", default=SERVER_HOST)
+    serve_parser.add_argument("--port", type=int, default=SERVER_PORT)
+
+    # File watcher
+    watch_parser = subparsers.add_parser(
+        "watch", help="Keep the index in step with highlights/ as files are added, edited, renamed or deleted."
+    )
+    watch_parser.add_argument(
+        "--directory", action="append", help="Folder to watch; repeatable (default: every library's folder)."
+    )
+
+    # Memory report
+    memory_parser = subparsers.add_parser(
+        "memory", help="Report resident memory per component after a sample query, and after a reset."
+    )
+    memory_parser.add_argument("--question", default="How do I build better habits?", help="Sample query to run first.")
+    memory_parser.add_argument(
+        "--server", default=SERVER_ADDRESS or None, metavar="HOST:PORT",
+        help="Report on a running `serve` process instead.",
+    )
+
+    # Benchmarks
+    bench_parser = subparsers.add_parser(
+        "bench", help="Benchmark indexing and query latency on synthetic libraries."
+    )
+    bench_parser.add_argument(
+        "--scales", default="10,100", help="Comma-separated library sizes relative to highlights/ (default: 10,100)."
+    )
+    bench_parser.add_argument("--queries", type=int, default=50, help="Queries timed per library.")
+    bench_parser.add_argument(
+        "--stand-in", action="store_true", help="Use small built-in stand-in models (no downloads)."
+    )
+    bench_parser.add_argument("--text", action="store_true", help="Also run the text-processing micro-benchmark.")
+    bench_parser.add_argument(
+        "--fast", action="store_const", const="fast", default="full", dest="mode",
+        help="Time searches in fast rerank mode and compare them with full reranking.",
+    )
+    bench_parser.add_argument(
+        "--parity", choices=["int8", "onnx"], help="Also compare rankings from this backend against fp32 on highlights/."
+    )
+    bench_parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results.")
 
     args = parser.parse_args()
 
     # routing
     if args.command == "database":
-        from database import create_database, clean_database
-
-        if args.db_command == "create":
-            create_database()
-        elif args.db_command == "clean":
-            clean_database()
+        if args.db_command:
+            run_database(args.db_command, args.library, getattr(args, "recall", None), getattr(args, "path", None))
         else:
             db_parser.print_help()
 
     elif args.command == "query":
-        from data import query_database
-
-        if args.question:
-            query_database(args.question)
+        if args.batch:
+            run_batch(args.batch, args.output, args.top_k, args.server, args.mode, args.library)
+        elif args.question:
+            run_query(args.question, args.profile, args.server, args.mode, args.library)
         else:
             print("Interactive mode. Type 'exit' to quit.")
             while True:
@@ -51,7 +236,27 @@ def main():
                     break
                 if not question:
                     continue
-                query_database(question)
+                run_query(question, args.profile, args.server, args.mode, args.library)
+
+    elif args.command == "serve":
+        from server import serve
+
+        serve(args.host, args.port)
+
+    elif args.command == "watch":
+        from libraries import configured_libraries
+        from watcher import watch
+
+        watch(args.directory or [library.highlights_dir for library in configured_libraries().values()])
+
+    elif args.command == "memory":
+        run_memory(args.question, args.server)
+
+    elif args.command == "bench":
+        from bench import run_benchmarks
+
+        scales = [int(s) for s in args.scales.split(",") if s.strip()]
+        run_benchmarks(scales, args.queries, args.stand_in, args.output, args.text, args.parity, args.mode)
 
     else:
         parser.print_help()
@@ -0,0 +1,261 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from memory import rss
+from config import (
+    BATCH_MAX_SIZE,
+    BATCH_WINDOW_MS,
+    KEYWORD_WEIGHT,
+    RERANK_MODE,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    VECTOR_WEIGHT,
+)
+
+
+class MicroBatcher:
+    """Coalesces calls that arrive within `window` seconds into one `fn(items)` call.
+
+    While a batch is running, new calls queue up and go out together as the
+    next batch as soon as it finishes. `callers()` returns how many requests
+    could join; once all of them are waiting there is no point in waiting on.
+    """
+
+    def __init__(self, name, fn, loop, window=BATCH_WINDOW_MS / 1000, max_batch=BATCH_MAX_SIZE, callers=None):
+        self.name = name
+        self.callers = callers
+        self.fn = fn
+        self.loop = loop
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []  # (item, future)
+        self.running = False
+        self.batches = 0
+        self.items = 0
+        self._timer = None
+        # One thread per model: batches run back to back, never interleaved
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix=f"batch-{name}")
+
+    async def submit(self, item):
+        future = self.loop.create_future()
+        self.pending.append((item, future))
+        if not self.running:
+            full = min(self.max_batch, self.callers()) if self.callers else self.max_batch
+            if len(self.pending) >= full:
+                self._flush()
+            elif self._timer is None:
+                self._timer = self.loop.call_later(self.window, self._flush)
+        return await future
+
+    def call(self, item):
+        """Blocking submit for code running on worker threads."""
+        return asyncio.run_coroutine_threadsafe(self.submit(item), self.loop).result()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.running or not self.pending:
+            return
+        batch, self.pending = self.pending[: self.max_batch], self.pending[self.max_batch:]
+        self.running = True
+        self.loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            outputs = await self.loop.run_in_executor(self._executor, self.fn, [item for item, _ in batch])
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.running = False
+            # Whatever arrived meanwhile has already waited long enough
+            self._flush()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class _BatchedQueries:
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def embed_query(self, text):
+        return self.batcher.call(text)
+
+
+class _BatchedReranker:
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def score(self, query, passages):
+        return self.batcher.call((query, list(passages)))
+
+
+class BatchedEngine:
+    """SearchEngine view whose query embedding and reranking go through micro-batches."""
+
+    def __init__(self, engine, embed_batcher, rerank_batcher):
+        self.engine = engine
+        self.embedding_function = _BatchedQueries(embed_batcher)
+        self.reranker = _BatchedReranker(rerank_batcher)
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+
+def embed_batch(engine, texts):
+    return engine.embedding_function.embed_queries(texts)
+
+
+def rerank_batch(engine, requests):
+    """Score several (query, passages) requests with one reranker call."""
+    scores = engine.reranker.score_pairs([(q, p) for q, passages in requests for p in passages])
+    split, start = [], 0
+    for _, passages in requests:
+        split.append(scores[start:start + len(passages)])
+        start += len(passages)
+    return split
+
+
+class QueryServer:
+    """Local asyncio service owning one SearchEngine; speaks one JSON object per line."""
+
+    def __init__(self, engine=None, host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS,
+                 window=BATCH_WINDOW_MS / 1000, max_batch=BATCH_MAX_SIZE):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.window = window
+        self.max_batch = max_batch
+        # Each search runs its non-model stages (BM25, Chroma, quotes) on a worker thread
+        self.workers = ThreadPoolExecutor(workers, thread_name_prefix="search")
+        self.requests = 0
+        self.active = 0  # searches in flight
+
+    async def run(self, ready=None):
+        import data
+
+        loop = asyncio.get_running_loop()
+        self.engine = self.engine or data.SearchEngine.get()
+        self.embed_batcher = MicroBatcher(
+            "embed", lambda texts: embed_batch(self.engine, texts), loop, self.window, self.max_batch,
+            callers=lambda: self.active,
+        )
+        self.rerank_batcher = MicroBatcher(
+            "rerank", lambda reqs: rerank_batch(self.engine, reqs), loop, self.window, self.max_batch,
+            callers=lambda: self.active,
+        )
+        self.view = BatchedEngine(self.engine, self.embed_batcher, self.rerank_batcher)
+
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"🚀 Serving on {self.host}:{self.port} (batch window {self.window * 1000:.0f} ms, "
+              f"up to {self.max_batch} per batch)")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.embed_batcher.close()
+            self.rerank_batcher.close()
+            self.workers.shutdown(wait=False)
+
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.dispatch(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        op = request.get("op")
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        if op == "search":
+            self.active += 1
+            try:
+                return await loop.run_in_executor(self.workers, self._search, request)
+            finally:
+                self.active -= 1
+        if op == "add":
+            stats = await loop.run_in_executor(
+                self.workers, self.engine.add_documents_from_files, request["paths"], request.get("library")
+            )
+            return {"ok": True, "stats": _jsonable_stats(stats)}
+        if op == "rebuild":
+            stats = await loop.run_in_executor(self.workers, self.engine.rebuild, request.get("libraries"))
+            return {"ok": True, "stats": _jsonable_stats(stats)}
+        if op == "start_rebuild":
+            return {"ok": True, "started": self.engine.start_rebuild(request.get("libraries"))}
+        if op == "rebuild_status":
+            return {"ok": True, "rebuild": self.engine.rebuild_status()}
+        if op == "status":
+            import data
+
+            return {
+                "ok": True,
+                "requests": self.requests,
+                "startup": self.engine.startup_times(),
+                "embed": self.embed_batcher.stats(),
+                "rerank": self.rerank_batcher.stats(),
+                "result_cache": data.result_cache.stats(),
+                "semantic_cache": data.semantic_cache.stats(),
+                "rss": rss(),
+            }
+        if op == "memory":
+            return {"ok": True, "memory": await loop.run_in_executor(self.workers, self.engine.memory_report)}
+        return {"ok": False, "error": f"Unknown op '{op}'"}
+
+    def _search(self, request):
+        import data
+
+        results, insight, trace = data.search_database(
+            request["query"],
+            top_k=request.get("top_k", 5),
+            book_filter=request.get("book_filter"),
+            vector_weight=request.get("vector_weight", VECTOR_WEIGHT),
+            keyword_weight=request.get("keyword_weight", KEYWORD_WEIGHT),
+            engine=self.view,
+            return_trace=True,
+            mode=request.get("mode", RERANK_MODE),
+            libraries=request.get("libraries"),
+        )
+        return {"ok": True, "results": results, "insight": insight, "trace": trace.as_dict()}
+
+
+def _jsonable_stats(stats):
+    stats = dict(stats)
+    if "trace" in stats:
+        stats["trace"] = stats["trace"].as_dict()
+    return stats
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT):
+    try:
+        asyncio.run(QueryServer(host=host, port=port).run())
+    except KeyboardInterrupt:
+        print("👋 Server stopped.")
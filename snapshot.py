@@ -0,0 +1,187 @@
+import gzip
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from bm25 import BM25Index
+from config import CHROMA_DIR, EMBEDDING_MODEL, MANIFEST_FILE, QUOTE_COLLECTION
+from generations import activate, active_directory, collect_garbage, new_generation, validate
+from index_health import COPY_BATCH_SIZE
+from indexing import CHUNK_COLLECTION, IndexManifest, LibraryIndex, close_client, open_client, open_collection
+from quote_index import SOURCE_KEY, QuoteIndex
+from tracing import Trace
+
+# A snapshot is a folder holding snapshot.json, and per collection a float32
+# vector file (rows in id order, memory-mappable) and gzipped columns of ids,
+# documents and metadata, plus the manifest and keyword index as they were.
+SNAPSHOT_FILE = "snapshot.json"
+SNAPSHOT_VERSION = 1
+COLLECTIONS = (CHUNK_COLLECTION, QUOTE_COLLECTION)
+
+
+def read_snapshot(path):
+    """The description in a snapshot folder; ValueError if it is missing or from another version."""
+    try:
+        meta = json.loads((Path(path) / SNAPSHOT_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{path} is not a readable snapshot: {e}") from None
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is a version {meta.get('version')} snapshot; this release reads {SNAPSHOT_VERSION}")
+    return meta
+
+
+def _export_collection(collection, folder, trace):
+    total = collection.count()
+    vectors, columns, dim = None, {"ids": [], "documents": [], "metadatas": {}}, 0
+    for offset in range(0, total, COPY_BATCH_SIZE):
+        with trace.stage("read_chroma"):
+            data = collection.get(
+                limit=COPY_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"]
+            )
+        batch = np.asarray(data["embeddings"], dtype=np.float32)
+        if vectors is None:
+            dim = batch.shape[1]
+            vectors = np.memmap(folder / f"{collection.name}.f32", dtype=np.float32, mode="w+", shape=(total, dim))
+        with trace.stage("write_vectors", items=len(batch)):
+            vectors[offset:offset + len(batch)] = batch
+        start = len(columns["ids"])
+        columns["ids"].extend(data["ids"])
+        columns["documents"].extend(data["documents"])
+        for i, meta in enumerate(data["metadatas"]):
+            for key, value in (meta or {}).items():
+                if key.startswith(SOURCE_KEY):
+                    continue  # one column per book; rebuilt from "sources" on import
+                columns["metadatas"].setdefault(key, [None] * total)[start + i] = value
+    if vectors is None:
+        (folder / f"{collection.name}.f32").write_bytes(b"")
+    else:
+        vectors.flush()
+        del vectors
+    if len(columns["ids"]) != total:
+        raise RuntimeError(f"read {len(columns['ids'])} of {total} entries from '{collection.name}'")
+    with trace.stage("write_columns"):
+        with gzip.open(folder / f"{collection.name}.columns.json.gz", "wt", encoding="utf-8") as f:
+            json.dump(columns, f)
+    return {"count": total, "dim": dim}
+
+
+def export_snapshot(path, persist_directory=CHROMA_DIR, trace=None):
+    """Write the live index under `persist_directory` to a snapshot folder at `path`.
+
+    The snapshot is tagged with the embedding model the index was built
+    with. It is written beside `path` and moved into place when complete.
+    """
+    trace = trace if trace is not None else Trace("export_snapshot")
+    source = active_directory(persist_directory)
+    manifest = IndexManifest.load(source)
+    if not manifest.exists:
+        raise ValueError(f"No current index at {persist_directory}; run `python run.py database create` first")
+
+    target = Path(path)
+    staging = target.with_name(f"{target.name}.partial-{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    try:
+        client = open_client(source)
+        collections = {
+            name: _export_collection(client.get_collection(name), staging, trace) for name in COLLECTIONS
+        }
+        with trace.stage("copy_sidecars"):
+            shutil.copy2(manifest.path, staging / MANIFEST_FILE)
+            shutil.copy2(BM25Index.load(source).path, staging / "bm25.json")
+        meta = {
+            "version": SNAPSHOT_VERSION,
+            "embedding_model": manifest.embedding_model,
+            "manifest_version": IndexManifest.VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "generation": Path(source).name,
+            "files": len(manifest.files),
+            "collections": collections,
+        }
+        (staging / SNAPSHOT_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return meta
+
+
+def _import_collection(collection, folder, info, trace):
+    """Bulk-add one exported collection into an empty Chroma collection."""
+    name, total = collection.name, info["count"]
+    if not total:
+        return [], None
+    with trace.stage("read_columns"):
+        with gzip.open(folder / f"{name}.columns.json.gz", "rt", encoding="utf-8") as f:
+            columns = json.load(f)
+    vectors = np.memmap(folder / f"{name}.f32", dtype=np.float32, mode="r", shape=(total, info["dim"]))
+    keys = list(columns["metadatas"])
+    for start in range(0, total, COPY_BATCH_SIZE):
+        end = min(start + COPY_BATCH_SIZE, total)
+        metadatas = [
+            {key: columns["metadatas"][key][i] for key in keys if columns["metadatas"][key][i] is not None}
+            for i in range(start, end)
+        ]
+        if name == QUOTE_COLLECTION:
+            metadatas = [QuoteIndex.metadata(json.loads(meta["sources"])) for meta in metadatas]
+        with trace.stage("write_chroma", items=end - start):
+            collection.add(
+                ids=columns["ids"][start:end],
+                embeddings=np.ascontiguousarray(vectors[start:end]),
+                documents=columns["documents"][start:end],
+                metadatas=metadatas,
+            )
+    return columns["documents"], vectors
+
+
+def import_snapshot(path, highlights_dir, persist_directory=CHROMA_DIR, embedding_model=EMBEDDING_MODEL,
+                    embedding_cache=None, trace=None):
+    """Load a snapshot into a new generation of `persist_directory` and switch to it.
+
+    Vectors are inserted as stored, so no model runs. A snapshot made with
+    another embedding model is refused with ValueError. With
+    `embedding_cache`, its vectors are also cached so later rebuilds reuse
+    them. Returns (generation path, snapshot description).
+    """
+    trace = trace if trace is not None else Trace("import_snapshot")
+    folder = Path(path)
+    meta = read_snapshot(folder)
+    if meta["embedding_model"] != embedding_model:
+        raise ValueError(
+            f"Snapshot was made with {meta['embedding_model']}, but EMBEDDING_MODEL is {embedding_model}; "
+            "import it with the same model or run `python run.py database create`"
+        )
+    if meta["manifest_version"] != IndexManifest.VERSION:
+        raise ValueError(
+            f"Snapshot holds a version {meta['manifest_version']} manifest; this release needs "
+            f"{IndexManifest.VERSION}, so export it again with this release"
+        )
+
+    generation = new_generation(persist_directory)
+    try:
+        with trace.stage("copy_sidecars"):
+            shutil.copy2(folder / MANIFEST_FILE, generation / MANIFEST_FILE)
+            shutil.copy2(folder / "bm25.json", generation / "bm25.json")
+        db = open_collection(generation, None)
+        index = LibraryIndex(db, str(generation), embedding_model)
+        for name, collection in ((CHUNK_COLLECTION, db._collection), (QUOTE_COLLECTION, index.quotes.db._collection)):
+            texts, vectors = _import_collection(collection, folder, meta["collections"][name], trace)
+            if embedding_cache is not None and texts:
+                with trace.stage("seed_embedding_cache", items=len(texts)):
+                    embedding_cache.put_many(texts, vectors)
+        index.quotes.count = index.quotes.db._collection.count()
+        with trace.stage("validate"):
+            validate(index, highlights_dir)
+    except BaseException:
+        close_client(generation)
+        shutil.rmtree(generation, ignore_errors=True)
+        raise
+    activate(persist_directory, generation)
+    collect_garbage(persist_directory)
+    return generation, meta
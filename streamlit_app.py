@@ -4,6 +4,8 @@ import shutil
 from pathlib import Path
 import warnings
 import gc
+from config import RERANK_MODE, SERVER_ADDRESS, WATCH_IN_APP
+from libraries import configured_libraries
 
 # Suppress warnings
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
@@ -53,15 +55,87 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# With INSIGHTMINER_SERVER set, a running `run.py serve` does the work and this app is a thin client
+@st.cache_resource
+def get_client():
+    if not SERVER_ADDRESS:
+        return None
+    from client import QueryClient
+    return QueryClient(SERVER_ADDRESS)
+
+
+def get_engine():
+    client = get_client()
+    if client is not None:
+        return client
+    import data
+    return data.SearchEngine.get()
+
+# With INSIGHTMINER_WATCH=1 the app keeps the index in step with every library folder itself
+@st.cache_resource
+def get_watchers():
+    if not WATCH_IN_APP or get_client() is not None:
+        return []
+    from watcher import LibraryWatcher
+    return [LibraryWatcher(get_engine(), library.highlights_dir).start() for library in libraries.values()]
+
+# Directory listings are cached per folder mtime and cleared after adds and rebuilds
+@st.cache_data(show_spinner=False)
+def list_books(directory, mtime):
+    return sorted(p.name for p in Path(directory).glob("*.md"))
+
+
+def library_books(names=None):
+    books = set()
+    for name in names or libraries:
+        directory = Path(libraries[name].highlights_dir)
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except OSError:
+            continue
+        books.update(list_books(str(directory), mtime))
+    return sorted(books)
+
+
+def render_insight(slot, insight):
+    slot.markdown(f"""
+    <div class="insight-box">
+        <h3>✨ Insights</h3>
+        {insight.replace(chr(10), '<br>')}
+    </div>
+    """, unsafe_allow_html=True)
+
+
+def render_results(slot, results, ranked=True):
+    with slot.container():
+        st.markdown("### 🔍 Relevant Highlights" + ("" if ranked else " (ranking…)"))
+        for res in results:
+            score_tag = f"Match: {int(res['score'] * 100)}%" if ranked else "…"
+            source = f"{res['source']} · {res['library']}" if res.get("library") else res["source"]
+            st.markdown(f"""
+            <div class="card">
+                <span class="source-tag">📖 {source}</span>
+                <span class="score-tag">{score_tag}</span>
+                <div style="margin-top: 10px; line-height: 1.6;">
+                    {res['content'].replace(chr(10), '<br>')}
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+
 # --- Sidebar ---
 st.sidebar.title("📚 InsightMiner")
 st.sidebar.markdown("Explore your reading highlights insightfully.")
 
-highlights_dir = Path("highlights")
-highlights_dir.mkdir(exist_ok=True)
+libraries = configured_libraries()
+for library in libraries.values():
+    Path(library.highlights_dir).mkdir(parents=True, exist_ok=True)
 
 # 1. Add New Content
 st.sidebar.header("📥 Add New Content")
+upload_library = next(iter(libraries))
+if len(libraries) > 1:
+    upload_library = st.sidebar.selectbox("Library", options=list(libraries))
+highlights_dir = Path(libraries[upload_library].highlights_dir)
 uploaded_files = st.sidebar.file_uploader("Upload Book Highlights (.md)", accept_multiple_files=True, type=['md'])
 
 if uploaded_files:
@@ -75,11 +149,14 @@ if uploaded_files:
                         f.write(uploaded_file.getbuffer())
                     new_file_paths.append(file_path)
                 
-                import data
-                engine = data.SearchEngine.get()
-                engine.add_documents_from_files(new_file_paths)
+                engine = get_engine()
+                stats = engine.add_documents_from_files(new_file_paths, library=upload_library)
+                list_books.clear()
                 
-                st.sidebar.success(f"Successfully added {len(new_file_paths)} books!")
+                st.sidebar.success(
+                    f"Successfully added {len(new_file_paths)} books! "
+                    f"({stats['embedded']} chunks embedded, {stats['reused']} reused)"
+                )
                 st.rerun()
             except Exception as e:
                 st.sidebar.error(f"Error adding files: {e}")
@@ -90,22 +167,50 @@ st.sidebar.divider()
 st.sidebar.header("⚙️ Database Management")
 
 # Statistics
-if highlights_dir.exists():
-    num_books = len(list(highlights_dir.glob("*.md")))
-    st.sidebar.metric("Books Indexed", num_books)
-else:
-    st.sidebar.warning("No highlights folder found!")
+st.sidebar.metric("Books Indexed", len(library_books()))
+if len(libraries) > 1:
+    st.sidebar.caption(", ".join(f"{name}: {len(library_books([name]))}" for name in libraries))
 
-if st.sidebar.button("♻️ Full Rebuild", help="Clear and re-process ALL markdown files"):
-    with st.spinner("Rebuilding database from scratch..."):
-        try:
-            import data
-            engine = data.SearchEngine.get()
-            engine.rebuild()
-            st.sidebar.success("Database fully rebuilt!")
-            st.rerun()
-        except Exception as e:
-            st.sidebar.error(f"Error rebuilding database: {e}")
+for watcher in get_watchers():
+    status = watcher.status()
+    lag = f"{status['last_lag']:.1f}s" if status["last_lag"] is not None else "n/a"
+    st.sidebar.caption(f"👀 Watching {watcher.directory}: {status['pending']} pending, last index lag {lag}")
+
+# Rebuilds run in the background; searches keep using the current index until the new one is ready
+@st.fragment(run_every=1)
+def rebuild_progress():
+    if not st.session_state.get("rebuilding"):
+        return
+    status = get_engine().rebuild_status()
+    if status["state"] == "running":
+        total, done = status.get("total", 0), status.get("done", 0)
+        label = f"Rebuilding: {status.get('phase', 'starting')}"
+        if total:
+            label += f" {done}/{total}"
+        st.progress(done / total if total else 0.0, text=f"{label} ({status.get('seconds', 0):.0f}s)")
+        return
+    st.session_state.rebuilding = False
+    list_books.clear()
+    if status["state"] == "failed":
+        message = ("error", f"Rebuild failed, still serving the previous index: {status['error']}")
+    else:
+        message = ("success", f"Database rebuilt in {status['seconds']:.0f}s! {status['stats']}")
+    st.session_state.rebuild_message = message
+    st.rerun()
+
+
+if st.sidebar.button("♻️ Full Rebuild", help="Re-index ALL markdown files in the background, embedding only new text"):
+    try:
+        get_engine().start_rebuild()
+        st.session_state.rebuilding = True
+    except Exception as e:
+        st.sidebar.error(f"Error starting rebuild: {e}")
+
+with st.sidebar:
+    rebuild_progress()
+if "rebuild_message" in st.session_state:
+    kind, message = st.session_state.pop("rebuild_message")
+    getattr(st.sidebar, kind)(message)
 
 # --- Main Content ---
 
@@ -114,6 +219,8 @@ st.title("🧠 Mining...")
 # Lazy load the search engine to avoid UI freeze on startup if possible
 @st.cache_resource
 def get_search_engine():
+    if get_client() is not None:
+        return get_client()  # exposes the same search_database() as the data module
     try:
         import data
         # Ensure models are loaded
@@ -123,7 +230,7 @@ def get_search_engine():
         print(f"Error loading engine: {e}")
         return None
 
-if not Path("chroma_db").exists():
+if not any(Path(library.persist_directory).exists() for library in libraries.values()):
     st.info("👋 Welcome! It looks like your database hasn't been created yet.")
     st.info("Please click '♻️ Rebuild Database' in the sidebar to process your highlights.")
 else:
@@ -132,48 +239,78 @@ else:
     if not data_module:
         st.error("Could not load the search engine. Check logs for details.")
     else:
-        # Book Filter
-        available_books = [f.name for f in list(highlights_dir.glob("*.md"))]
+        # Library and Book Filters
+        selected_libraries = []
+        if len(libraries) > 1:
+            selected_libraries = st.multiselect(
+                "Libraries", options=list(libraries), placeholder="All libraries"
+            )
+        available_books = library_books(selected_libraries)
         selected_books = st.multiselect("Filter by Book (Optional)", options=available_books, placeholder="Select books to search within...")
         
+        fast_mode = st.toggle(
+            "⚡ Fast mode", value=RERANK_MODE == "fast",
+            help="Skip reranking when the embedding scores already decide the order."
+        )
+
         query = st.text_input("Ask a question to your library...", placeholder="e.g., How to build better habits?")
 
         if query:
-            with st.spinner("Thinking..."):
-                try:
-                    # search_database returns (results, insight_string)
-                    results, insight = data_module.search_database(query, book_filter=selected_books)
-                    
-                    if not results:
-                        st.warning("No results found. Try a different query.")
-                    else:
-                        # Display Insights
-                        st.markdown(f"""
-                    <div class="insight-box">
-                        <h3>✨ Insights</h3>
-                        {insight.replace(chr(10), '<br>')}
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                    st.markdown("### 🔍 Relevant Highlights")
-                    
-                    for res in results:
-                        source = res['source']
-                        score = res['score']
-                        content = res['content']
-                        
-                        st.markdown(f"""
-                        <div class="card">
-                            <span class="source-tag">📖 {source}</span>
-                            <span class="score-tag">Match: {int(score * 100)}%</span>
-                            <div style="margin-top: 10px; line-height: 1.6;">
-                                {content.replace(chr(10), '<br>')}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                except Exception as e:
-                    st.error(f"An error occurred during search: {e}")
+            mode = "fast" if fast_mode else "full"
+            insight_slot, results_slot = st.empty(), st.empty()
+            try:
+                if hasattr(data_module, "iter_search"):
+                    # Fused hits show first, the reranked order replaces them, the insight lands last
+                    results, insight, trace = [], "", None
+                    with st.spinner("Thinking..."):
+                        for kind, value in data_module.iter_search(
+                            query, book_filter=selected_books, mode=mode, libraries=selected_libraries
+                        ):
+                            if kind == "candidates":
+                                render_results(results_slot, value, ranked=False)
+                            elif kind == "results":
+                                results = value
+                                if results:
+                                    render_results(results_slot, results)
+                            elif kind == "insight":
+                                insight = value
+                                if results:
+                                    render_insight(insight_slot, insight)
+                            elif kind == "trace":
+                                trace = value
+                else:
+                    with st.spinner("Thinking..."):
+                        results, insight, trace = data_module.search_database(
+                            query, book_filter=selected_books, return_trace=True, mode=mode,
+                            libraries=selected_libraries,
+                        )
+                    if results:
+                        render_insight(insight_slot, insight)
+                        render_results(results_slot, results)
+
+                if not results:
+                    results_slot.empty()
+                    st.warning("No results found. Try a different query.")
+
+                with st.expander(f"⏱️ Timings ({trace.total * 1000:.0f} ms)"):
+                    st.table(trace.rows())
+                    st.caption(f"Rerank path: {trace.meta.get('rerank_path', 'full')}")
+                    shards = trace.meta.get("shards")
+                    if shards:
+                        st.caption("Per library: " + ", ".join(
+                            f"{name} {sum(stages.values()):.0f} ms" for name, stages in shards.items()
+                        ))
+                    match = trace.meta.get("semantic_match")
+                    if match:
+                        st.caption(f"Reused the candidates of “{match['query']}” (similarity {match['similarity']:.2f})")
+                    startup = get_engine().startup_times()
+                    st.caption("Startup: " + ", ".join(
+                        f"{name} {seconds:.1f}s" if seconds is not None else f"{name} loading…"
+                        for name, seconds in startup.items()
+                    ))
+
+            except Exception as e:
+                st.error(f"An error occurred during search: {e}")
 
 st.markdown("---")
 st.markdown("InsightMiner © 2026")
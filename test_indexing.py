@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from indexing import LibraryIndex, close_client, open_collection, stored_id
+from models import STAND_IN_EMBEDDING_MODEL, HashingEmbeddings
+
+
+def paragraph(seed, words=90):
+    rng = random.Random(seed)
+    vocabulary = [f"word{n}" for n in range(400)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words)) + "."
+
+
+def edited(text):
+    """`text` with a word added, close enough to stay a near-duplicate."""
+    return text[:-1] + " Edited."
+
+
+# Its fingerprint moves by a single bit when edited
+SHARED = paragraph(6)
+
+
+def write_book(folder, name, paragraphs):
+    path = folder / f"{name}.md"
+    path.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def library(tmp_path):
+    folder = tmp_path / "highlights"
+    folder.mkdir()
+    persist_directory = str(tmp_path / "chroma_db")
+    db = open_collection(persist_directory, HashingEmbeddings())
+    yield folder, LibraryIndex(db, persist_directory, STAND_IN_EMBEDDING_MODEL)
+    close_client(persist_directory)
+
+
+def stored_ids(index):
+    return set(index.db._collection.get(include=[])["ids"])
+
+
+def assert_consistent(index):
+    """Every manifest chunk resolves to a stored chunk, and keywords cover exactly those."""
+    stored = stored_ids(index)
+    for source, entry in index.manifest.files.items():
+        for c in entry["chunks"]:
+            assert stored_id(c) in stored, f"{source} points at missing chunk {stored_id(c)}"
+    assert index.stored_chunk_ids() == stored
+    assert set(index.keywords.docs) == stored
+
+
+def aliases(index, path):
+    return [c for c in index.manifest.files[str(path)]["chunks"] if "dup_of" in c]
+
+
+def test_near_duplicate_across_files_is_stored_once(library):
+    folder, index = library
+    a = write_book(folder, "Book A", [SHARED, paragraph(2)])
+    index.index_files([a])
+    b = write_book(folder, "Book B", [edited(SHARED), paragraph(3)])
+    stats = index.index_files([b])
+
+    assert stats["duplicates"] == 1
+    [alias] = aliases(index, b)
+    assert alias["dup_of"] in {c["id"] for c in index.manifest.files[str(a)]["chunks"]}
+    assert index.duplicate_sources(alias["dup_of"]) == (str(b),)
+    assert_consistent(index)
+
+
+def test_editing_a_chunk_in_place_stores_the_new_version(library):
+    folder, index = library
+    a = write_book(folder, "Book A", [SHARED, paragraph(2)])
+    index.index_files([a])
+    old_ids = {c["id"] for c in index.manifest.files[str(a)]["chunks"]}
+
+    write_book(folder, "Book A", [edited(SHARED), paragraph(2)])
+    index.index_files([a])
+
+    assert aliases(index, a) == []
+    assert not old_ids.isdisjoint(stored_ids(index))
+    hits = index.keyword_search("Edited", sources=[str(a)])
+    assert [chunk_id for chunk_id, _ in hits] == [index.manifest.files[str(a)]["chunks"][0]["id"]]
+    assert_consistent(index)
+
+
+def test_removing_the_stored_copy_reindexes_its_aliases(library):
+    folder, index = library
+    a = write_book(folder, "Book A", [SHARED])
+    b = write_book(folder, "Book B", [edited(SHARED), paragraph(3)])
+    index.index_files([a])
+    index.index_files([b])
+    assert len(aliases(index, b)) == 1
+
+    a.unlink()
+    index.remove_sources([str(a)])
+
+    assert str(a) not in index.manifest.files
+    assert aliases(index, b) == []
+    assert index.keyword_search("Edited", sources=[str(b)])
+    assert_consistent(index)
+
+
+def test_renaming_the_stored_copy_keeps_aliases_resolvable(library):
+    folder, index = library
+    a = write_book(folder, "Book A", [SHARED, paragraph(2)])
+    b = write_book(folder, "Book B", [edited(SHARED)])
+    index.sync_directory(folder)
+    assert len(aliases(index, b)) == 1
+
+    renamed = a.rename(folder / "Book Renamed.md")
+    index.sync_directory(folder)
+
+    assert set(index.manifest.files) == {str(b), str(renamed)}
+    chunks = index.manifest.files[str(b)]["chunks"] + index.manifest.files[str(renamed)]["chunks"]
+    assert sum("dup_of" in c for c in chunks) == 1
+    assert_consistent(index)
@@ -0,0 +1,119 @@
+import json
+import re
+
+# --- Precompiled patterns ---
+# Everything clean_text strips, matched in one alternation
+ARTIFACTS_RE = re.compile(r"background-color:: \w+|==|[\*\_\[\]\(\)#-]")
+QUOTES_WORD_RE = re.compile(r"\bQuotes\b")
+DOUBLE_QUOTED_RE = re.compile(r'"([^"]+)"')
+BULLET_RE = re.compile(r"•\s*(.+?)(?=\n|$)")
+WHITESPACE_RE = re.compile(r"\s+")
+
+SKIP_PREFIXES = ("chapter", "section", "note")
+BAD_ENDINGS = (":", "-", "...")
+
+
+def clean_text(text):
+    """Clean text but preserve quotes."""
+    if not text or not isinstance(text, str):
+        return ""
+
+    if "## Quotes" in text:
+        return text
+
+    # One regex pass for the artifacts, then a C-level whitespace collapse
+    return " ".join(ARTIFACTS_RE.sub("", text).split())
+
+
+def format_content(content, width=80):
+    """Format text nicely with one quote per line."""
+    if not content:
+        return ""
+
+    # Remove unwanted artifacts
+    content = QUOTES_WORD_RE.sub("", clean_text(content))
+
+    # Split quotes into separate lines
+    quotes = DOUBLE_QUOTED_RE.findall(content)
+    if quotes:
+        cleaned_quotes = []
+        seen = set()
+        for q in quotes:
+            q = q.strip()
+            if q and q not in seen:
+                seen.add(q)
+                if not q.endswith((".", "!", "?")):
+                    q += "."
+                q = q[0].upper() + q[1:]
+                cleaned_quotes.append(q)
+        return "\n".join(cleaned_quotes)
+
+    # Fallback: split into paragraphs
+    paragraphs = [p.strip() for p in content.split("\n") if p.strip()]
+    lines = []
+    for para in paragraphs:
+        words = para.split()
+        line = []
+        for word in words:
+            if len(" ".join(line + [word])) <= width:
+                line.append(word)
+            else:
+                lines.append(" ".join(line))
+                line = [word]
+        if line:
+            lines.append(" ".join(line))
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def filter_quotes(quotes):
+    """Keep quotes that read like standalone insights."""
+    valid_quotes = []
+    for q in quotes:
+        q = q.strip()
+        words = q.split()
+
+        if (
+            (6 <= len(words) <= 40)
+            and not q.lower().startswith(SKIP_PREFIXES)
+            and not q.endswith(BAD_ENDINGS)
+            and not any(word.isupper() for word in words[:3])
+        ):
+            q = q.rstrip(",.;")
+            valid_quotes.append(q)
+
+    return valid_quotes
+
+
+def extract_and_filter_quotes(text):
+    """Extract and filter quotes from text."""
+    cleaned = clean_text(str(text))
+    if not cleaned:
+        return []
+    return filter_quotes(DOUBLE_QUOTED_RE.findall(cleaned) + BULLET_RE.findall(cleaned))
+
+
+def analyze_chunk(content):
+    """Clean a chunk once and return (word_count, quotes)."""
+    cleaned = clean_text(str(content))
+    if not cleaned:
+        return 0, []
+    quotes = filter_quotes(DOUBLE_QUOTED_RE.findall(cleaned) + BULLET_RE.findall(cleaned))
+    return len(cleaned.split()), quotes
+
+
+def annotate_chunk(doc):
+    """Store word count and quotes on a chunk so queries don't re-clean it."""
+    word_count, quotes = analyze_chunk(doc.page_content)
+    doc.metadata["word_count"] = word_count
+    # Chroma metadata values must be scalars
+    doc.metadata["quotes"] = json.dumps(quotes)
+    return doc
+
+
+def chunk_analysis(content, metadata):
+    """(word_count, quotes) from index-time metadata, computing it for older chunks."""
+    if metadata and "word_count" in metadata and "quotes" in metadata:
+        return metadata["word_count"], json.loads(metadata["quotes"])
+    return analyze_chunk(content)
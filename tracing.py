@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import TRACE_LOG
+
+_log_lock = threading.Lock()
+
+
+class Trace:
+    """Wall time and item counts per named stage of one operation.
+
+    Finished traces are appended to the JSONL file named by
+    ``INSIGHTMINER_TRACE_LOG`` when it is set.
+    """
+
+    def __init__(self, name="", **meta):
+        self.name = name
+        self.meta = meta
+        self.stages = {}  # stage -> {"seconds": float, "items": int}
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    @classmethod
+    def from_dict(cls, record):
+        """Rebuild a finished trace from ``as_dict()`` output, e.g. sent by the query server."""
+        trace = cls(record.get("name", ""), **record.get("meta", {}))
+        trace.stages = {name: dict(entry) for name, entry in record.get("stages", {}).items()}
+        trace.elapsed = record.get("total_seconds", 0.0)
+        return trace
+
+    @contextmanager
+    def stage(self, name, items=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, items or 0)
+
+    def add(self, name, seconds=0.0, items=0):
+        entry = self.stages.setdefault(name, {"seconds": 0.0, "items": 0})
+        entry["seconds"] += seconds
+        entry["items"] += items
+
+    def count(self, name, items):
+        """Attach an item count to a stage after the fact."""
+        self.add(name, 0.0, items)
+
+    def finish(self, log_path=TRACE_LOG):
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started
+            if log_path:
+                write_log(self, log_path)
+        return self
+
+    @property
+    def total(self):
+        return self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+
+    def seconds(self):
+        return {name: entry["seconds"] for name, entry in self.stages.items()}
+
+    def rows(self):
+        """One dict per stage, slowest first, for tables."""
+        return [
+            {"stage": name, "ms": round(entry["seconds"] * 1000, 2), "items": entry["items"]}
+            for name, entry in sorted(self.stages.items(), key=lambda kv: -kv[1]["seconds"])
+        ]
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "meta": self.meta,
+            "total_seconds": self.total,
+            "stages": self.stages,
+        }
+
+    def describe(self):
+        lines = [f"⏱️ {self.name or 'trace'}: {self.total * 1000:.1f} ms"]
+        if "rerank_path" in self.meta:
+            lines[0] += f" ({self.meta['rerank_path']} rerank)"
+        if "semantic_match" in self.meta:
+            match = self.meta["semantic_match"]
+            lines.append(f"  reused candidates of {match['query']!r} (similarity {match['similarity']:.2f})")
+        for row in self.rows():
+            items = f" ({row['items']} items)" if row["items"] else ""
+            lines.append(f"  {row['stage']:<18} {row['ms']:9.2f} ms{items}")
+        return "\n".join(lines)
+
+
+def write_log(trace, path):
+    record = {"timestamp": datetime.now(timezone.utc).isoformat(), **trace.as_dict()}
+    try:
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write trace log {path}: {e}")
@@ -0,0 +1,205 @@
+import threading
+import time
+from pathlib import Path
+
+from config import HIGHLIGHTS_DIR, WATCH_DEBOUNCE, WATCH_MAX_DELAY
+from libraries import configured_libraries
+
+
+class LibraryWatcher:
+    """Re-indexes markdown files in `directory` shortly after they change.
+
+    Events are collected until the folder has been quiet for `debounce`
+    seconds (or `max_delay` has passed since the first one), then applied
+    as one batch on a background thread: changed files go through
+    add_documents_from_files, deleted ones are removed, and a rename is
+    both. Paths are recorded the way the index stores them, relative to
+    their library's folder, and a folder that is created, moved or deleted
+    counts as each markdown file in it. A batch that fails is retried with
+    the next one. Lag is the time from a batch's first event to it being
+    indexed.
+    """
+
+    def __init__(self, engine=None, directory=HIGHLIGHTS_DIR, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY):
+        self.engine = engine
+        self.directory = str(directory)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.changed = set()
+        self.removed = set()
+        self.first_event = None
+        self.last_event = None
+        self.batches = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    def start(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                watcher.record(event.src_path, folder=event.is_directory)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.record(event.src_path)
+
+            def on_deleted(self, event):
+                watcher.record(event.src_path, removed=True, folder=event.is_directory)
+
+            def on_moved(self, event):
+                watcher.record(event.src_path, removed=True, folder=event.is_directory)
+                watcher.record(event.dest_path, folder=event.is_directory)
+
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.directory, recursive=True)
+        self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+        print(f"👀 Watching {self.directory} (debounce {self.debounce:.1f}s)")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _engine(self):
+        if self.engine is None:
+            import data
+
+            self.engine = data.SearchEngine.get()
+        return self.engine
+
+    def _source(self, path):
+        """`path` as its library's index names it; unchanged outside every library."""
+        for library in self._libraries():
+            if library.owns(path):
+                return library.source(path)
+        return str(Path(path))
+
+    def _libraries(self):
+        if self.engine is not None:
+            return self.engine.libraries.values()
+        return configured_libraries().values()
+
+    def record(self, path, removed=False, folder=False):
+        """Note a change to `path`, or to every markdown file in it when `folder`; other paths are ignored."""
+        if folder:
+            if removed:
+                paths = self._engine().indexed_sources(path)
+            else:
+                paths = [str(p) for p in Path(path).glob("**/*.md")]
+        else:
+            paths = [path] if str(path).endswith(".md") else []
+        if not paths:
+            return
+        paths = [self._source(p) for p in paths]
+        now = time.monotonic()
+        with self._lock:
+            for path in paths:
+                if removed:
+                    self.changed.discard(path)
+                    self.removed.add(path)
+                else:
+                    self.removed.discard(path)
+                    self.changed.add(path)
+            self.first_event = self.first_event or now
+            self.last_event = now
+        self._wake.set()
+
+    def _due(self):
+        """Seconds until the pending batch should run, or None when nothing is pending."""
+        with self._lock:
+            if self.first_event is None:
+                return None
+            now = time.monotonic()
+            return max(0.0, min(self.last_event + self.debounce, self.first_event + self.max_delay) - now)
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self._due()
+            self._wake.wait(wait)
+            self._wake.clear()
+            if self._due() == 0.0:
+                self.flush()
+
+    def flush(self):
+        """Index everything recorded so far."""
+        with self._lock:
+            changed, removed, first = self.changed, self.removed, self.first_event
+            self.changed, self.removed, self.first_event, self.last_event = set(), set(), None, None
+        if first is None:
+            return
+
+        engine = self._engine()
+        # A file may have vanished again after its last event
+        existing = sorted(p for p in changed if Path(p).exists())
+        removed = sorted(removed | (changed - set(existing)))
+        try:
+            if removed:
+                engine.remove_documents(removed)
+            if existing:
+                engine.add_documents_from_files(existing)
+        except Exception as e:
+            print(f"❌ Watch update failed, retrying with the next batch: {e}")
+            now = time.monotonic()
+            with self._lock:
+                # Events recorded meanwhile are newer, so they win
+                self.changed.update(set(existing) - self.removed)
+                self.removed.update(set(removed) - self.changed)
+                self.first_event = self.first_event or now
+                self.last_event = now
+            self._wake.set()
+            return
+
+        lag = time.monotonic() - first
+        self.batches += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        print(f"🔁 {len(existing)} changed, {len(removed)} removed; index lag {lag:.1f}s")
+
+    def status(self):
+        with self._lock:
+            pending = len(self.changed) + len(self.removed)
+            waiting = time.monotonic() - self.first_event if self.first_event else 0.0
+        return {
+            "pending": pending,
+            "waiting_seconds": waiting,
+            "batches": self.batches,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+
+def watch(directories=(HIGHLIGHTS_DIR,)):
+    """Sync the index once, then keep it in step with `directories` until interrupted."""
+    import data
+
+    if isinstance(directories, str):
+        directories = [directories]
+    engine = data.SearchEngine.get()
+    engine.rebuild()
+    watchers = [LibraryWatcher(engine, directory).start() for directory in directories]
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("👋 Stopping watcher...")
+    finally:
+        for watcher in watchers:
+            watcher.stop()